@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 
 import argparse
+import gzip
+import heapq
+import multiprocessing
+import os
 import re
 import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import Enum
-from typing import NamedTuple, List
+from functools import partial
+from typing import NamedTuple, List, Iterator, Iterable
 from time import localtime, strftime
 
-from Bio.Blast.Applications import NcbiblastpCommandline, NcbiblastxCommandline
 from Bio.SeqRecord import SeqRecord
+from Bio.Seq import Seq
 from Bio import SeqIO
+import numpy
+
+from . import genome_index, blast_cache, blast_search, hit_cache, pipeline, region_table, interval_index, search_engines
 
 # This try block was added to stop a circular import error that occurs when this module is called from reannotate.py
 try:
@@ -37,6 +47,7 @@ RegionInfo = NamedTuple('RegionInfo', [('contig', str),
                                        ('query', str),
                                        ('start', int),
                                        ('end', int),
+                                       ('query_length', int),
                                        ('strand', str),
                                        ('hits', List[BlastHit]),
                                        ('note', str),
@@ -44,23 +55,48 @@ RegionInfo = NamedTuple('RegionInfo', [('contig', str),
 
 
 # A collection of regions (ORFs and intergenic regions) on the same contig.
-Contig = NamedTuple('Contig', [('regions', List[RegionInfo]),
+# Regions are stored column by column in a RegionTable (see region_table.py).
+Contig = NamedTuple('Contig', [('regions', region_table.RegionTable),
                                ('name', str),
                                ('number', int)])
 
-# Global dictionary, which will be called to write the log file
-StatisticsDict = {
-                    'BlastpFilename': '',
-                    'BlastxFilename': '',
-                    'NumberOfContigs': 0,
-                    'ProteomeOrfs': 0,
-                    'FragmentedOrfs': 0,
-                    'PseudogenesTotal': 0,
-                    'PseudogenesShort': 0,
-                    'PseudogenesFragmented': 0,
-                    'PseudogenesIntergenic': 0,
-                    'OutputFiles': []
-                  }
+# Splits the "# Query:" header line of a blast file into its fields.
+# example: "# Query: COGCCIIJ_00001 COGCCIIJ_1 [115:223](+)" -> "['#', 'Query', 'COGCCIIJ_00001', 'COGCCIIJ_1', '115', '223', '+']"
+QUERY_HEADER_SPLIT = re.compile("\s|(?<=[0-9])-|\[|\]|:|\(|\)")
+
+# Arguments and contigs of the current run, set in every worker process by init_contig_worker()
+WorkerContigs = None
+
+
+class RunStats:
+    """Statistics of a single annotate/reannotate run, which are reported in the log file.
+    Each run counts into its own RunStats, that is passed along the pipeline. Contigs that are checked separately
+    (ie. in other processes) are counted into separate RunStats, and merged into the statistics of the run."""
+
+    def __init__(self):
+        self.proteome_orfs = 0
+        self.number_of_contigs = 0
+        self.fragmented_orfs = 0
+        self.pseudogenes_total = 0
+        self.pseudogenes_short = 0
+        self.pseudogenes_fragmented = 0
+        self.pseudogenes_intergenic = 0
+        self.blast_queries_cached = 0     # Queries whose BLAST results were found in the hit cache
+        self.blast_queries_duplicate = 0  # Queries with the same sequence as another query, that were not searched
+        self.blast_queries_searched = 0   # Queries that were sent to BLAST
+        self.blast_tiers = []             # [database, queries, queries resolved, seconds] of every --tier_databases tier
+        self.blast_seconds_saved = 0.0    # Estimated BLAST time saved by searching in tiers
+        self.blast_queries_escalated = 0  # Queries searched again with the full hitcap, see --adaptive_hitcap
+
+    def merge(self, other: 'RunStats') -> 'RunStats':
+        """Adds the counts of another RunStats to this one, and returns this one."""
+
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def functional_genes(self) -> int:
+        return self.proteome_orfs - self.fragmented_orfs - self.pseudogenes_short
 
 
 # Functions
@@ -84,8 +120,40 @@ def get_args():
     # Optional arguments
     optional = parser.add_argument_group('\033[1m' + 'Adjustable parameters' + '\033[0m')
 
-    optional.add_argument('-t', '--threads', default=4,
+    optional.add_argument('-t', '--threads', default=4, type=int,
                           help='Please provide total number of threads to use for blast, default is 4.')
+    optional.add_argument('-se', '--search_engine', default='blast', choices=sorted(search_engines.ENGINES),
+                          help='Program that searches the proteome and the intergenic regions against the database:\n'
+                               'blast (NCBI BLAST+, a BLAST database), diamond (DIAMOND, a DIAMOND database) or\n'
+                               'mock (a k-mer search against a protein fasta file, for testing without BLAST).\n'
+                               'Default is %(default)s.')
+    optional.add_argument('-bt', '--blast_threads', default=None, type=int,
+                          help='Number of threads of each BLAST process. If smaller than --threads, the queries are\n'
+                               'split into shards that run as --threads / --blast_threads BLAST processes at the\n'
+                               'same time. Default is the same as --threads (a single BLAST process).')
+    optional.add_argument('-br', '--blast_retries', default=2, type=int,
+                          help='Number of times a failed BLAST shard is run again. Default is %(default)s.')
+    optional.add_argument('-bto', '--blast_timeout', default=None, type=float,
+                          help='Seconds after which a BLAST shard is stopped and counts as failed (see --blast_retries).\n'
+                               'Default is no time limit.')
+    optional.add_argument('-ahc', '--adaptive_hitcap', default=None, type=int,
+                          help='Search every query with this smaller hitcap first, and search again with the full\n'
+                               'hitcap (--search_hitcap) only the queries that reached it. Default is to search every\n'
+                               'query with the full hitcap.')
+    optional.add_argument('-td', '--tier_databases', default=None, nargs='+',
+                          help='Smaller databases (ie. SwissProt) that are searched before --database, in this order.\n'
+                               'Only the queries that a database does not resolve are searched against the next one\n'
+                               '(see --tier_min_hits and --tier_margin). Default is to search --database only.')
+    optional.add_argument('-tmh', '--tier_min_hits', default=3, type=int,
+                          help='Number of hits an ORF or intergenic region needs in a --tier_databases database to be\n'
+                               'resolved by it. Default is %(default)s.')
+    optional.add_argument('-tm', '--tier_margin', default=0.1, type=float,
+                          help='How far from --length_pseudo the length ratio of an ORF must be to be resolved by one\n'
+                               'of the --tier_databases. Default is %(default)s.')
+    optional.add_argument('-ov', '--overlap', default=False, action='store_true',
+                          help='Check every contig for pseudogenes as soon as BLAST has finished all of its queries,\n'
+                               'while the other queries are still searched. Pseudogenes of finished contigs are\n'
+                               'written to [prefix]_pseudos.partial.gff and .partial.fasta until the run is done.')
     optional.add_argument('-i', '--intergenic_length', default=30, type=int,
                           help='Please provide length of intergenic regions to check, default is 30 bp.')
     optional.add_argument('-l', '--length_pseudo', default=0.65, type=float,
@@ -102,6 +170,15 @@ def get_args():
                           help='Maximum distance between two regions to consider joining them. Default is %(default)s.')
     optional.add_argument('-hc', '--hitcap', default=15, type=int,
                           help='Maximum number of allowed hits for BLAST. Default is %(default)s.\n')
+    optional.add_argument('-shc', '--search_hitcap', default=None, type=int,
+                          help='Maximum number of hits that BLAST actually searches for, if larger than --hitcap.\n'
+                               'Only the --hitcap hits with the lowest e-values are used here, but reannotate and\n'
+                               'visualize can then try any hitcap up to this one without running BLAST again.\n'
+                               'Default is the same as --hitcap.')
+    optional.add_argument('-si', '--search_intergenic_length', default=None, type=int,
+                          help='Length of the shortest intergenic regions that are blasted, if shorter than\n'
+                               '--intergenic_length. Works like --search_hitcap: reannotate and visualize can then\n'
+                               'try any intergenic length from this one up. Default is the same as --intergenic_length.')
     optional.add_argument('-ce', '--contig_ends', default=False, action='store_true',
                           help='Forces the program to include intergenic regions at contig ends. If not specified,\n the '
                                'program will ignore any sequence before the first ORF and after the last ORF on a contig.')
@@ -109,35 +186,50 @@ def get_args():
                           help='Number of BlastX hits needed to annotate an intergenic region as a pseudogene.\n'
                                'Calculated as a percentage of maximum number of allowed hits (--hitcap).\n'
                                'Default is %(default)s.')
+    optional.add_argument('-w', '--workers', default=1, type=int,
+                          help='Number of processes used to check contigs for pseudogenes after BLAST (or while BLAST\n'
+                               'is running, with --overlap). Default is %(default)s.')
+    optional.add_argument('-rs', '--restart', default=False, action='store_true',
+                          help='Run every stage again. By default, stages whose outputs are still up to date\n'
+                               '(see [prefix]_manifest.json) are skipped, so an interrupted run resumes where it stopped.')
 
     # parse_known_args will create a tuple of known arguments in the first position and unknown in the second.
     # We only care about the known arguments, so we take [0].
     args = parser.parse_known_args()[0]
 
+    if args.search_hitcap is None:
+        args.search_hitcap = args.hitcap
+    if args.search_intergenic_length is None:
+        args.search_intergenic_length = args.intergenic_length
+    if args.search_hitcap < args.hitcap or args.search_intergenic_length > args.intergenic_length:
+        parser.error("--search_hitcap cannot be smaller than --hitcap, "
+                     "and --search_intergenic_length cannot be larger than --intergenic_length.")
+    if args.adaptive_hitcap is not None and not 0 < args.adaptive_hitcap < args.search_hitcap:
+        parser.error("--adaptive_hitcap must be between 0 and --search_hitcap.")
+    if args.adaptive_hitcap is not None and args.tier_databases:
+        parser.error("--adaptive_hitcap cannot be combined with --tier_databases.")
+
     return args
 
 
-def get_proteome(args, out_faa: str) -> None:
-    """Parse genbank input file for coding sequences (CDSs) and write them to the output file with coordinates."""
+def get_proteome(genome: genome_index.GenomeIndex, out_faa: str) -> None:
+    """Write all coding sequences (CDSs) from the genome index to the output file with coordinates."""
 
-    with open(args.genome, "r") as input_handle:
-        with open(out_faa, "w") as output_handle:
-            for seq_record in SeqIO.parse(input_handle, "genbank"):
-                for seq_feature in seq_record.features:
-                    if seq_feature.type == "CDS":
-                        assert len(seq_feature.qualifiers['translation']) == 1
-                        output_handle.write(">%s %s %s\n%s\n" % (seq_feature.qualifiers['locus_tag'][0],
-                                                                 seq_record.name,
-                                                                 seq_feature.location,
-                                                                 seq_feature.qualifiers['translation'][0]))
+    with open(out_faa, "w") as output_handle:
+        for contig in genome.contigs:
+            for cds in contig.cds:
+                output_handle.write(">%s %s %s\n%s\n" % (cds.locus_tag,
+                                                         contig.name,
+                                                         cds.location,
+                                                         cds.translation))
 
     print('%s\tProteome extracted from:\t\t%s\n'
-          '\t\t\tWritten to file:\t\t\t%s.' % (current_time(), args.genome, out_faa,)),
+          '\t\t\tWritten to file:\t\t\t%s.' % (current_time(), genome.filename, out_faa,)),
     sys.stdout.flush()
 
 
-def get_intergenic_regions(args, out_fasta: str) -> None:
-    """Parse genbank input file for intergenic regions and write them to the output file with coordinates.
+def get_intergenic_regions(args, genome: genome_index.GenomeIndex, out_fasta: str) -> None:
+    """Collect intergenic regions from the genome index and write them to the output file with coordinates.
 
     Copied/modified from "get_interregions" by Iddo Friedberg & Ian MC Fleming
     Released under Biopython license. http://www.biopython.org/DIST/LICENSE
@@ -147,23 +239,18 @@ def get_intergenic_regions(args, out_fasta: str) -> None:
     # Resets 'fasta' if it contains content already
     open(out_fasta, 'w').close()
 
-    # Parse all contigs in the multicontig genbank
-    for contig in SeqIO.parse(args.genome, "genbank"):  # contig = all information for an entire contig
-        gene_list = []  # List of coding regions extracted from genbank file.
+    # Loop over all contigs in the multicontig genbank
+    for contig in genome.contigs:  # contig = all information for an entire contig
+        # List of coding regions extracted from genbank file. Only present if prokka was run with --compliant flag
+        gene_list = [(gene.start, gene.end) for gene in contig.genes]
         intergenic_records = []  # List of intergenic regions that has been extracted from in between coding regions.
-        
-        for feature in contig.features:  # Loop over the contig, get the gene features on each of the strands
-            if feature.type == "gene":  # Only present if prokka was run with --compliant flag
-                start_position = feature.location._start.position
-                end_position = feature.location._end.position
-                gene_list.append((start_position, end_position))
 
         if args.contig_ends is True:
             # Put 'gene' at the start of the contig (position 0). This will force the next 'for loop' 
             # to consider intergenic space between position '0' and the beginning of the first gene.
             gene_list.insert(0, (0, 0))
 
-            contig_end = len(contig.seq)  # Apparently this is the fastest way to retrieve the end of a contig
+            contig_end = contig.length
             # Append a 'gene' the end of the contig. This will force the next 'for loop' to consider 
             # intergenic space between the last gene and the end of the contig.
             gene_list.append((contig_end, contig_end))
@@ -172,9 +259,9 @@ def get_intergenic_regions(args, out_fasta: str) -> None:
             last_end = gene_list[i - 1][1]
             this_start = gene_list[i][0]
 
-            if this_start - last_end >= args.intergenic_length:  # Default 30bp.
+            if this_start - last_end >= args.search_intergenic_length:  # Default 30bp.
 
-                intergenic_region = SeqRecord(seq=contig.seq[last_end:this_start],        # Nucleotide sequence in range
+                intergenic_region = SeqRecord(seq=Seq(str(contig.seq[last_end:this_start])),  # Nucleotides in range
                                               id="%s_ign_%d" % (contig.name, i),          # Individual ID
                                               description="%s %d-%d %s" % (contig.name,   # Description including name,
                                                                            last_end + 1,  # start position
@@ -187,44 +274,139 @@ def get_intergenic_regions(args, out_fasta: str) -> None:
         SeqIO.write(intergenic_records, open(out_fasta, "a"), "fasta")
 
     print('%s\tIntergenic regions extracted from:\t%s\n'
-          '\t\t\tWritten to file:\t\t\t%s.' % (current_time(), args.genome, out_fasta,)),
+          '\t\t\tWritten to file:\t\t\t%s.' % (current_time(), genome.filename, out_fasta,)),
     sys.stdout.flush()
 
 
-def run_blastp(args, in_faa: str, out_tsv: str) -> None:
-    """"Run BLASTP with FAA file against DB of your choice."""
+def run_blast(args, in_faa: str, in_fasta: str, blastp_out: str, blastx_out: str, on_blocks=None) -> dict:
+    """Run BLASTP with FAA file and BLASTX with FASTA file against DB of your choice, at the same time, with the
+    program chosen with --search_engine (see search_engines.py). Both are split into shards that run as separate
+    BLAST processes, within --threads threads (see blast_search.py).
+    Queries that were searched before with the same settings are taken from the hit cache (see hit_cache.py).
+    on_blocks is given the results of the queries as soon as they are known (see blast_search.run_searches).
+    Returns the number of queries that were found in the cache, duplicated or searched, as RunStats attributes."""
+
+    threads_per_search = min(args.threads, args.blast_threads or args.threads)
+
+    print('%s\tBlastP and BlastX executed with %s as %s processes with %s threads each.' % (
+        current_time(), args.search_engine, max(1, args.threads // threads_per_search), threads_per_search)),
+    sys.stdout.flush()
 
-    print('%s\tBlastP executed with %s threads.' % (current_time(), args.threads)),
+    engine = search_engines.ENGINES[args.search_engine]
+    databases = (args.tier_databases or []) + [args.database]
+    tiers = [blast_searches(args, engine, database, args.search_hitcap, in_faa, in_fasta, blastp_out, blastx_out)
+             for database in databases]  # BlastP and BlastX searches of every database
+    escalated = 0
+
+    cache = hit_cache.open_hit_cache()  # None if the cache is disabled
+    if len(tiers) == 1 and args.adaptive_hitcap is not None:
+        first_pass = blast_searches(args, engine, args.database, args.adaptive_hitcap, in_faa, in_fasta, blastp_out,
+                                    blastx_out)
+        first_counts, full_counts, searched_again = blast_search.run_adaptive_searches(
+            first_pass, tiers[0], first_hitcap=args.adaptive_hitcap, threads=args.threads,
+            threads_per_search=threads_per_search, retries=args.blast_retries, cache=cache, on_blocks=on_blocks,
+            timeout=args.blast_timeout)
+        # Queries that were searched again are counted in both passes
+        counts = [blast_search.QueryCounts(*numpy.add(first, full).tolist())
+                  for first, full in zip(first_counts, full_counts)]
+        escalated = sum(searched_again)
+        tier_results = []
+        for search, search_counts, query_number in zip(tiers[0], first_counts, searched_again):
+            print('%s\t%s: %s of %s queries searched again with hitcap %s after a first pass with hitcap %s.' % (
+                current_time(), search.name, query_number, sum(search_counts), args.search_hitcap,
+                args.adaptive_hitcap))
+    elif len(tiers) == 1:
+        counts = blast_search.run_searches(tiers[0], threads=args.threads, threads_per_search=threads_per_search,
+                                           retries=args.blast_retries, cache=cache, on_blocks=on_blocks,
+                                           timeout=args.blast_timeout)
+        tier_results = []
+    else:
+        tier_results = blast_search.run_tiered_searches(tiers, resolved=partial(tier_resolved, args),
+                                                        threads=args.threads, threads_per_search=threads_per_search,
+                                                        retries=args.blast_retries, cache=cache, on_blocks=on_blocks,
+                                                        timeout=args.blast_timeout)
+        # Queries that went on to later tiers are counted once in every tier
+        counts = [blast_search.QueryCounts(*numpy.sum([tier.counts[number] for tier in tier_results], axis=0).tolist())
+                  for number in range(len(tiers[0]))]
+    if cache is not None:
+        cache.close()
+
+    for search, query_counts in zip(tiers[0], counts):
+        print('%s\t%s: %s queries found in the hit cache, %s identical to another query, %s searched.' % (
+            current_time(), search.name, query_counts.cached, query_counts.duplicate, query_counts.searched))
+
+    for database, tier in zip(databases, tier_results):
+        print('%s\tDatabase %s: %s queries, %s resolved, in %.1f seconds.' % (
+            current_time(), database, tier.queries, tier.resolved_queries, tier.seconds))
+    seconds_saved = blast_search.seconds_saved(tier_results)
+    if tier_results:
+        print('%s\tEstimated BLAST time saved by searching in tiers: %.1f seconds.' % (current_time(), seconds_saved))
     sys.stdout.flush()
 
-    blastp_cline = NcbiblastpCommandline(query=in_faa,
-                                         num_threads=args.threads,
-                                         db=args.database,
-                                         max_target_seqs=args.hitcap,
-                                         max_hsps=1,
-                                         evalue=args.evalue,
-                                         outfmt="\'7 qseqid sseqid pident length mismatch gapopen qstart qend "
-                                                "sstart send slen evalue bitscore frames stitle\'",
-                                         out=out_tsv)
-    blastp_cline()
+    return {'blast_queries_cached': sum(query_counts.cached for query_counts in counts),
+            'blast_queries_duplicate': sum(query_counts.duplicate for query_counts in counts),
+            'blast_queries_searched': sum(query_counts.searched for query_counts in counts),
+            'blast_tiers': [[database, tier.queries, tier.resolved_queries, tier.seconds]
+                            for database, tier in zip(databases, tier_results)],
+            'blast_seconds_saved': seconds_saved,
+            'blast_queries_escalated': escalated}
+
+
+def blast_searches(args, engine: search_engines.SearchEngine, database: str, hitcap: int, in_faa: str, in_fasta: str,
+                   blastp_out: str, blastx_out: str) -> List[blast_search.Search]:
+    """The BlastP and BlastX searches of the proteome and the intergenic regions against a database."""
+
+    searches = []
+    for name, program, query, out in (('BlastP', 'blastp', in_faa, blastp_out),
+                                      ('BlastX', 'blastx', in_fasta, blastx_out)):
+        finish = partial(engine.finish, program, database=database) if engine.finish is not None else None
+        settings = hit_cache.search_settings(program=search_engines.program_name(engine, program),
+                                             database=database, evalue=args.evalue, hitcap=hitcap)
+        searches.append(blast_search.Search(name=name, query=query, out=out,
+                                            command=partial(engine.command, args, database, hitcap, program),
+                                            finish=finish, settings=settings))
+
+    return searches
+
+
+def tier_resolved(args, search: blast_search.Search, blocks: List[str]) -> List[bool]:
+    """Whether the BLAST results of each query (its block) are enough to decide it, so that it does not have to be
+    searched against the next of the --tier_databases (see blast_search.run_tiered_searches):
+        *ORFs with at least --tier_min_hits hits, whose length ratio is at least --tier_margin away from
+         --length_pseudo, are clearly either too short or not.
+        *Intergenic regions with enough hits to pass --intergenic_threshold (and --tier_min_hits) are pseudogene
+         candidates, and more hits in a larger database would not change that. Regions shorter than
+         --intergenic_length are never checked, so they are resolved as well.
+    Only the --hitcap hits with the lowest e-values are counted, like limit_to_settings()."""
+
+    lines = (line for block in blocks for line in block.splitlines(keepends=True))
+    lori = regions_to_table(iterate_blast_lines(lines=lines, blast_format=search.name))
+    if (lori.hit_counts() > args.hitcap).any():
+        lori = region_table.best_hits(lori, hitcap=args.hitcap)
+    number_of_hits = lori.hit_counts()
+
+    if search.name == 'BlastP':
+        resolved = numpy.zeros(len(lori), dtype=bool)
+        rows, ratio = orf_length_ratios(lori)
+        resolved[rows] = (number_of_hits[rows] >= args.tier_min_hits) & (
+            numpy.abs(ratio - args.length_pseudo) >= args.tier_margin)
+    else:
+        resolved = ((lori.query_length < args.intergenic_length) |
+                    (number_of_hits >= max(args.tier_min_hits, args.intergenic_threshold * args.hitcap)))
+
+    return resolved.tolist()
 
 
-def run_blastx(args, in_fasta: str, out_tsv: str) -> None:
-    """Run BLASTX with FASTA file against DB of your choice."""
+def open_blast_file(filename: str):
+    """Opens a blast output file for reading as text. Gzip-compressed files are detected and decompressed on the fly."""
 
-    print('%s\tBlastX executed with %s threads.' % (current_time(), args.threads)),
-    sys.stdout.flush()
+    with open(filename, 'rb') as raw_file:
+        compressed = raw_file.read(2) == b'\x1f\x8b'  # gzip magic number
 
-    blastx_cline = NcbiblastxCommandline(query=in_fasta,
-                                         num_threads=args.threads,
-                                         db=args.database,
-                                         max_target_seqs=args.hitcap,
-                                         max_hsps=1,
-                                         evalue=args.evalue,
-                                         outfmt="\'7 qseqid sseqid pident length mismatch gapopen qstart qend "
-                                                "sstart send slen evalue bitscore frames stitle\'",
-                                         out=out_tsv)
-    blastx_cline()
+    if compressed:
+        return gzip.open(filename, 'rt')
+    else:
+        return open(filename, 'r')
 
 
 def collect_query_ids(filename: str) -> List[str]:
@@ -232,11 +414,9 @@ def collect_query_ids(filename: str) -> List[str]:
 
     loq = []  # list of Query names
 
-    with open(filename) as tsvfile:
-        lines = tsvfile.readlines()
-
-        for line in lines:
-            if re.match("^# Query:", line):
+    with open_blast_file(filename) as tsvfile:
+        for line in tsvfile:
+            if line.startswith("# Query:"):
                 fields_in_line = list(filter(None, re.split("\s|\[|\]|:|\(|\)", line)))
                 query = fields_in_line[2]
                 loq.append(query)
@@ -244,95 +424,139 @@ def collect_query_ids(filename: str) -> List[str]:
     return loq
 
 
-def parse_blast(filename: str, blast_format: str) -> List[RegionInfo]:
-    """This function needs to take a blast query and extract the relevant information (RegionInfo)."""
+def parse_blast(filename: str, blast_format: str, stats: RunStats) -> region_table.RegionTable:
+    """This function needs to take a blast file and extract the relevant information of every query (RegionTable)."""
 
     print('%s\tExtracting information from %s file.' % (current_time(), blast_format)),
     sys.stdout.flush()
 
-    query_dict = {}  # Dictionary of information relating to each query
-    region_list = []  # the final list of regions
-
-    with open(filename, 'r') as tsvfile:
-        lines = tsvfile.readlines()
+    # Parsed results are cached, so reannotating with the same blast file does not have to parse it again
+    region_list = blast_cache.cached_parse(filename=filename, blast_format=blast_format, parser=build_region_table)
 
-        # This will soon be replaced by an actual query, just have to get past the first line
-        query = "Placeholder query that wont matching anything because it's way too long"
+    # If you're parsing a BlastP file, keep track of how many ORFs are in the file
+    if blast_format == "BlastP":
+        stats.proteome_orfs += len(region_list)
 
-        for line_number, line in enumerate(lines):
-            # matching line example: "# Query: COGCCIIJ_00001 COGCCIIJ_1 [115:223](+)"
-            if re.match("^# Query:", line):
-                # fields_in_line splits all fields and filters unintentional whitespace
-                # example: "['#', 'Query', 'COGCCIIJ_00001', 'COGCCIIJ_1', '115', '223', '+']"
-                fields_in_line = list(filter(None, re.split("\s|(?<=[0-9])-|\[|\]|:|\(|\)", line)))
+    return region_list
 
-                query = fields_in_line[2]  # the query that is currently being looked at
 
-                # collect contig, start, end, strand from fields, add to dictionary
-                query_dict[query] = {'contig': fields_in_line[3],
-                                     'query': fields_in_line[2],
-                                     'start': int(fields_in_line[4])+1,
-                                     'end': int(fields_in_line[5]),
-                                     'strand': fields_in_line[6],
-                                     'hits': []}
+def build_region_table(filename: str, blast_format: str) -> region_table.RegionTable:
+    """Reads all queries of a blast file into a RegionTable."""
+    return regions_to_table(iterate_blast(filename=filename, blast_format=blast_format))
 
-                # If you're parsing a BlastP file, keep track of how many ORFs are in the file
-                if blast_format == "BlastP":
-                    StatisticsDict['ProteomeOrfs'] += 1
-                else:
-                    pass
 
-            # Matches the current query at the front of the line
-            # match example: "COGCCIIJ_00002	sp|P86052|CYC4_THIRO	47.929	169	81	5	61	225	25	190	192	1.33e-40	140"
-            elif re.match("^%s" % query, line):
-                # fields_in_line acts the same as above
-                # example: "['COGCCIIJ_00002', 'sp|P86052|CYC4_THIRO', '47.929', '169', '81', '5', '61', '225', '25', '190', '192', '1.33e-40', '140']"
-                fields_in_line = list(filter(None, re.split("\s|\[|\]|:|\(|\)", line)))
+def regions_to_table(regions: Iterable[RegionInfo]) -> region_table.RegionTable:
+    """Collects RegionInfo into a RegionTable, in the same order."""
 
-                # This try/catch is needed to prevent getting an error from trying
-                # to append to a dictionary key that does not exist.
-                try:
-                    query_dict[query]['hits']  # Check if the list exists
-                except KeyError:
-                    query_dict[query]['hits'] = []  # If it does not, make it an empty list
-
-                # Append hit info to list
-                query_dict[query]['hits'].append(BlastHit(accession=fields_in_line[1],
-                                                          slen=int(fields_in_line[10])*3,
-                                                          s_start=int(fields_in_line[6]),
-                                                          s_end=int(fields_in_line[7]),
-                                                          eval=float(fields_in_line[11])))
-
-    # Once all lines have been checked, write the results to a final list in the form of RegionInfo
-    for key in query_dict:
-        if blast_format == "BlastP":
-            region_list.append(RegionInfo(contig=query_dict[key]['contig'],
-                                          query=query_dict[key]['query'],
-                                          start=(query_dict[key]['start']),
-                                          end=(query_dict[key]['end']),
-                                          strand=query_dict[key]['strand'],
-                                          hits=query_dict[key]['hits'],
-                                          note='From BlastP;colour=51 153 102',
-                                          region_type=RegionType.ORF))
-
-        # Have to modify range for intergenic regions
-        if blast_format == "BlastX":
-            try:  # retrieve actual intergenic range based on blast hits
-                region_start, region_end = get_intergenic_query_range(query_dict[key]['hits'], query_dict[key]['start'])
-
-            except ValueError:  # If there are no blast hits, this region will not be considered
-                region_start, region_end = (0, 0)
-
-            region_list.append(RegionInfo(contig=query_dict[key]['contig'],
-                                          query=query_dict[key]['query'],
-                                          start=region_start,
-                                          end=region_end,
-                                          strand=query_dict[key]['strand'],
-                                          hits=query_dict[key]['hits'],
-                                          note='From BlastX',
-                                          region_type=RegionType.intergenic))
+    builder = region_table.RegionTableBuilder()
 
-    return region_list
+    for region in regions:
+        builder.add_region(contig=region.contig,
+                           query=region.query,
+                           start=region.start,
+                           end=region.end,
+                           query_length=region.query_length,
+                           strand=region.strand,
+                           region_type=region.region_type.value,
+                           note=region.note,
+                           hits=region.hits)
+
+    return builder.build()
+
+
+def iterate_blast(filename: str, blast_format: str) -> Iterator[RegionInfo]:
+    """Streams a blast file (outfmt 7) line by line and yields the RegionInfo of each query as soon as its block ends."""
+
+    with open_blast_file(filename) as tsvfile:
+        yield from iterate_blast_lines(lines=tsvfile, blast_format=blast_format)
+
+
+def iterate_blast_lines(lines: Iterable[str], blast_format: str) -> Iterator[RegionInfo]:
+    """Same as iterate_blast(), for the lines of blast output (outfmt 7) that are already in memory or still arriving."""
+
+    query_info = None  # Information relating to the query that is currently being read
+
+    for line in lines:
+        # matching line example: "# Query: COGCCIIJ_00001 COGCCIIJ_1 [115:223](+)"
+        if line.startswith("# Query:"):
+            # The previous query's block has ended, so it is complete
+            if query_info is not None:
+                yield make_region(query_info, blast_format)
+
+            # fields_in_line splits all fields and filters unintentional whitespace
+            # example: "['#', 'Query', 'COGCCIIJ_00001', 'COGCCIIJ_1', '115', '223', '+']"
+            fields_in_line = list(filter(None, QUERY_HEADER_SPLIT.split(line)))
+
+            # collect contig, start, end, strand from fields
+            query_info = {'contig': fields_in_line[3],
+                          'query': fields_in_line[2],
+                          'start': int(fields_in_line[4])+1,
+                          'end': int(fields_in_line[5]),
+                          'query_length': query_length_from_header(fields_in_line, blast_format),
+                          'strand': fields_in_line[6],
+                          'hits': []}
+
+        # Matches the current query at the front of the line
+        # match example: "COGCCIIJ_00002	sp|P86052|CYC4_THIRO	47.929	169	81	5	61	225	25	190	192	1.33e-40	140"
+        elif query_info is not None and line.startswith(query_info['query']):
+            # Hit lines are tab separated
+            # example: "['COGCCIIJ_00002', 'sp|P86052|CYC4_THIRO', '47.929', '169', '81', '5', '61', '225', '25', '190', '192', '1.33e-40', '140']"
+            fields_in_line = line.split('\t', 12)
+
+            # Append hit info to list
+            query_info['hits'].append(BlastHit(accession=fields_in_line[1],
+                                               slen=int(fields_in_line[10])*3,
+                                               s_start=int(fields_in_line[6]),
+                                               s_end=int(fields_in_line[7]),
+                                               eval=float(fields_in_line[11])))
+
+    # The last query is complete once there are no more lines
+    if query_info is not None:
+        yield make_region(query_info, blast_format)
+
+
+def make_region(query_info: dict, blast_format: str) -> RegionInfo:
+    """Converts the information collected for a single blast query into RegionInfo."""
+
+    if blast_format == "BlastP":
+        return RegionInfo(contig=query_info['contig'],
+                          query=query_info['query'],
+                          start=query_info['start'],
+                          end=query_info['end'],
+                          query_length=query_info['query_length'],
+                          strand=query_info['strand'],
+                          hits=query_info['hits'],
+                          note='From BlastP;colour=51 153 102',
+                          region_type=RegionType.ORF)
+
+    # Have to modify range for intergenic regions
+    elif blast_format == "BlastX":
+        try:  # retrieve actual intergenic range based on blast hits
+            region_start, region_end = get_intergenic_query_range(query_info['hits'], query_info['start'])
+
+        except ValueError:  # If there are no blast hits, this region will not be considered
+            region_start, region_end = (0, 0)
+
+        return RegionInfo(contig=query_info['contig'],
+                          query=query_info['query'],
+                          start=region_start,
+                          end=region_end,
+                          query_length=query_info['query_length'],
+                          strand=query_info['strand'],
+                          hits=query_info['hits'],
+                          note='From BlastX',
+                          region_type=RegionType.intergenic)
+
+
+def query_length_from_header(fields_in_line: List[str], blast_format: str) -> int:
+    """Length of a blasted sequence, from the range in its "# Query:" header.
+    Proteins are written with python-style ranges (ie. [114:223]) by get_proteome(), intergenic regions with
+    inclusive ranges (ie. 115-223) by get_intergenic_regions(). For intergenic regions, this is the length that
+    was compared with --intergenic_length."""
+
+    length = int(fields_in_line[5]) - int(fields_in_line[4])
+
+    return length + 1 if blast_format == "BlastX" else length
 
 
 def get_intergenic_query_range(lobh: List[BlastHit], start_position: int) -> tuple:
@@ -349,31 +573,78 @@ def get_intergenic_query_range(lobh: List[BlastHit], start_position: int) -> tup
     return region_start, region_end
 
 
-def split_regions_into_contigs(lori: List[RegionInfo]) -> List[Contig]:
-    """Takes a list of regions and splits them based on which contig it belongs to.
-    Contig is defined above as 'List[RegionInfo]', so 'List[Contig]' is a list of lists."""
+def limit_to_settings(args, lori: region_table.RegionTable) -> region_table.RegionTable:
+    """Reduces regions from blast files that were searched with a larger hitcap or a shorter intergenic length
+    (see --search_hitcap) to what a search with args.hitcap and args.intergenic_length would have returned:
+    intergenic regions that are too short are removed, and every region keeps the args.hitcap hits with the lowest
+    e-values. The range of an intergenic region depends on its hits (see get_intergenic_query_range), so it is
+    calculated again from the hits it keeps. The table is returned as it is if there is nothing to remove."""
 
-    # collects all contig names. Doesn't store duplicates, so a contig name will not be stored more than once.
-    contig_names = list(set([ri.contig for ri in lori]))
-    StatisticsDict['NumberOfContigs'] = len(contig_names)
-    contig_list = []  # this will store the output
+    too_short = (lori.region_type == RegionType.intergenic.value) & (lori.query_length < args.intergenic_length)
+    if too_short.any():
+        lori = lori.take(numpy.flatnonzero(~too_short))
+
+    if not (lori.hit_counts() > args.hitcap).any():
+        return lori
+
+    limited = region_table.best_hits(lori, hitcap=args.hitcap)
+
+    # Intergenic regions start at (start of the blasted sequence + first hit position), see get_intergenic_query_range
+    intergenic = (lori.region_type == RegionType.intergenic.value) & (lori.hit_counts() > 0)
+    old_first, old_last = hit_position_range(lori)
+    new_first, new_last = hit_position_range(limited)
+    sequence_start = lori.start - old_first
+    limited.start[intergenic] = (sequence_start + new_first)[intergenic]
+    limited.end[intergenic] = (sequence_start + new_last)[intergenic]
+
+    return limited
+
+
+def hit_position_range(lori: region_table.RegionTable) -> tuple:
+    """Lowest and highest s_start/s_end among the hits of every region, 0 for regions without hits."""
+
+    counts = lori.hit_counts()
+    has_hits = counts > 0
+    first = numpy.zeros(len(lori), dtype=numpy.int64)
+    last = numpy.zeros(len(lori), dtype=numpy.int64)
+
+    if has_hits.any():
+        hit_starts = lori.hits.s_start[lori.hit_index]
+        hit_ends = lori.hits.s_end[lori.hit_index]
+        # Regions without hits have no positions in hit_index, so the offsets of the others are enough for reduceat
+        offsets = lori.hit_offsets[:-1][has_hits]
+        first[has_hits] = numpy.minimum.reduceat(numpy.minimum(hit_starts, hit_ends), offsets)
+        last[has_hits] = numpy.maximum.reduceat(numpy.maximum(hit_starts, hit_ends), offsets)
+
+    return first, last
 
-    for contig_name in contig_names:
-        # Finds all numbers in the contig name (ie. '15' in EOKKIDHA_15) and returns them as a single integer
-        contig_number = int("".join(re.findall('\d', str(contig_name))))
-        regions_on_contig = []  # stores the List[RegionInfo] to be contained on a contig
 
-        for ri in lori:
-            if ri.contig == contig_name:  # if the region's contig name matches, it is added to that contig
-                regions_on_contig.append(ri)
+def split_regions_into_contigs(lori: region_table.RegionTable,
+                               genome: genome_index.GenomeIndex = None) -> List[Contig]:
+    """Takes a table of regions and splits it based on which contig each region belongs to.
+    Contig is defined above as a 'RegionTable' with a name, so 'List[Contig]' is a list of tables.
 
-        # once all regions have been added, that list of regions is appended as a 'Contig' to the list of contigs.
-        contig_list.append(Contig(regions=regions_on_contig, name=contig_name, number=contig_number))
+    Contigs are numbered in the order they appear in the genome. Contigs that are not in the genome (or all of them,
+    if no genome is given) are numbered after those, in the order they first appear in lori."""
+
+    # Position of every contig in the genbank file
+    genome_order = {} if genome is None else {contig.name: number for number, contig in enumerate(genome.contigs)}
+
+    # Rows of all regions on each contig, grouped in a single pass over the table
+    rows_by_contig = lori.rows_by_contig()
+    contig_list = []  # this will store the output
+
+    for contig_id, rows in rows_by_contig.items():
+        contig_name = lori.contig_names[contig_id]
+        contig_number = genome_order.get(contig_name, len(genome_order) + contig_id)
+
+        # once all regions have been selected, that table of regions is appended as a 'Contig' to the list of contigs.
+        contig_list.append(Contig(regions=lori.take(rows), name=contig_name, number=contig_number))
 
     return contig_list
 
 
-def annotate_pseudos(args, contig: Contig) -> Contig:
+def annotate_pseudos(args, contig: Contig, stats: RunStats) -> Contig:
     """
     This function will take input blast files and return a list of all pseudogene candidates.
     """
@@ -382,175 +653,181 @@ def annotate_pseudos(args, contig: Contig) -> Contig:
     individual_pseudos, intergenic_pseudos = check_individual_ORFs(args=args, lori=contig.regions)
 
     # 2: Update list of regions with any pseudogenes that were flagged from step #1.
-    updated_list = replace_pseudos_in_list(pseudos=individual_pseudos+intergenic_pseudos, regions=contig.regions)
+    updated_list = replace_pseudos_in_list(pseudos=region_table.concatenate([individual_pseudos, intergenic_pseudos]),
+                                           regions=contig.regions)
 
     # 3: Check adjacent regions to see if they could be pseudogene fragments.
-    #   This function returns two lists: [0] = Individual pseudogenes
-    #                                    [1] = Merged pseudogenes
-    all_pseudos = check_adjacent_regions(args=args, lori=updated_list)
+    #   This function returns two tables: [0] = Individual pseudogenes
+    #                                     [1] = Merged pseudogenes
+    all_pseudos = check_adjacent_regions(args=args, lori=updated_list, stats=stats)
 
-    final_regions = add_locus_tags(lori=(all_pseudos[0] + all_pseudos[1]), contig=contig.name)
+    final_regions = add_locus_tags(lori=region_table.concatenate([all_pseudos[0], all_pseudos[1]]), contig=contig.name)
 
-    # returns both individual and merged pseudogenes as a single list, with locus tags added.
+    # returns both individual and merged pseudogenes as a single table, with locus tags added.
     return Contig(regions=final_regions, name=contig.name, number=contig.number)
 
 
-def check_individual_ORFs(args, lori: List[RegionInfo]) -> tuple:
-    """This function will take an input of regions and return two lists:
-    [0]: a list of individual ORFs that could be pseudogenes.
-    [1]: a list of intergenic regions that could be pseudogenes."""
+def check_individual_ORFs(args, lori: region_table.RegionTable) -> tuple:
+    """This function will take an input of regions and return two tables:
+    [0]: ORFs that could be pseudogenes.
+    [1]: intergenic regions that could be pseudogenes."""
 
-    initial_blastp_list = []  # This list will contain all ORFs that have enough blast hits to be considered.
-    blastp_pseudos = []      # This list will contain the resulting pseudogenes
-    blastx_pseudos = []
+    # Include a blastx hit if it meets the minimum criteria defined by args.intergenic_threshold
+    # For example, if a blastx region has 5 blast hits, the blast hitcap is 15 hits, and the threshold is 0.20,
+    # the region will pass. ( 5/15 >= 0.2 ) is true.
+    intergenic_rows, hit_fraction = intergenic_hit_fractions(args, lori)
+    blastx_rows = intergenic_rows[hit_fraction >= args.intergenic_threshold]
 
-    for region in lori:
-        # Only include regions that were already as genes from whichever
-        # annotation software, and that have at least 2 blast hits.
-        if region.region_type == RegionType.ORF and len(region.hits) > 2:
-            initial_blastp_list.append(region)
+    # ratio of each ORF's length to the average length of its hits.
+    initial_blastp_rows, ratio = orf_length_ratios(lori)
 
-        # Include a blastx hit if it meets the minimum criteria defined by args.intergenic_threshold
-        # For example, if a blastx region has 5 blast hits, the blast hitcap is 15 hits, and the threshold is 0.20,
-        # the region will pass. ( 5/15 >= 0.2 ) is true.
-        elif region.region_type == RegionType.intergenic and len(region.hits)/args.hitcap >= args.intergenic_threshold:
-            pseudo = convert_region_to_pseudo(region=region,
-                                              ratio=None,  # this value is only used for BlastP-derived pseudos (below)
-                                              number_of_hits=len(region.hits))
-            blastx_pseudos.append(pseudo)
+    is_short = ratio < args.length_pseudo
+    blastp_pseudos = convert_region_to_pseudo(regions=lori,
+                                              rows=initial_blastp_rows[is_short],
+                                              ratios=ratio[is_short]*100)  # Multiplied by 100 to convert to percentage
+    blastx_pseudos = convert_region_to_pseudo(regions=lori,
+                                              rows=blastx_rows,
+                                              ratios=None)  # this value is only used for BlastP-derived pseudos
 
-    for region in initial_blastp_list:
+    return blastp_pseudos, blastx_pseudos
 
-        # Retrieves lengths of genes that this region has blasted against
-        list_of_database_lengths = [hit.slen for hit in region.hits]
 
-        # Calculates the average length of genes that this region has blasted against
-        average_database_length = sum(list_of_database_lengths) / len(list_of_database_lengths)
+def orf_length_ratios(lori: region_table.RegionTable) -> tuple:
+    """Returns the rows of the ORFs that can be checked for being too short, and the ratio of each one's length
+    to the average length of the genes it has blasted against. Does not depend on any setting."""
 
-        # Calculates the length of this region
-        region_length = region.end - region.start
+    number_of_hits = lori.hit_counts()
 
-        # ratio of the region's length to the average length of hits.
-        ratio = (region_length/average_database_length)
+    # Only include regions that were already as genes from whichever
+    # annotation software, and that have at least 2 blast hits.
+    initial_blastp_rows = numpy.flatnonzero((lori.region_type == RegionType.ORF.value) & (number_of_hits > 2))
 
-        if ratio < args.length_pseudo:
-            pseudo = convert_region_to_pseudo(region=region,
-                                              ratio=ratio*100,      # Multiplied by 100 to convert to percentage
-                                              number_of_hits=None)  # Not important for BlastP hits
-            blastp_pseudos.append(pseudo)
+    # Sums the lengths of genes that each region has blasted against
+    cumulative_database_lengths = numpy.zeros(len(lori.hit_index) + 1, dtype=numpy.int64)
+    numpy.cumsum(lori.hits.slen[lori.hit_index], out=cumulative_database_lengths[1:])
+    sum_of_database_lengths = (cumulative_database_lengths[lori.hit_offsets[1:]] -
+                               cumulative_database_lengths[lori.hit_offsets[:-1]])[initial_blastp_rows]
 
-    return blastp_pseudos, blastx_pseudos
+    # Calculates the average length of genes that these regions have blasted against
+    average_database_length = sum_of_database_lengths / number_of_hits[initial_blastp_rows]
 
+    # Calculates the length of these regions
+    region_length = lori.end[initial_blastp_rows] - lori.start[initial_blastp_rows]
 
-def convert_region_to_pseudo(region: RegionInfo, ratio: float, number_of_hits: int) -> RegionInfo:
-    """Flags a region as a pseudogene by adding a note, that will appear in the GFF file.
-    Regions must be explicitly rewritten because NamedTuples are immutable."""
+    return initial_blastp_rows, region_length/average_database_length
 
-    if region.region_type == RegionType.ORF:
-        message = 'Note=pseudogene candidate. ' \
-                  'Reason: ORF is %s%% of the average length of hits to this gene.;' \
-                  'colour=229 204 255' % (round(ratio, 1))  # 'colour=' makes this region appear coloured in Artemis.
-        pseudo_type = RegionType.shortpseudo
 
-    elif region.region_type == RegionType.intergenic:
-        message = 'Note=pseudogene candidate. ' \
-                  'Reason: Intergenic region with %s blast hits.;' \
-                  'colour=229 204 255' % number_of_hits  # 'colour=' makes this region appear coloured in Artemis.
-        pseudo_type = RegionType.intergenicpseudo
+def intergenic_hit_fractions(args, lori: region_table.RegionTable) -> tuple:
+    """Returns the rows of all intergenic regions, and their number of blast hits as a fraction of args.hitcap."""
 
-    pseudogene = RegionInfo(contig=region.contig,
-                            query=region.query,
-                            start=region.start,
-                            end=region.end,
-                            strand=region.strand,
-                            hits=region.hits,
-                            note=message,
-                            region_type=pseudo_type)
+    intergenic_rows = numpy.flatnonzero(lori.region_type == RegionType.intergenic.value)
 
-    return pseudogene
+    return intergenic_rows, lori.hit_counts()[intergenic_rows]/args.hitcap
 
 
-def replace_pseudos_in_list(pseudos: List[RegionInfo], regions: List[RegionInfo]) -> List[RegionInfo]:
-    """This function prevents duplicates of regions that would occur if a gene was
-    labelled and pseudogene and the original gene was not removed from the list."""
+def convert_region_to_pseudo(regions: region_table.RegionTable, rows: numpy.ndarray,
+                             ratios: numpy.ndarray) -> region_table.RegionTable:
+    """Flags regions as pseudogenes by adding a note, that will appear in the GFF file.
+    Returns a new table with the flagged regions, the original table is not modified."""
 
-    final_list = []
+    pseudogenes = regions.take(rows)
+    number_of_hits = pseudogenes.hit_counts().tolist()
 
-    for region in regions:
-        if pseudo_present(region, pseudos)[0]:  # if a pseudogene is present at the same position, write the pseudo
-            final_list.append(pseudo_present(region, pseudos)[1])
-        else:
-            final_list.append(region)  # if it is not, write the gene
+    for row, region_type in enumerate(pseudogenes.region_type.tolist()):
+        if region_type == RegionType.ORF.value:
+            message = 'Note=pseudogene candidate. ' \
+                      'Reason: ORF is %s%% of the average length of hits to this gene.;' \
+                      'colour=229 204 255' % (round(float(ratios[row]), 1))  # 'colour=' makes this region appear coloured in Artemis.
+            pseudo_type = RegionType.shortpseudo
 
-    return final_list
+        elif region_type == RegionType.intergenic.value:
+            message = 'Note=pseudogene candidate. ' \
+                      'Reason: Intergenic region with %s blast hits.;' \
+                      'colour=229 204 255' % number_of_hits[row]  # 'colour=' makes this region appear coloured in Artemis.
+            pseudo_type = RegionType.intergenicpseudo
 
+        pseudogenes.note[row] = message
+        pseudogenes.region_type[row] = pseudo_type.value
 
-def pseudo_present(region: RegionInfo, pseudos: List[RegionInfo]) -> tuple:
-    """Takes a particular gene and checks if that gene has been flagged as a pseudogene.
-    Returns two pieces of information.
-    0. If a pseudogene has been annotated at this location (bool)
-    1. The identity of the (pseudo)gene at this location (RegionInfo)"""
+    return pseudogenes
 
-    for pseudo in pseudos:
-        if pseudo.start == region.start:
-            return True, pseudo
-        else:
-            pass
 
-    return False, region
+def replace_pseudos_in_list(pseudos: region_table.RegionTable,
+                            regions: region_table.RegionTable) -> region_table.RegionTable:
+    """This function prevents duplicates of regions that would occur if a gene was
+    labelled and pseudogene and the original gene was not removed from the list.
+    Any region with the same start position as a pseudogene is replaced by that (first) pseudogene."""
+
+    # Row of the first pseudogene at each start position, or -1 if no pseudogene starts there
+    pseudo_at_start = interval_index.IntervalIndex(pseudos.start, pseudos.end).first_at(regions.start)
+
+    # Pseudogenes are counted after all regions in the combined table below
+    final_rows = numpy.where(pseudo_at_start >= 0, len(regions) + pseudo_at_start, numpy.arange(len(regions)))
 
+    return region_table.concatenate([regions, pseudos]).take(final_rows)
 
-def check_adjacent_regions(args, lori: List[RegionInfo]) -> tuple:
-    """This function will take input blast files and return a list of all pseudogene candidates.
 
-    lori: List of regions you want to run through.
-    contig_number: the position of the contig in a list of contigs. Used for printing information.
-    cutoff: refer to arg.shared_hits. Percentage of hits shared between two regions to consider joining them."""
+def check_adjacent_regions(args, lori: region_table.RegionTable, stats: RunStats) -> tuple:
+    """This function will take a table of regions and return all pseudogene candidates in two tables.
 
-    sorted_lori = sorted(lori, key=lambda r: r.start)
-    merged_list = []  # List of merged pseudogenes stored as RegionInfo
-    individual_list = []  # List of individual pseudogenes stored as RegionInfo
+    lori: Table of regions you want to run through. Merged regions are appended to this table as they are made.
+    cutoff: refer to arg.shared_hits. Percentage of hits shared between two regions to consider joining them.
+    stats: Statistics of the run, the pseudogenes found are counted into it.
+
+    Regions are walked in order of their start position, which is kept in a linked list (RegionChain) so that
+    joining two regions does not shift or re-sort the whole list. Pseudogenes found so far are kept in dictionaries
+    keyed by start position, in the order they were found."""
+
+    shared_hits = region_table.SharedHits(lori)  # Remembers the number of shared hits of every pair compared below
+    starts = lori.start.tolist()    # Start and end position of every row of lori, extended as regions are merged
+    ends = lori.end.tolist()
+    sorted_lori = region_table.RegionChain(numpy.argsort(lori.start, kind='stable').tolist(), starts)
+    merged_pseudos = {}         # Merged pseudogenes stored as {start: row of lori}
+    merged_ends = {}            # {end: start} of the merged pseudogenes
+    individual_pseudos = {}     # Individual pseudogenes stored as {start: row of lori}
     i = 0   # Iterator
 
     while i < len(sorted_lori)-1 and len(sorted_lori) > 1:
         new_pseudo_made = False
+        pseudo = None
         try:
             # compare_regions() checks that the two regions pass certain criteria
-            if compare_regions(args, r1=sorted_lori[i], r2=sorted_lori[i + 1]) is True:
+            if compare_regions(args, lori, shared_hits, r1=sorted_lori[i], r2=sorted_lori[i + 1]) is True:
                 new_pseudo_made = True    # this bool will be important later on in this function
-                pseudo = join_regions(sorted_lori[i], sorted_lori[i + 1])   # if they pass, create a pseudogene
+                pseudo = join_regions(lori, sorted_lori[i], sorted_lori[i + 1])   # if they pass, create a pseudogene
 
                 # this is to keep track of overall statistics. If the regions are plain ORFs or ORFs annotated
                 # as short pseudos, the counter will increase by 1 for each of them.
                 for region in [sorted_lori[i], sorted_lori[i + 1]]:
-                    if region.region_type == RegionType.ORF or region.region_type == RegionType.shortpseudo:
-                        StatisticsDict['FragmentedOrfs'] += 1
+                    if lori.region_type[region] == RegionType.ORF.value or lori.region_type[region] == RegionType.shortpseudo.value:
+                        stats.fragmented_orfs += 1
 
                 del sorted_lori[i + 1]  # remove items that were joined together
                 del sorted_lori[i]
 
             # If regions [i] and [i+1] fail to join (above), look at regions [i] and [i+2].
-            elif compare_regions(args=args, r1=sorted_lori[i], r2=sorted_lori[i + 2]) is True:
+            elif compare_regions(args, lori, shared_hits, r1=sorted_lori[i], r2=sorted_lori[i + 2]) is True:
 
                 new_pseudo_made = True  # this boolean will be important later on in this function
-                pseudo = join_regions(sorted_lori[i], sorted_lori[i + 2])  # if they pass, create a pseudogene
+                pseudo = join_regions(lori, sorted_lori[i], sorted_lori[i + 2])  # if they pass, create a pseudogene
 
                 # same as above ^
                 for region in [sorted_lori[i], sorted_lori[i + 1], sorted_lori[i + 2]]:
-                    if region.region_type == RegionType.ORF or region.region_type == RegionType.shortpseudo:
-                        StatisticsDict['FragmentedOrfs'] += 1
+                    if lori.region_type[region] == RegionType.ORF.value or lori.region_type[region] == RegionType.shortpseudo.value:
+                        stats.fragmented_orfs += 1
 
                 del sorted_lori[i + 2]  # remove items that were joined together, and [i+1] because it's in between them
                 del sorted_lori[i + 1]
                 del sorted_lori[i]
 
             # If the pieces were not assembled but one of them is an 'individual pseudogene',
-            # it is added to the individual_list
-            elif sorted_lori[i].region_type == RegionType.shortpseudo or sorted_lori[i].region_type == RegionType.intergenicpseudo:
+            # it is added to individual_pseudos
+            elif lori.region_type[sorted_lori[i]] == RegionType.shortpseudo.value or lori.region_type[sorted_lori[i]] == RegionType.intergenicpseudo.value:
                 pseudo = sorted_lori[i]
-                # Deletes an item in individual_list if it has the same start position as an individual pseudo.
-                individual_list[:] = [item for item in individual_list if item.start is not pseudo.start]
-                individual_list.append(pseudo)
+                # Replaces the individual pseudogene with the same start position, if there is one.
+                # It is removed first, so that the new one moves to the end of the dictionary.
+                individual_pseudos.pop(starts[pseudo], None)
+                individual_pseudos[starts[pseudo]] = pseudo
 
             # If the region in question fits none of the critera, move on.
             else:
@@ -562,19 +839,26 @@ def check_adjacent_regions(args, lori: List[RegionInfo]) -> tuple:
         # 'new_pseudo_made' resets to false every loop
         # so it will only be 'True' if two regions have just been merged together
         if new_pseudo_made is True:
-            # Deletes an item in merged_list if that item has the same start position as the pseudogene.
-            # It works like:
-            #   merged_list[:] = a new version of merged_list, that contains items from merged_list,
-            #   unless that item is nested within the new pseudogene.
-            merged_list[:] = [item for item in merged_list if (item.start is not pseudo.start) and (item.end is not pseudo.end)]
-
-            # Adds the merged region to a list to keep track of all merged regions
-            merged_list.append(pseudo)
-            # Adds the merged region to the original list so that it will continue to be considered
-            sorted_lori.append(pseudo)
-
-            # Re-sorts the list, because two regions will have been removed and one new one added (see just above).
-            sorted_lori = sorted(sorted_lori, key=lambda r: r.start)
+            starts.append(int(lori.start[pseudo]))
+            ends.append(int(lori.end[pseudo]))
+
+            # Removes the merged pseudogene that has the same start position as the new one, and the one that has
+            # the same end position. Those are nested within the new pseudogene.
+            # Merged pseudogenes never share a start or an end, so there is at most one of each.
+            nested = merged_pseudos.pop(starts[pseudo], None)
+            if nested is not None:
+                del merged_ends[ends[nested]]
+            nested_start = merged_ends.pop(ends[pseudo], None)
+            if nested_start is not None:
+                del merged_pseudos[nested_start]
+
+            # Adds the merged region to a dictionary to keep track of all merged regions
+            merged_pseudos[starts[pseudo]] = pseudo
+            merged_ends[ends[pseudo]] = starts[pseudo]
+
+            # Adds the merged region to the chain of regions so that it will continue to be considered.
+            # It is inserted in order of start position, because two regions will have been removed.
+            sorted_lori.insert_sorted(pseudo)
 
             i = i - 1  # Resets the iterator so that new region can be tested by join_regions()
 
@@ -582,28 +866,34 @@ def check_adjacent_regions(args, lori: List[RegionInfo]) -> tuple:
         else:
             i = i + 1
 
-        # This will remove rare cases where a pseudogene isnt handled correctly and remains in the individual_list
-        # despite being a part of a merged pseudogene in merged_list. No touchy.
-        individual_list[:] = [item for item in individual_list if item.start not in [pseudo.start for pseudo in merged_list]]
+        # This will remove rare cases where a pseudogene isnt handled correctly and remains in individual_pseudos
+        # despite being a part of a merged pseudogene in merged_pseudos. No touchy.
+        # Only the pseudogene handled in this iteration can have caused this.
+        if pseudo is not None and starts[pseudo] in merged_pseudos:
+            individual_pseudos.pop(starts[pseudo], None)
+
+    individual_pseudos = lori.take(list(individual_pseudos.values()))
+    merged_pseudos = lori.take(list(merged_pseudos.values()))
 
-    # Once the loop finishes, add all statistics to StatisticsDict for reporting in the log file.
-    StatisticsDict['PseudogenesTotal'] += len(individual_list) + len(merged_list)
-    StatisticsDict['PseudogenesShort'] += len([item for item in individual_list if item.region_type == RegionType.shortpseudo])
-    StatisticsDict['PseudogenesIntergenic'] += len([item for item in individual_list if item.region_type == RegionType.intergenicpseudo])
-    StatisticsDict['PseudogenesFragmented'] += len(merged_list)
+    # Once the loop finishes, add all statistics to the run statistics for reporting in the log file.
+    stats.pseudogenes_total += len(individual_pseudos) + len(merged_pseudos)
+    stats.pseudogenes_short += int(numpy.count_nonzero(individual_pseudos.region_type == RegionType.shortpseudo.value))
+    stats.pseudogenes_intergenic += int(numpy.count_nonzero(individual_pseudos.region_type == RegionType.intergenicpseudo.value))
+    stats.pseudogenes_fragmented += len(merged_pseudos)
 
-    return individual_list, merged_list
+    return individual_pseudos, merged_pseudos
 
 
-def compare_regions(args, r1: RegionInfo, r2: RegionInfo) -> bool:
-    """Takes two regions and decides if they are similar enough to join together."""
+def compare_regions(args, lori: region_table.RegionTable, shared_hits: region_table.SharedHits,
+                    r1: int, r2: int) -> bool:
+    """Takes two regions (rows of lori) and decides if they are similar enough to join together."""
 
     # A list of conditions that must be met in order for two regions to be joined
     if (
-        region_proximity(r1, r2) < args.distance and      # Closer than cutoff default (1000bp)
-        matching_hit_critera(args, r1, r2) is True and    # Have enough matching blast hits
-        r1.strand == r2.strand and                        # Same strand
-        not (r1.region_type == RegionType.intergenic and r2.region_type == RegionType.intergenic)  # They are not both intergenic regions
+        region_proximity(lori, r1, r2) < args.distance and                  # Closer than cutoff default (1000bp)
+        matching_hit_critera(args, lori, shared_hits, r1, r2) is True and   # Have enough matching blast hits
+        lori.strand[r1] == lori.strand[r2] and                              # Same strand
+        not (lori.region_type[r1] == RegionType.intergenic.value and lori.region_type[r2] == RegionType.intergenic.value)  # They are not both intergenic regions
     ):
         return True
 
@@ -611,25 +901,26 @@ def compare_regions(args, r1: RegionInfo, r2: RegionInfo) -> bool:
         return False
 
 
-def region_proximity(r1: RegionInfo, r2: RegionInfo) -> int:
+def region_proximity(lori: region_table.RegionTable, r1: int, r2: int) -> int:
     """Takes two regions and returns their distance from each other in # of nucleotides."""
     # sorts the two regions by starting point, so the math will always be consistent.
-    sorted_by_start = sorted([r1,r2], key=lambda r: r.start)
+    sorted_by_start = sorted([r1, r2], key=lambda r: lori.start[r])
 
     # substracts the end position of the first from the start position of the second
     # this value can actually be negative if a gene starts before the previous one finishes
-    return sorted_by_start[1].start - sorted_by_start[0].end
+    return int(lori.start[sorted_by_start[1]] - lori.end[sorted_by_start[0]])
 
 
-def matching_hit_critera(args, r1: RegionInfo, r2: RegionInfo) -> bool:
+def matching_hit_critera(args, lori: region_table.RegionTable, shared_hits: region_table.SharedHits,
+                         r1: int, r2: int) -> bool:
     """This function determines if two regions meet the minimum blast hit criteria to be joined together."""
 
-    if len(r1.hits) is not 0 and len(r2.hits) is not 0:
-        # sorts the two regions based on number of blast hits.
-        s = sorted([r1, r2], key=lambda r: len(r.hits))
+    r1_hits = int(lori.hit_offsets[r1 + 1] - lori.hit_offsets[r1])
+    r2_hits = int(lori.hit_offsets[r2 + 1] - lori.hit_offsets[r2])
 
+    if r1_hits != 0 and r2_hits != 0:
         # math: (Number of shared hits) / (Total number of hits from the region with the least hits) >= cutoff value.
-        if number_of_matching_hits(r1, r2)/len(s[0].hits) >= args.shared_hits:
+        if number_of_matching_hits(shared_hits, r1, r2)/min(r1_hits, r2_hits) >= args.shared_hits:
             return True
         else:
             return False
@@ -638,125 +929,274 @@ def matching_hit_critera(args, r1: RegionInfo, r2: RegionInfo) -> bool:
         return False
 
 
-def number_of_matching_hits(r1: RegionInfo, r2: RegionInfo) -> int:
+def number_of_matching_hits(shared_hits: region_table.SharedHits, r1: int, r2: int) -> int:
     """This function returns the number of blast hits that two regions have in common."""
 
-    r1_accessions = set([blasthit.accession for blasthit in r1.hits])
-    r2_accessions = set([blasthit.accession for blasthit in r2.hits])
-
-    return len(set(r1_accessions) & set(r2_accessions))
+    return shared_hits.count(r1, r2)
 
 
-def join_regions(r1: RegionInfo, r2: RegionInfo) -> RegionInfo:
-    """This function needs to take two regions and merge their locations."""
+def join_regions(lori: region_table.RegionTable, r1: int, r2: int) -> int:
+    """This function needs to take two regions and merge their locations.
+    The merged region is added to the end of lori, and its row is returned."""
 
     # concatenates hits from both regions, discards any duplicates, and sorts them by e-value.
-    merged_hits = sort_hits_by_eval(list(set(r1.hits + r2.hits)))
-
-    merged_region = RegionInfo(contig=r1.contig,
-                               query=r1.query+","+r2.query+",",
-                               start=min([r1.start, r2.start]),
-                               end=max([r1.end, r2.end]),
-                               strand=r1.strand,
-                               hits=merged_hits,
-                               note='Note=pseudogene candidate. Reason: Predicted fragmentation of a single gene.;'
-                                    'colour=229 204 255',  # 'colour=' makes this region appear coloured in Artemis.
-                               region_type=RegionType.fragmentedpseudo)
+    merged_hits = sort_hits_by_eval(lori.hits, numpy.union1d(lori.region_hits(r1), lori.region_hits(r2)))
+
+    merged_region = lori.append_region(contig=lori.contig[r1],
+                                       query=lori.query[r1]+","+lori.query[r2]+",",
+                                       start=min([lori.start[r1], lori.start[r2]]),
+                                       end=max([lori.end[r1], lori.end[r2]]),
+                                       strand=lori.strand[r1],
+                                       region_type=RegionType.fragmentedpseudo.value,
+                                       note='Note=pseudogene candidate. Reason: Predicted fragmentation of a single gene.;'
+                                            'colour=229 204 255',  # 'colour=' makes this region appear coloured in Artemis.
+                                       hit_rows=merged_hits)
     return merged_region
 
 
-def sort_hits_by_eval(lobh: List[BlastHit]) -> List[BlastHit]:
-    """Sorts a list of blasthits by e-value from low to high (returning the hit with the lowest evalue first)."""
+def sort_hits_by_eval(hits: region_table.HitTable, lobh: numpy.ndarray) -> numpy.ndarray:
+    """Sorts rows of a HitTable by e-value from low to high (returning the hit with the lowest evalue first)."""
 
-    sorted_list = sorted(lobh, key=lambda r: r.eval)
+    sorted_list = lobh[numpy.argsort(hits.eval[lobh], kind='stable')]
     return sorted_list
 
 
 def sort_contigs(loc: List[Contig]) -> List[Contig]:
-    """Takes a list of contigs and sorts it numerically."""
+    """Takes a list of contigs and sorts it by contig number (their order in the genome)."""
 
     sortedlist = sorted(loc, key=lambda c: c.number)
 
     return sortedlist
 
 
-def add_locus_tags(lori: List[RegionInfo], contig: str) -> List[RegionInfo]:
-    """Adds numerically increasing locus tags to a list of regions."""
+def add_locus_tags(lori: region_table.RegionTable, contig: str) -> region_table.RegionTable:
+    """Adds numerically increasing locus tags to a table of regions."""
 
-    sorted_by_start = sorted(lori, key=lambda r: r.start)
+    sorted_by_start = lori.take(numpy.argsort(lori.start, kind='stable'))
 
-    final_list = []
+    # adds a locus tag with 4 digits.
+    # ie, if counter = 2 and contig = 'contig1', result will be
+    # 'locus_tag=pseudo_contig_1_0002'
+    sorted_by_start.note = [note + str(';locus_tag=%s_%04d' % (contig, counter+1))
+                            for counter, note in enumerate(sorted_by_start.note)]
 
-    for counter, region in enumerate(sorted_by_start):
-        tagged_region = RegionInfo(region.contig,
-                                   region.query,
-                                   region.start,
-                                   region.end,
-                                   region.strand,
-                                   region.hits,
-                                   # adds a locus tag with 4 digits.
-                                   # ie, if counter = 2 and contig = 'contig1', result will be
-                                   # 'locus_tag=pseudo_contig_1_0002'
-                                   region.note + str(';locus_tag=%s_%04d' % (contig, counter+1)),
-                                   region_type=region.region_type)
+    return sorted_by_start
 
-        final_list.append(tagged_region)
 
-    return final_list
+def write_genes_to_gff(genome: genome_index.GenomeIndex, lopg: region_table.RegionTable, gff: str) -> None:
+    """Takes an input table of genes and writes them to a GFF file in proper format."""
 
+    with open(gff, 'w') as gff_output_handle:
+        write_gff_header(genome, gff_output_handle)
+        write_gff_genes(lopg, gff_output_handle)
 
-def write_genes_to_gff(args, lopg: List[RegionInfo], gff: str) -> None:
-    """Takes an input list of genes and writes them to a GFF file in proper format."""
 
-    with open(gff, 'w') as gff_output_handle:
-        # write header
-        gff_output_handle.write("##gff-version 3\n#!annotation-date\t%s\n" % (current_time()))  # first line
-        for i, seq_record in enumerate(SeqIO.parse(args.genome, "genbank")):  # writes one line for each contig
-            entry_elements = ["##sequence-region",                # Necessary to comply with GFF3 formatting
-                              "gnl|Prokka|%s" % seq_record.id,    # contig seqid
-                              1,                                  # contig start
-                              len(seq_record)]
-
-            gff_output_handle.write(' '.join(map(str, entry_elements))+'\n')
-
-        # write genes
-        for region in lopg:
-            entry_elements = ["gnl|Prokka|%s" % region.contig,
-                              "pseudofinder",
-                              "gene",
-                              region.start,
-                              region.end,
-                              '.',
-                              region.strand,
-                              '.',
-                              region.note]
-
-            gff_output_handle.write('\t'.join(map(str, entry_elements))+'\n')
-
-
-def get_functional_genes(contig: Contig, pseudos: List[RegionInfo]) -> Contig:
+def write_gff_header(genome: genome_index.GenomeIndex, gff_output_handle) -> None:
+    """Writes the header of a GFF file, with a sequence-region line for every contig of the genome."""
+
+    gff_output_handle.write("##gff-version 3\n#!annotation-date\t%s\n" % (current_time()))  # first line
+    for contig in genome.contigs:  # writes one line for each contig
+        entry_elements = ["##sequence-region",                # Necessary to comply with GFF3 formatting
+                          "gnl|Prokka|%s" % contig.id,        # contig seqid
+                          1,                                  # contig start
+                          contig.length]
+
+        gff_output_handle.write(' '.join(map(str, entry_elements))+'\n')
+
+
+def write_gff_genes(lopg: region_table.RegionTable, gff_output_handle) -> None:
+    """Writes one GFF line for every gene in a table."""
+
+    for contig, start, end, strand, note in zip(lopg.contig.tolist(), lopg.start.tolist(), lopg.end.tolist(),
+                                                lopg.strand.tolist(), lopg.note):
+        entry_elements = ["gnl|Prokka|%s" % lopg.contig_names[contig],
+                          "pseudofinder",
+                          "gene",
+                          start,
+                          end,
+                          '.',
+                          strand,
+                          '.',
+                          note]
+
+        gff_output_handle.write('\t'.join(map(str, entry_elements))+'\n')
+
+
+def get_functional_genes(contig: Contig, pseudos: region_table.RegionTable) -> Contig:
     """"Inspects a contig for genes that have not been annotated as pseudogenes, and returns them."""
 
     # All regions on a contig, sorted by start position
-    region_list = sorted(contig.regions, key=lambda r: r.start)
-    # Begin with all regions on the contig
-    functional_list = sorted(contig.regions, key=lambda r: r.start)
-
-    # Iterate through regions on the contig
-    for region in region_list:
-        for pseudo in pseudos:
-            # This will be true if the region is nested within a pseudogene
-            if region.start >= pseudo.start and region.end <= pseudo.end:
-                functional_list.remove(region)  # Remove that region from the final list
-                break  # this will speed up the function by ending the 'for pseudo' loop if a match is successful
-            else:
-                pass
+    region_list = contig.regions.take(numpy.argsort(contig.regions.start, kind='stable'))
+
+    # This will be true if the region is nested within a pseudogene
+    nested = interval_index.IntervalIndex(pseudos.start, pseudos.end).contains(region_list.start, region_list.end)
+
+    # Remove those regions from the final table
+    functional_list = region_list.take(numpy.flatnonzero(~nested))
 
     functional_genes = Contig(regions=functional_list, name=contig.name, number=contig.number)
 
     return functional_genes
 
 
+def annotate_contig(args, contig: Contig, orfs: Contig) -> tuple:
+    """Flags the pseudogenes on a single contig and collects its functional genes.
+    orfs is the same contig with only its ORFs, or None if there are none.
+
+    Returns (pseudogenes, functional genes or None, RunStats of this contig)."""
+
+    contig_stats = RunStats()
+    pseudos_on_contig = annotate_pseudos(args=args, contig=contig, stats=contig_stats)
+
+    if orfs is None:
+        functional_genes_on_contig = None
+    else:
+        functional_genes_on_contig = get_functional_genes(contig=orfs, pseudos=pseudos_on_contig.regions).regions
+
+    return pseudos_on_contig.regions, functional_genes_on_contig, contig_stats
+
+
+def annotate_contigs(args, all_regions_by_contig: List[Contig], orfs_by_contig: List[Contig], stats: RunStats) -> tuple:
+    """Runs annotate_contig() on every contig and returns two lists of tables, in contig order:
+    [0]: pseudogenes on each contig.
+    [1]: functional genes on each contig (contigs without ORFs are skipped).
+
+    With args.workers > 1, contigs are sent to a pool of processes in batches of about the same number of regions.
+    The results are gathered in contig order, and the statistics of every contig are merged into stats in that order,
+    so the output is identical to checking the contigs one after the other."""
+
+    # Contigs are paired with the ORFs of the contig at the same position. Small contigs may have no ORFs.
+    contigs = [(contig, orfs_by_contig[contig_index] if contig_index < len(orfs_by_contig) else None)
+               for contig_index, contig in enumerate(all_regions_by_contig)]
+    workers = min(args.workers, len(contigs))
+
+    if workers > 1:
+        print('%s\tChecking %s contigs for pseudogenes with %s workers.' % (current_time(), len(contigs), workers)),
+        sys.stdout.flush()
+        results = annotate_contigs_in_pool(args, contigs, workers)
+
+    else:
+        results = []
+        for contig_index, (contig, orfs) in enumerate(contigs):
+            print('\033[1m'+'%s\tChecking contig %s / %s for pseudogenes.\033[0m' % (current_time(),
+                                                                                     contig_index+1,
+                                                                                     len(contigs))),
+            sys.stdout.flush()
+            results.append(annotate_contig(args, contig, orfs))
+            print_contig_counts(contig, pseudos_on_contig=results[-1][0], functional_genes_on_contig=results[-1][1])
+
+    pseudogenes = []
+    functional_genes = []
+
+    for (contig, orfs), (pseudos_on_contig, functional_genes_on_contig, contig_stats) in zip(contigs, results):
+        pseudogenes.append(pseudos_on_contig)  # Table of regions
+        stats.merge(contig_stats)
+
+        if functional_genes_on_contig is None:  # If there are no orfs on a small contig, there is nothing to report.
+            continue
+        functional_genes.append(functional_genes_on_contig)
+
+        if workers > 1:  # Contigs that were checked one after the other have been reported as they were checked
+            print_contig_counts(contig, pseudos_on_contig, functional_genes_on_contig)
+
+    return pseudogenes, functional_genes
+
+
+def print_contig_counts(contig: Contig, pseudos_on_contig: region_table.RegionTable,
+                        functional_genes_on_contig: region_table.RegionTable) -> None:
+    """Prints the number of ORFs and pseudogenes of a checked contig. Contigs without ORFs are not reported."""
+
+    if functional_genes_on_contig is None:
+        return
+
+    print('\t\t\tNumber of ORFs on this contig: %s\n'
+          '\t\t\tNumber of pseudogenes flagged: %s' % (
+              numpy.count_nonzero(contig.regions.region_type == RegionType.ORF.value),
+              len(pseudos_on_contig))),
+    sys.stdout.flush()
+
+
+def annotate_contigs_in_pool(args, contigs: List[tuple], workers: int) -> List[tuple]:
+    """Runs annotate_contig() on (contig, orfs) pairs in a pool of processes, and returns the results in the same order.
+
+    Every worker receives all contigs once, when it starts, and is then sent batches of contig numbers.
+    Tables travel back without their hits (region_table.detach), and get the hits of the original contig back here."""
+
+    batches = balanced_batches(sizes=[len(contig.regions) for contig, orfs in contigs], number_of_batches=4 * workers)
+    results = [None] * len(contigs)
+
+    # Workers are forked where possible, so that the contigs are not copied into them
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method),
+                             initializer=init_contig_worker, initargs=(args, contigs)) as pool:
+        futures = [pool.submit(annotate_contig_batch, batch) for batch in batches]
+
+        for future in as_completed(futures):
+            for contig_index, pseudos_on_contig, functional_genes_on_contig, contig_stats in future.result():
+                contig, orfs = contigs[contig_index]
+                pseudos_on_contig = region_table.attach(pseudos_on_contig, like=contig.regions)
+                if functional_genes_on_contig is not None:
+                    functional_genes_on_contig = region_table.attach(functional_genes_on_contig, like=orfs.regions)
+                results[contig_index] = (pseudos_on_contig, functional_genes_on_contig, contig_stats)
+
+            print('%s\tChecked %s / %s contigs for pseudogenes.' % (current_time(),
+                                                                    sum(result is not None for result in results),
+                                                                    len(contigs))),
+            sys.stdout.flush()
+
+    return results
+
+
+def init_contig_worker(args, contigs: List[tuple]) -> None:
+    """Runs once in every worker process of annotate_contigs_in_pool()."""
+
+    global WorkerContigs
+    WorkerContigs = (args, contigs)
+
+
+def annotate_contig_batch(batch: List[int]) -> List[tuple]:
+    """Runs annotate_contig() on a batch of contig numbers, in a worker process."""
+
+    args, contigs = WorkerContigs
+    results = []
+
+    for contig_index in batch:
+        contig, orfs = contigs[contig_index]
+        pseudos_on_contig, functional_genes_on_contig, contig_stats = annotate_contig(args, contig, orfs)
+        if functional_genes_on_contig is not None:
+            functional_genes_on_contig = region_table.detach(functional_genes_on_contig)
+        results.append((contig_index, region_table.detach(pseudos_on_contig), functional_genes_on_contig,
+                        contig_stats))
+
+    return results
+
+
+def annotate_detached_contig(args, contig: Contig, orfs: Contig) -> tuple:
+    """Runs annotate_contig() on a single contig in a worker process of ContigStream, and returns its tables without
+    their hits (see region_table.detach)."""
+
+    pseudos_on_contig, functional_genes_on_contig, contig_stats = annotate_contig(args, contig, orfs)
+    if functional_genes_on_contig is not None:
+        functional_genes_on_contig = region_table.detach(functional_genes_on_contig)
+
+    return region_table.detach(pseudos_on_contig), functional_genes_on_contig, contig_stats
+
+
+def balanced_batches(sizes: List[int], number_of_batches: int) -> List[List[int]]:
+    """Splits items (ie. contigs, by number of regions) into batches of about the same total size.
+    Items are added from largest to smallest, each to the batch that is smallest so far. Returns item numbers."""
+
+    batches = [[] for _ in range(min(number_of_batches, len(sizes)))]
+    batch_sizes = [(0, batch_number) for batch_number in range(len(batches))]  # heap of (total size, batch)
+
+    for item in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+        batch_size, batch_number = heapq.heappop(batch_sizes)
+        batches[batch_number].append(item)
+        heapq.heappush(batch_sizes, (batch_size + sizes[item], batch_number))
+
+    return [sorted(batch) for batch in batches if batch]
+
+
 #TODO: FINISH THIS BOY
 def write_functional_to_fasta(infile: str, outfile: str, contigs: List[Contig]) -> None:
     """Parses a multifasta file for regions and returns them in a list."""
@@ -778,31 +1218,61 @@ def write_functional_to_fasta(infile: str, outfile: str, contigs: List[Contig])
                     pass
 
 
-def write_pseudos_to_fasta(args, pseudofinder_regions: List[RegionInfo], outfile: str) -> None:
-    """Parse genbank input file for the regions provided and write them to the output file in fasta format."""
+def write_pseudos_to_fasta(genome: genome_index.GenomeIndex, pseudofinder_regions: region_table.RegionTable,
+                           outfile: str) -> None:
+    """Slice the regions provided out of the genome index and write them to the output file in fasta format."""
 
     fasta_list = []
+    rows_by_contig = pseudofinder_regions.rows_by_contig()
+    contig_ids = {name: contig_id for contig_id, name in enumerate(pseudofinder_regions.contig_names)}
 
-    for contig in SeqIO.parse(args.genome, "genbank"):
-        try:
-            pseudofinder_regions_on_contig = [region for region in pseudofinder_regions if region.contig == contig.name]
-        except IndexError:
+    for contig in genome.contigs:
+        pseudofinder_regions_on_contig = rows_by_contig.get(contig_ids.get(contig.name))
+        if pseudofinder_regions_on_contig is None:  # No regions on this contig
             continue
 
-        coord_list = [(region.start, region.end) for region in pseudofinder_regions_on_contig]
-        for counter, coordinate in enumerate(coord_list):
-            fasta_list.append(SeqRecord(seq=contig.seq[coordinate[0]:coordinate[1]], id="%s_%04d" % (contig.name, counter + 1),
-                                        description="%s-%s +" % (coordinate[0], coordinate[1])))
+        fasta_list.extend(pseudo_records(contig, pseudofinder_regions.take(pseudofinder_regions_on_contig)))
 
     SeqIO.write(fasta_list, open(outfile, "w"), "fasta")
 
 
-def write_summary_file(args, file_dict: dict) -> None:
+def pseudo_records(contig: genome_index.ContigRecord,
+                   pseudos_on_contig: region_table.RegionTable) -> List[SeqRecord]:
+    """Sequences of the pseudogenes on a single contig of the genome index, numbered in the order of the table."""
+
+    coord_list = zip(pseudos_on_contig.start.tolist(), pseudos_on_contig.end.tolist())
+
+    return [SeqRecord(seq=Seq(str(contig.seq[coordinate[0]:coordinate[1]])), id="%s_%04d" % (contig.name, counter + 1),
+                      description="%s-%s +" % (coordinate[0], coordinate[1]))
+            for counter, coordinate in enumerate(coord_list)]
+
+
+def write_summary_file(args, file_dict: dict, stats: RunStats) -> None:
     """Writes a summary file of statistics from the pseudo_finder run."""
 
     print('%s\tWriting summary of run:\t%s' % (current_time(), file_dict['log'])),
     sys.stdout.flush()
 
+    # Only runs that searched with BLAST have these
+    if stats.blast_queries_cached + stats.blast_queries_duplicate + stats.blast_queries_searched > 0:
+        blast_statistics = ("BLAST queries found in hit cache:\t" + str(stats.blast_queries_cached) + "\n"
+                            "BLAST queries identical to another query:\t" + str(stats.blast_queries_duplicate) + "\n"
+                            "BLAST queries searched:\t" + str(stats.blast_queries_searched) + "\n")
+    else:
+        blast_statistics = ""
+
+    # Only runs that searched in tiers (see --tier_databases) have these
+    for database, queries, resolved_queries, seconds in stats.blast_tiers:
+        blast_statistics += ("BLAST tier " + database + ":\t" + str(queries) + " queries, " + str(resolved_queries) +
+                             " resolved, " + "%.1f" % seconds + " seconds\n")
+    if stats.blast_tiers:
+        blast_statistics += "BLAST time saved by tiers (estimated, seconds):\t" + "%.1f" % stats.blast_seconds_saved + "\n"
+
+    # Only runs with --adaptive_hitcap have this
+    if stats.blast_queries_escalated > 0:
+        blast_statistics += ("BLAST queries searched again with the full hitcap:\t" +
+                             str(stats.blast_queries_escalated) + "\n")
+
     with open(file_dict['log'], 'w') as logfile:
         logfile.write(
             "####### Summary from annotate/reannotate #######\n\n"
@@ -822,22 +1292,25 @@ def write_summary_file(args, file_dict: dict) -> None:
             "#######  Settings  #######\n"
             "Distance:\t" + str(args.distance) + "\n"
             "hitcap:\t" + str(args.hitcap) + "\n"
+            "Search_hitcap:\t" + str(args.search_hitcap) + "\n"
             "Intergenic_length:\t" + str(args.intergenic_length) + "\n"
+            "Search_intergenic_length:\t" + str(args.search_intergenic_length) + "\n"
             "Intergenic_threshold:\t" + str(args.intergenic_threshold) + "\n"
             "Length_pseudo:\t" + str(args.length_pseudo) + "\n"
             "Shared_hits:\t" + str(args.shared_hits) + "\n\n"
                 
             "####### Statistics #######\n"
             "#Input:\n"
-            "Initial ORFs:\t" + str(StatisticsDict['ProteomeOrfs']) + "\n"
-            "Number of contigs:\t" + str(StatisticsDict['NumberOfContigs']) + "\n"
+            "Initial ORFs:\t" + str(stats.proteome_orfs) + "\n"
+            "Number of contigs:\t" + str(stats.number_of_contigs) + "\n"
+            + blast_statistics +
             "#Output:\n"
-            "Inital ORFs joined:\t" + str(StatisticsDict['FragmentedOrfs']) + "\n"
-            "Pseudogenes (total):\t" + str(StatisticsDict['PseudogenesTotal']) + "\n"
-            "Pseudogenes (too short):\t" + str(StatisticsDict['PseudogenesShort']) + "\n"
-            "Pseudogenes (fragmented):\t" + str(StatisticsDict['PseudogenesFragmented']) + "\n"
-            "Pseudogenes (no predicted ORF):\t" + str(StatisticsDict['PseudogenesIntergenic']) + "\n"
-            "Functional genes:\t" + str(StatisticsDict['ProteomeOrfs'] - StatisticsDict['FragmentedOrfs'] - StatisticsDict['PseudogenesShort']) + "\n\n"
+            "Inital ORFs joined:\t" + str(stats.fragmented_orfs) + "\n"
+            "Pseudogenes (total):\t" + str(stats.pseudogenes_total) + "\n"
+            "Pseudogenes (too short):\t" + str(stats.pseudogenes_short) + "\n"
+            "Pseudogenes (fragmented):\t" + str(stats.pseudogenes_fragmented) + "\n"
+            "Pseudogenes (no predicted ORF):\t" + str(stats.pseudogenes_intergenic) + "\n"
+            "Functional genes:\t" + str(stats.functional_genes()) + "\n\n"
 
             "####### Output Key #######\n"
             "Initial ORFs joined:\t\tThe number of input open reading frames "
@@ -848,17 +1321,246 @@ def write_summary_file(args, file_dict: dict) -> None:
         )
 
 
-def reset_statistics_dict():
-    """This function is needed because visualize.py was continuously accumulating values in StatisticsDict.
-    Calling this function at the end of reannotate.py runs will ensure that the values are reset properly."""
+def annotate_blast_files(args, genome: genome_index.GenomeIndex, file_dict: dict, stats: RunStats) -> None:
+    """Finds pseudogenes in the blast files of file_dict, and writes all output files.
+    This is everything that annotate does after BLAST, and all that reannotate does."""
+
+    # Collect everything from the blast files
+    # Only keep what a search with --hitcap and --intergenic_length would have found (see --search_hitcap)
+    orfs = limit_to_settings(args, parse_blast(filename=file_dict['blastp_filename'], blast_format='BlastP', stats=stats))
+    intergenic_regions = limit_to_settings(args, parse_blast(filename=file_dict['blastx_filename'],
+                                                             blast_format='BlastX', stats=stats))
+    all_regions = region_table.concatenate([orfs, intergenic_regions])
+
+    # Sorted list of contigs containing only orfs, no intergenic regions
+    orfs_by_contig = sort_contigs(loc=split_regions_into_contigs(lori=orfs, genome=genome))
+    # Sorted list of contigs containing orfs and intergenic regions
+    all_regions_by_contig = sort_contigs(loc=split_regions_into_contigs(lori=all_regions, genome=genome))
+    stats.number_of_contigs = len(all_regions_by_contig)
+
+    pseudos_by_contig, functional_by_contig = annotate_contigs(args=args, all_regions_by_contig=all_regions_by_contig,
+                                                               orfs_by_contig=orfs_by_contig, stats=stats)
+    pseudogenes = [region_table.empty(all_regions)] + pseudos_by_contig
+    functional_genes = [region_table.empty(orfs)] + functional_by_contig
+
+    pseudogenes = region_table.concatenate(pseudogenes)
+    functional_genes = region_table.concatenate(functional_genes)
 
-    StatisticsDict['ProteomeOrfs'] = 0
-    StatisticsDict['NumberOfContigs'] = 0
-    StatisticsDict['FragmentedOrfs'] = 0
-    StatisticsDict['PseudogenesTotal'] = 0
-    StatisticsDict['PseudogenesShort'] = 0
-    StatisticsDict['PseudogenesIntergenic'] = 0
-    StatisticsDict['PseudogenesFragmented'] = 0
+    write_output_files(args, genome, file_dict, pseudogenes=pseudogenes, functional_genes=functional_genes, stats=stats)
+
+
+def write_output_files(args, genome: genome_index.GenomeIndex, file_dict: dict, pseudogenes: region_table.RegionTable,
+                       functional_genes: region_table.RegionTable, stats: RunStats) -> None:
+    """Writes all output files of a run from its pseudogenes and functional genes, in contig order."""
+
+    write_genes_to_gff(genome, lopg=pseudogenes, gff=file_dict['pseudos_gff'])
+    write_genes_to_gff(genome, lopg=functional_genes, gff=file_dict['functional_gff'])
+    write_pseudos_to_fasta(genome, pseudofinder_regions=pseudogenes, outfile=file_dict['pseudos_fasta'])
+    # TODO: Activate this feature once you finish writing it
+    # write_functional_to_fasta(infile=file_dict['proteome_filename'], outfile=file_dict['functional_faa'],
+    #                           contigs=functional_genes)
+    genome_map.full(genome=genome, gff=file_dict['pseudos_gff'], outfile=file_dict['chromosome_map'])
+    write_summary_file(args=args, file_dict=file_dict, stats=stats)
+
+
+class ContigStream:
+    """Checks every contig for pseudogenes while BLAST is still running (see --overlap).
+
+    The blast stage hands over the results of the queries as soon as they are known (see blast_search.run_searches).
+    Once every ORF and intergenic region of a contig has its results, the contig is checked like annotate_contigs()
+    would, and its pseudogenes are appended to the partial GFF and fasta files, so that they can be looked at before
+    the run is done. finish() then gathers the results of every contig in contig order, for write_output_files().
+
+    Results arrive in the thread that BLAST hands them over in, not in the event loop that runs BLAST. With
+    args.workers > 1, contigs are checked in a pool of that many processes, and the results are taken in whenever
+    more blocks arrive, and at the end by finish()."""
+
+    def __init__(self, args, genome: genome_index.GenomeIndex, file_dict: dict):
+        self.args = args
+        self.genome = genome
+        self.file_dict = file_dict
+        self.contig_order = {contig.name: number for number, contig in enumerate(genome.contigs)}
+        self.pool = None
+        self.checking = {}  # contig name -> (Contig, future) of the contigs that are being checked in the pool
+        if args.workers > 1:
+            # The workers are started here, before BLAST starts threads of its own (forking a process that runs
+            # several threads can leave locks held in the child)
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            self.pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context(start_method))
+            self.pool.submit(os.getpid).result()
+
+        # Contig of every query, by its number in the query file. The contig is the second word of the fasta header,
+        # ie. ">COGCCIIJ_00001 COGCCIIJ_1 [115:223](+)" (see get_proteome() and get_intergenic_regions()).
+        self.query_contigs = {}
+        for blast_format, filename in (('BlastP', file_dict['proteome_filename']),
+                                       ('BlastX', file_dict['intergenic_filename'])):
+            self.query_contigs[blast_format] = [record.split(None, 2)[1]
+                                                for record in blast_search.read_fasta_records(filename)]
+
+        self.waiting = Counter(contig for contigs in self.query_contigs.values() for contig in contigs)
+        self.blocks = {contig: {'BlastP': {}, 'BlastX': {}} for contig in self.waiting}
+        self.results = {}  # contig name -> (Contig, pseudogenes, functional genes or None, RunStats of the contig)
+        self.partial_files = None
+
+    def add_blocks(self, search: blast_search.Search, blocks: dict) -> None:
+        """Takes the results of some queries of the BlastP or BlastX search as {query number: block}, and checks
+        every contig that is now complete."""
+
+        completed = []
+        for number, block in blocks.items():
+            contig = self.query_contigs[search.name][number]
+            self.blocks[contig][search.name][number] = block
+            self.waiting[contig] -= 1
+            if self.waiting[contig] == 0:
+                completed.append(contig)
+
+        for contig in sorted(completed, key=self.contig_order.get):
+            self.annotate(contig)
+        self.collect(wait=False)
+
+    def annotate(self, contig_name: str) -> None:
+        """Checks a contig whose queries all have their results, or sends it to the pool of processes."""
+
+        blocks = self.blocks.pop(contig_name)
+        orfs = limit_to_settings(self.args, self.blocks_to_table(blocks['BlastP'], blast_format='BlastP'))
+        intergenic_regions = limit_to_settings(self.args, self.blocks_to_table(blocks['BlastX'], blast_format='BlastX'))
+        all_regions = region_table.concatenate([orfs, intergenic_regions])
+        if len(all_regions) == 0:  # Like split_regions_into_contigs(), contigs without regions are left out
+            return
+
+        number = self.contig_order[contig_name]
+        contig = Contig(regions=all_regions, name=contig_name, number=number)
+        orfs_on_contig = Contig(regions=orfs, name=contig_name, number=number) if len(orfs) else None
+
+        if self.pool is not None:
+            self.checking[contig_name] = (contig, orfs_on_contig,
+                                          self.pool.submit(annotate_detached_contig, self.args, contig, orfs_on_contig))
+        else:
+            self.checked(contig, *annotate_contig(self.args, contig, orfs_on_contig))
+
+    def collect(self, wait: bool) -> None:
+        """Takes in the results of the contigs that the pool has checked, or waits for all of them."""
+
+        for contig_name, (contig, orfs_on_contig, future) in list(self.checking.items()):
+            if wait or future.done():
+                del self.checking[contig_name]
+                pseudos_on_contig, functional_genes_on_contig, contig_stats = future.result()
+                if functional_genes_on_contig is not None:
+                    functional_genes_on_contig = region_table.attach(functional_genes_on_contig,
+                                                                     like=orfs_on_contig.regions)
+                self.checked(contig, region_table.attach(pseudos_on_contig, like=contig.regions),
+                             functional_genes_on_contig, contig_stats)
+
+    def checked(self, contig: Contig, pseudos_on_contig: region_table.RegionTable,
+                functional_genes_on_contig: region_table.RegionTable, contig_stats: RunStats) -> None:
+        """Keeps the results of a checked contig, and writes its pseudogenes to the partial files."""
+
+        contig_name, number = contig.name, contig.number
+        self.results[contig_name] = (contig, pseudos_on_contig, functional_genes_on_contig, contig_stats)
+
+        if self.partial_files is None:
+            self.partial_files = (open(self.file_dict['pseudos_partial_gff'], 'w'),
+                                  open(self.file_dict['pseudos_partial_fasta'], 'w'))
+            write_gff_header(self.genome, self.partial_files[0])
+
+        partial_gff, partial_fasta = self.partial_files
+        write_gff_genes(pseudos_on_contig, partial_gff)
+        SeqIO.write(pseudo_records(self.genome.contigs[number], pseudos_on_contig), partial_fasta, "fasta")
+        partial_gff.flush()
+        partial_fasta.flush()
+
+        print('%s\tChecked contig %s for pseudogenes (%s / %s contigs).\n'
+              '\t\t\tNumber of pseudogenes flagged: %s' % (current_time(), contig_name, len(self.results),
+                                                          len(self.waiting), len(pseudos_on_contig))),
+        sys.stdout.flush()
+
+    @staticmethod
+    def blocks_to_table(blocks: dict, blast_format: str) -> region_table.RegionTable:
+        """Parses the blocks of some queries, in the order of the query file."""
+
+        lines = (line for number in sorted(blocks) for line in blocks[number].splitlines(keepends=True))
+        return regions_to_table(iterate_blast_lines(lines=lines, blast_format=blast_format))
+
+    def complete(self) -> bool:
+        """True once every query of every contig has its results."""
+        return not any(self.waiting.values())
+
+    def finish(self, stats: RunStats) -> tuple:
+        """Results of every contig, joined in contig order as annotate_blast_files() does: returns (pseudogenes,
+        functional genes), and merges the statistics of every contig into stats."""
+
+        self.collect(wait=True)
+        stats.proteome_orfs += len(self.query_contigs['BlastP'])
+        stats.number_of_contigs = len(self.results)
+
+        pseudogenes = [regions_to_table([])]
+        functional_genes = [regions_to_table([])]
+        for contig, pseudos_on_contig, functional_genes_on_contig, contig_stats in sorted(
+                self.results.values(), key=lambda result: result[0].number):
+            pseudogenes.append(pseudos_on_contig)
+            stats.merge(contig_stats)
+            if functional_genes_on_contig is not None:
+                functional_genes.append(functional_genes_on_contig)
+
+        return region_table.concatenate(pseudogenes), region_table.concatenate(functional_genes)
+
+    def close(self) -> None:
+        """Removes the partial files, once the output files are written, and stops the pool of processes."""
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.partial_files is not None:
+            for partial_file in self.partial_files:
+                partial_file.close()
+                os.remove(partial_file.name)
+            self.partial_files = None
+
+
+def blast_parameters(args) -> dict:
+    """Settings that change the output of the blast stage (see pipeline.py)."""
+
+    parameters = {'search_engine': args.search_engine,
+                  'database': args.database,
+                  'database_files': hit_cache.database_identity(args.database),
+                  'evalue': args.evalue,
+                  'search_hitcap': args.search_hitcap}
+
+    # The settings of annotate that tier_resolved() compares the hits with are left out (see tier_settings)
+    if args.tier_databases:
+        parameters.update({'tier_databases': [[database, hit_cache.database_identity(database)]
+                                              for database in args.tier_databases],
+                           'tier_min_hits': args.tier_min_hits,
+                           'tier_margin': args.tier_margin})
+    if args.adaptive_hitcap is not None:
+        parameters['adaptive_hitcap'] = args.adaptive_hitcap
+
+    return parameters
+
+
+def tier_settings(args) -> dict:
+    """Settings of annotate that decide which queries a --tier_databases database resolves (see tier_resolved).
+    They are not part of the parameters of the blast stage, so that changing them does not search everything again:
+    the blast stage records them with its results instead, and annotate points out when they have changed since."""
+
+    return {'hitcap': args.hitcap,
+            'length_pseudo': args.length_pseudo,
+            'intergenic_length': args.intergenic_length,
+            'intergenic_threshold': args.intergenic_threshold} if args.tier_databases else {}
+
+
+def logged_settings(args) -> dict:
+    """Settings of a run that reannotate and visualize need to know (see reannotate.parse_log)."""
+
+    return {'distance': args.distance,
+            'hitcap': args.hitcap,
+            'intergenic_length': args.intergenic_length,
+            'intergenic_threshold': args.intergenic_threshold,
+            'length_pseudo': args.length_pseudo,
+            'shared_hits': args.shared_hits,
+            'database': args.database,
+            'search_hitcap': args.search_hitcap,
+            'search_intergenic_length': args.search_intergenic_length}
 
 
 def main():
@@ -875,61 +1577,85 @@ def main():
         'functional_gff': base_outfile_name + "functional.gff",
         'functional_faa': base_outfile_name + "functional.faa",
         'chromosome_map': base_outfile_name + "map.pdf",
-        'log': base_outfile_name + "log.txt"
+        'log': base_outfile_name + "log.txt",
+        'pseudos_partial_gff': base_outfile_name + "pseudos.partial.gff",
+        'pseudos_partial_fasta': base_outfile_name + "pseudos.partial.fasta"
     }
 
-    # Collect sequences
-    get_proteome(args=args, out_faa=file_dict['proteome_filename'])
-    get_intergenic_regions(args=args, out_fasta=file_dict['intergenic_filename'])
-
-    # Run blast
-    run_blastp(args=args, in_faa=file_dict['proteome_filename'], out_tsv=file_dict['blastp_filename'])
-    run_blastx(args=args, in_fasta=file_dict['intergenic_filename'], out_tsv=file_dict['blastx_filename'])
-
-    # Collect everything from the blast files
-    orfs = parse_blast(filename=file_dict['blastp_filename'], blast_format='BlastP')
-    intergenic_regions = parse_blast(filename=file_dict['blastx_filename'], blast_format='BlastX')
-    all_regions = orfs + intergenic_regions
-
-    # Sorted list of contigs containing only orfs, no intergenic regions
-    orfs_by_contig = sort_contigs(loc=split_regions_into_contigs(lori=orfs))
-    # Sorted list of contigs containing orfs and intergenic regions
-    all_regions_by_contig = sort_contigs(loc=split_regions_into_contigs(lori=all_regions))
-
-    pseudogenes = []
-    functional_genes = []
-
-    for contig_index, contig in enumerate(all_regions_by_contig):
-        print('\033[1m'+'%s\tChecking contig %s / %s for pseudogenes.\033[0m' % (current_time(),
-                                                                                 contig_index+1,
-                                                                                 len(all_regions_by_contig))),
-        sys.stdout.flush()
-
-        pseudos_on_contig = annotate_pseudos(args=args, contig=contig)  # Returns 'Contig' data type
-        pseudogenes.extend(pseudos_on_contig.regions)  # List of regions
-
-        try:
-            functional_genes_on_contig = get_functional_genes(contig=orfs_by_contig[contig_index],
-                                                              pseudos=pseudos_on_contig.regions)
-            functional_genes.extend(functional_genes_on_contig.regions)
-        except IndexError:  # If there are no orfs on a small contig, an error will be thrown when checking that contig.
-            continue
-
-        print('\t\t\tNumber of ORFs on this contig: %s\n'
-              '\t\t\tNumber of pseudogenes flagged: %s' % (
-                  len([region for region in contig.regions if region.region_type == RegionType.ORF]),
-                  len(pseudos_on_contig.regions))),
-        sys.stdout.flush()
-
-    # Write all output files
-    write_genes_to_gff(args, lopg=pseudogenes, gff=file_dict['pseudos_gff'])
-    write_genes_to_gff(args, lopg=functional_genes, gff=file_dict['functional_gff'])
-    write_pseudos_to_fasta(args, pseudofinder_regions=pseudogenes, outfile=file_dict['pseudos_fasta'])
-    # TODO: Activate this feature once you finish writing it
-    # write_functional_to_fasta(infile=file_dict['proteome_filename'], outfile=file_dict['functional_faa'],
-    #                           contigs=functional_genes)
-    genome_map.full(genome=args.genome, gff=file_dict['pseudos_gff'], outfile=file_dict['chromosome_map'])
-    write_summary_file(args=args, file_dict=file_dict)
+    # Parse the genome once, every following stage reads from this index
+    genome = genome_index.load_genome(args.genome)
+
+    stream = None  # With --overlap, the contigs that were checked while BLAST was running
+
+    def search(results: dict) -> dict:
+        nonlocal stream
+        on_blocks = None
+        if args.overlap:
+            stream = ContigStream(args=args, genome=genome, file_dict=file_dict)
+            on_blocks = stream.add_blocks
+        blast_results = run_blast(args=args, in_faa=file_dict['proteome_filename'],
+                                  in_fasta=file_dict['intergenic_filename'], blastp_out=file_dict['blastp_filename'],
+                                  blastx_out=file_dict['blastx_filename'], on_blocks=on_blocks)
+        blast_results['tier_settings'] = tier_settings(args)
+        return blast_results
+
+    def find_pseudogenes(results: dict) -> None:
+        blast_results = dict(results['blast'])
+        searched_with = blast_results.pop('tier_settings', {})
+        if searched_with and searched_with != tier_settings(args):
+            print('%s\tThe BLAST files were searched in tiers with other settings (%s). Queries resolved by one of '
+                  'the --tier_databases are not searched again; use --restart to search everything with the '
+                  'current settings.' % (current_time(), ', '.join('%s %s' % (name, value)
+                                                                   for name, value in sorted(searched_with.items())))),
+            sys.stdout.flush()
+
+        # Statistics of this run, reported in the log file. They include what the blast stage found in the hit cache,
+        # even if that stage was skipped.
+        stats = RunStats()
+        vars(stats).update(blast_results)
+        if stream is not None and stream.complete():
+            pseudogenes, functional_genes = stream.finish(stats)
+            write_output_files(args, genome, file_dict, pseudogenes=pseudogenes, functional_genes=functional_genes,
+                               stats=stats)
+        else:
+            annotate_blast_files(args=args, genome=genome, file_dict=file_dict, stats=stats)
+
+    # Every stage reads the files written by the ones before it (see pipeline.py).
+    # Stages that are still up to date from a previous run with the same prefix are skipped.
+    stages = [
+        # Collect sequences
+        pipeline.Stage(name='proteome',
+                       inputs=[args.genome],
+                       parameters={},
+                       outputs=[file_dict['proteome_filename']],
+                       run=lambda results: get_proteome(genome=genome, out_faa=file_dict['proteome_filename'])),
+        pipeline.Stage(name='intergenic regions',
+                       inputs=[args.genome],
+                       parameters={'search_intergenic_length': args.search_intergenic_length,
+                                   'contig_ends': args.contig_ends},
+                       outputs=[file_dict['intergenic_filename']],
+                       run=lambda results: get_intergenic_regions(args=args, genome=genome,
+                                                                  out_fasta=file_dict['intergenic_filename'])),
+        # Run blast
+        pipeline.Stage(name='blast',
+                       inputs=[file_dict['proteome_filename'], file_dict['intergenic_filename']],
+                       parameters=blast_parameters(args),
+                       outputs=[file_dict['blastp_filename'], file_dict['blastx_filename']],
+                       run=search),
+        # Find pseudogenes and write all output files
+        pipeline.Stage(name='annotate',
+                       inputs=[args.genome, file_dict['blastp_filename'], file_dict['blastx_filename']],
+                       parameters=logged_settings(args),
+                       outputs=[file_dict['pseudos_gff'], file_dict['pseudos_fasta'], file_dict['functional_gff'],
+                                file_dict['chromosome_map'], file_dict['log']],
+                       run=find_pseudogenes)
+    ]
+
+    manifest_file = pipeline.manifest_path(args.outprefix)
+    pipeline.run_stages(stages, manifest_file=manifest_file, restart=args.restart)
+    pipeline.record_settings(manifest_file, logged_settings(args), logfile=file_dict['log'])
+    if stream is not None:
+        stream.close()
 
 if __name__ == '__main__':
     main()
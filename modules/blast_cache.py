@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+"""
+Cache of parsed blast files, so that reannotate and visualize do not have to parse the same blast file again.
+
+Parsed results are stored in two places:
+    *In memory, keyed by the path, size and modification time of the blast file. A parameter sweep in visualize
+     only has to check the file with os.stat() after the first parse.
+    *On disk, keyed by the SHA-1 hash and size of the blast file (content-addressed). Later runs on the same
+     blast file, even if it was copied or renamed, load the pickled result instead of parsing the file.
+
+The on-disk store lives in $PSEUDOFINDER_CACHE_DIR (default: ~/.cache/pseudofinder). Setting it to an empty
+string disables it. Whenever an entry is written, the least recently used entries are evicted until the store is
+smaller than $PSEUDOFINDER_CACHE_SIZE megabytes (default: 2048). clear_cache() removes everything explicitly.
+"""
+
+# Bump this whenever the parsed representation changes, so that old entries are never loaded.
+CACHE_VERSION = 4
+CACHE_SUFFIX = ".pfcache"
+MEMORY_ENTRIES = 8  # Number of parsed files kept in memory
+
+_memory_cache = OrderedDict()  # (path, size, mtime, blast_format) -> parsed result
+_checksums = {}                # (path, size, mtime) -> SHA-1, so that a file is only hashed once per process
+
+
+def cache_directory() -> str:
+    """Returns the folder of the on-disk store, or an empty string if it is disabled."""
+    return os.environ.get('PSEUDOFINDER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pseudofinder'))
+
+
+def cache_size_limit() -> int:
+    """Maximum size of the on-disk store in bytes."""
+    return int(float(os.environ.get('PSEUDOFINDER_CACHE_SIZE', 2048)) * 1024 * 1024)
+
+
+def file_stamp(filename: str) -> tuple:
+    """Path, size and modification time of a file."""
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+
+def file_checksum(filename: str, stamp: tuple) -> str:
+    """SHA-1 hash of a file's contents. Only computed once per process for each version of a file."""
+
+    if stamp not in _checksums:
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as file_handle:
+            for block in iter(lambda: file_handle.read(1 << 20), b''):
+                sha1.update(block)
+        _checksums[stamp] = sha1.hexdigest()
+
+    return _checksums[stamp]
+
+
+def cache_entry(filename: str, stamp: tuple, blast_format: str) -> str:
+    """Path of the on-disk entry for a blast file."""
+    return os.path.join(cache_directory(), "%s_%d_%s_v%d%s" % (file_checksum(filename, stamp), stamp[1],
+                                                              blast_format, CACHE_VERSION, CACHE_SUFFIX))
+
+
+def cached_parse(filename: str, blast_format: str, parser):
+    """Returns parser(filename, blast_format), reusing a previous result for the same file if possible.
+    The same object is returned to every caller, so it must not be modified."""
+
+    stamp = file_stamp(filename)
+    memory_key = stamp + (blast_format,)
+
+    if memory_key in _memory_cache:
+        _memory_cache.move_to_end(memory_key)
+        return _memory_cache[memory_key]
+
+    result = None
+    entry = cache_entry(filename, stamp, blast_format) if cache_directory() else None
+
+    if entry is not None:
+        try:
+            with open(entry, 'rb') as entry_handle:
+                result = pickle.load(entry_handle)
+            os.utime(entry)  # Marks the entry as recently used
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            result = None
+
+    if result is None:
+        result = parser(filename, blast_format)
+        if entry is not None:
+            write_entry(entry, result)
+
+    _memory_cache[memory_key] = result
+    while len(_memory_cache) > MEMORY_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+    return result
+
+
+def write_entry(entry: str, result) -> None:
+    """Writes a parsed result to the on-disk store, then evicts old entries if the store is too big.
+    The store is only an optimisation, so failing to write it is not an error."""
+
+    temporary_file = "%s.%d.tmp" % (entry, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with open(temporary_file, 'wb') as entry_handle:
+            pickle.dump(result, entry_handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, entry)
+        evict(cache_size_limit())
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+def list_entries() -> list:
+    """All entries in the on-disk store as (path, size, last used), least recently used first."""
+
+    directory = cache_directory()
+    entries = []
+
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # Removed by another process in the meantime
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+
+    return sorted(entries, key=lambda e: e[2])
+
+
+def evict(max_size: int) -> None:
+    """Removes the least recently used entries from the on-disk store until it is at most max_size bytes."""
+
+    entries = list_entries()
+    total_size = sum(entry[1] for entry in entries)
+
+    for path, size, last_used in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def clear_cache(filename: str = None) -> None:
+    """Invalidates cached results. If a filename is given, only the entries of that blast file are removed,
+    otherwise the in-memory cache and the entire on-disk store are emptied."""
+
+    if filename is None:
+        _memory_cache.clear()
+        _checksums.clear()
+        evict(0)
+        return
+
+    stamp = file_stamp(filename)
+    for memory_key in [key for key in _memory_cache if key[0] == stamp[0]]:
+        del _memory_cache[memory_key]
+
+    if cache_directory():
+        prefix = "%s_%d_" % (file_checksum(filename, stamp), stamp[1])
+        for path, size, last_used in list_entries():
+            if os.path.basename(path).startswith(prefix):
+                os.remove(path)
@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, List, Callable, Dict
+from time import localtime, strftime
+
+import numpy
+
+from . import hit_cache
+
+"""
+Runs BLAST searches as several concurrent BLAST processes, within a total number of threads.
+
+BLAST does not use many threads well, so instead of a single process with every thread, the query file of each search
+is split into shards with about the same number of residues, and each shard is searched by its own process with a few
+threads. Shards of all searches are interleaved (ie. blastp, blastx, blastp, ...), so that both searches progress at
+the same time and neither has to wait for the other to finish.
+
+Shards hold consecutive queries of the original file, so their outputs (outfmt 7) are joined back in shard order into
+the same file a single BLAST process would have written. A shard that fails, or takes longer than the timeout, is run
+again on its own.
+
+The BLAST processes of all shards are run from a single asyncio event loop. While they run, the "# Query:" lines of
+their outputs are counted to report the number of queries searched per second and the time left. If a shard fails for
+good or the run is interrupted (ie. Ctrl+C), every BLAST process that is still running is killed before returning.
+
+Before that, queries with the same sequence are only searched once (ie. copies of a transposase), and queries whose
+results are in the hit cache (see hit_cache.py) are not searched at all. The block of every query is then taken from
+the new search, from the query with the same sequence or from the cache, in the order of the queries, and given the
+name of its query. The output is the same as if every query had been searched.
+
+Searches can also be run in tiers (see run_tiered_searches): the same queries against several databases in turn, where
+only the queries that are not resolved by one database are searched against the next one.
+
+Or in two passes (see run_adaptive_searches): every query with a small hitcap first, and only the queries that reached
+it again with the full hitcap.
+
+Callers that want to use the results before every search is done (see annotate --overlap) can pass on_blocks, which
+is given the blocks of the queries as soon as they are known: those from the cache at the start, and those of every
+shard (with the queries that have the same sequence) as soon as the shard is done.
+"""
+
+# A BLAST search of every query in a fasta file.
+# command(query, out, threads) returns the command line of a BLAST process that searches the fasta file 'query', as a
+# list of arguments or as an object that gives the command line as a string (ie. NcbiblastpCommandline).
+# If finish is not None, finish(query, out) is called once the command is done, ie. to convert the output of another
+# search engine into outfmt 7 (see search_engines.py).
+# settings describes everything apart from the queries that changes the results (see hit_cache.search_settings).
+Search = NamedTuple('Search', [('name', str),
+                               ('query', str),
+                               ('out', str),
+                               ('command', Callable),
+                               ('finish', Callable),
+                               ('settings', str)])
+
+# Some consecutive queries of a search, written to their own fasta file, and their own output file.
+# records are the numbers of these queries in the query file of the search.
+Shard = NamedTuple('Shard', [('search', Search),
+                             ('number', int),
+                             ('query', str),
+                             ('out', str),
+                             ('records', List[int])])
+
+# Number of queries of a search that were found in the hit cache, that had the same sequence as another query, and that
+# were searched.
+QueryCounts = NamedTuple('QueryCounts', [('cached', int),
+                                         ('duplicate', int),
+                                         ('searched', int)])
+
+# Result of a single tier of run_tiered_searches(): the QueryCounts of every search, the number of queries and residues
+# that were searched in this tier and resolved by it, and how long it took.
+TierResult = NamedTuple('TierResult', [('counts', List[QueryCounts]),
+                                       ('queries', int),
+                                       ('residues', int),
+                                       ('resolved_queries', int),
+                                       ('resolved_residues', int),
+                                       ('seconds', float)])
+
+# Last line of an outfmt 7 file, ie. "# BLAST processed 412 queries"
+BLAST_FOOTER = "# BLAST processed "
+# Line that names the query of a block in an outfmt 7 file, ie. "# Query: COGCCIIJ_00001 COGCCIIJ_1 [115:223](+)"
+QUERY_LINE = "# Query:"
+# Seconds between two progress reports while shards are running
+PROGRESS_INTERVAL = 5
+
+
+def current_time() -> str:
+    """Returns the current time when this function was executed."""
+    return str(strftime("%Y-%m-%d %H:%M:%S", localtime()))
+
+
+def run_searches(searches: List[Search], threads: int, threads_per_search: int, retries: int,
+                 cache: hit_cache.HitCache = None, on_blocks: Callable = None, timeout: float = None) -> List[QueryCounts]:
+    """Runs every search, with every sequence only searched once and without the queries that are in the hit cache
+    (if one is given). The results of the queries that were searched are added to the cache.
+    If on_blocks is given, on_blocks(search, {query number: block}) is called with the blocks of the queries of a
+    search as soon as they are known, once for every query. Calls never overlap: the blocks from the cache are given
+    in the thread of the caller, those of the shards in a thread of their own while BLAST runs (see run_shards()).
+    Returns the QueryCounts of every search."""
+
+    lookups = []  # (records, their keys, blocks found in the cache, search of the unique missing queries)
+    for search in searches:
+        records = read_fasta_records(search.query)
+        keys = [hit_cache.query_key(search.settings, record_sequence(record)) for record in records]
+        found = cache.lookup(keys) if cache is not None else {}
+
+        # The first query with each sequence that is not in the cache represents all the others
+        representatives = {}
+        for number, key in enumerate(keys):
+            if key not in found:
+                representatives.setdefault(key, number)
+
+        missing = Search(name=search.name, query=search.out + ".missing.fasta", out=search.out + ".missing.tsv",
+                         command=search.command, finish=search.finish, settings=search.settings)
+        with open(missing.query, 'w') as query_file:
+            query_file.writelines(records[number] for number in representatives.values())
+        lookups.append((records, keys, found, representatives, missing))
+
+        if on_blocks is not None:
+            on_blocks(search, {number: named_block(found[key], record)
+                               for number, (record, key) in enumerate(zip(records, keys)) if key in found})
+
+    searches_by_missing = {lookup[-1].out: (search, lookup) for search, lookup in zip(searches, lookups)}
+
+    def blocks_of_shard(shard: Shard) -> None:
+        search, (records, keys, found, representatives, missing) = searches_by_missing[shard.search.out]
+        on_blocks(search, shard_blocks(shard, records, keys, representatives))
+
+    run_shards([lookup[-1] for lookup in lookups if lookup[3]],
+               threads=threads, threads_per_search=threads_per_search, retries=retries,
+               on_shard=blocks_of_shard if on_blocks is not None else None, timeout=timeout)
+
+    counts = []
+    for search, (records, keys, found, representatives, missing) in zip(searches, lookups):
+        searched = read_blocks(missing.out) if representatives else []  # Blocks of the representatives, in order
+        if len(searched) != len(representatives):
+            raise ValueError("%s did not report every query of %s." % (search.name, missing.query))
+
+        searched = dict(zip(representatives.values(), searched))  # query number -> block
+        results = dict(found)
+        results.update((key, anonymous_block(searched[number])) for key, number in representatives.items())
+        if cache is not None:
+            cache.store({key: results[key] for key in representatives})
+
+        with open(search.out, 'w') as output:
+            for number, (record, key) in enumerate(zip(records, keys)):
+                output.write(searched[number] if number in searched else named_block(results[key], record))
+            output.write("%s%d queries\n" % (BLAST_FOOTER, len(records)))
+
+        for path in (missing.query, missing.out):
+            if os.path.exists(path):
+                os.remove(path)
+
+        cached = sum(key in found for key in keys)
+        counts.append(QueryCounts(cached=cached,
+                                  duplicate=len(records) - cached - len(representatives),
+                                  searched=len(representatives)))
+
+    return counts
+
+
+def run_tiered_searches(tiers: List[List[Search]], resolved: Callable, threads: int, threads_per_search: int,
+                        retries: int, cache: hit_cache.HitCache = None, on_blocks: Callable = None,
+                        timeout: float = None) -> List[TierResult]:
+    """Runs the same searches against several databases in turn. tiers holds the searches of every tier, in the same
+    order (ie. [[BlastP, BlastX] of the first database, [BlastP, BlastX] of the second, ...]), all with the query and
+    output files of the first tier.
+
+    Every query is searched in the first tier. resolved(search, blocks) returns whether each of the blocks of the
+    search settles its query, and those that do not are searched again in the next tier. The output of a search has,
+    for every query, the block of the tier that resolved it, or of the last tier. on_blocks (see run_searches()) is
+    only given those blocks. Returns the TierResult of every tier."""
+
+    first_tier = tiers[0]
+    records = [read_fasta_records(search.query) for search in first_tier]
+    remaining = [list(range(len(search_records))) for search_records in records]  # Query numbers that go on
+    final_blocks = [{} for search in first_tier]  # Query number -> block, for every search
+    tier_results = []
+
+    for tier_number, searches in enumerate(tiers):
+        last_tier = tier_number == len(tiers) - 1
+        tier_searches = [search._replace(query="%s.tier%d.fasta" % (search.out, tier_number),
+                                         out="%s.tier%d.tsv" % (search.out, tier_number)) for search in searches]
+        for tier_search, search_records, numbers in zip(tier_searches, records, remaining):
+            with open(tier_search.query, 'w') as query_file:
+                query_file.writelines(search_records[number] for number in numbers)
+
+        def on_tier_blocks(tier_search: Search, blocks: Dict[int, str]) -> None:
+            search_number = [search.out for search in tier_searches].index(tier_search.out)
+            numbers = list(blocks)
+            settled = [True] * len(numbers) if last_tier else resolved(tier_search, [blocks[n] for n in numbers])
+            on_blocks(first_tier[search_number], {remaining[search_number][number]: blocks[number]
+                                                  for number, is_settled in zip(numbers, settled) if is_settled})
+
+        start_time = time.monotonic()
+        counts = run_searches(tier_searches, threads=threads, threads_per_search=threads_per_search, retries=retries,
+                              cache=cache, on_blocks=on_tier_blocks if on_blocks is not None else None,
+                              timeout=timeout)
+        seconds = time.monotonic() - start_time
+
+        queries = residues = resolved_queries = resolved_residues = 0
+        for search_number, tier_search in enumerate(tier_searches):
+            blocks = read_blocks(tier_search.out)
+            settled = [True] * len(blocks) if last_tier else resolved(tier_search, blocks)
+            next_tier = []
+            for number, block, is_settled in zip(remaining[search_number], blocks, settled):
+                length = record_length(records[search_number][number])
+                queries += 1
+                residues += length
+                if is_settled:
+                    final_blocks[search_number][number] = block
+                    resolved_queries += 1
+                    resolved_residues += length
+                else:
+                    next_tier.append(number)
+            remaining[search_number] = next_tier
+
+            for path in (tier_search.query, tier_search.out):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        tier_results.append(TierResult(counts=counts, queries=queries, residues=residues,
+                                       resolved_queries=resolved_queries, resolved_residues=resolved_residues,
+                                       seconds=seconds))
+
+    for search, search_records, blocks in zip(first_tier, records, final_blocks):
+        with open(search.out, 'w') as output:
+            output.writelines(blocks[number] for number in range(len(search_records)))
+            output.write("%s%d queries\n" % (BLAST_FOOTER, len(search_records)))
+
+    return tier_results
+
+
+def run_adaptive_searches(first_pass: List[Search], full: List[Search], first_hitcap: int, threads: int,
+                          threads_per_search: int, retries: int, cache: hit_cache.HitCache = None,
+                          on_blocks: Callable = None, timeout: float = None) -> tuple:
+    """Runs searches in two passes: first_pass are the searches with a small hitcap (first_hitcap), and full the same
+    searches (in the same order, with the same query and output files) with the full hitcap.
+
+    Every query is searched in the first pass. Queries with fewer hits than first_hitcap already have every hit there
+    is, and the others are searched again with the full hitcap. The output of a search has the block of the full
+    search for those, so it is the same as if every query had been searched with the full hitcap. on_blocks (see
+    run_searches()) is given the blocks of the queries that have all their hits after the first pass, and those of
+    the others as soon as they are searched again.
+
+    Returns the QueryCounts of every search in each pass, and the number of queries of every search that were
+    searched again, as (first pass counts, full counts, numbers searched again)."""
+
+    outputs = [search.out for search in full]
+    first_pass = [search._replace(out=search.out + ".first_pass.tsv") for search in first_pass]
+    again = [search._replace(query=search.out + ".full.fasta", out=search.out + ".full.tsv") for search in full]
+
+    first_counts = run_searches(first_pass, threads=threads, threads_per_search=threads_per_search, retries=retries,
+                                cache=cache, timeout=timeout)
+    records = [read_fasta_records(search.query) for search in first_pass]
+    blocks = [read_blocks(search.out) for search in first_pass]
+
+    # Queries that reached the small hitcap, and may have more hits
+    capped = [[number for number, block in enumerate(search_blocks) if count_hits(block) >= first_hitcap]
+              for search_blocks in blocks]
+
+    for search, again_search, search_records, search_blocks, numbers in zip(full, again, records, blocks, capped):
+        with open(again_search.query, 'w') as query_file:
+            query_file.writelines(search_records[number] for number in numbers)
+        if on_blocks is not None:
+            numbers = set(numbers)
+            on_blocks(search, {number: block for number, block in enumerate(search_blocks) if number not in numbers})
+
+    def on_full_blocks(again_search: Search, full_blocks: Dict[int, str]) -> None:
+        search_number = [search.out for search in again].index(again_search.out)
+        on_blocks(full[search_number], {capped[search_number][number]: block for number, block in full_blocks.items()})
+
+    full_counts = run_searches(again, threads=threads, threads_per_search=threads_per_search, retries=retries,
+                               cache=cache, on_blocks=on_full_blocks if on_blocks is not None else None,
+                               timeout=timeout)
+
+    for search_number, search in enumerate(again):
+        for number, block in zip(capped[search_number], read_blocks(search.out)):
+            blocks[search_number][number] = block
+
+        with open(outputs[search_number], 'w') as output:
+            output.writelines(blocks[search_number])
+            output.write("%s%d queries\n" % (BLAST_FOOTER, len(blocks[search_number])))
+
+        for path in (first_pass[search_number].out, search.query, search.out):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return first_counts, full_counts, [len(numbers) for numbers in capped]
+
+
+def count_hits(block: str) -> int:
+    """Number of hits in the block of a query."""
+    return sum(1 for line in block.splitlines() if line and not line.startswith("#"))
+
+
+def seconds_saved(tier_results: List[TierResult]) -> float:
+    """Estimated time saved by not searching the queries that a tier resolved in the tiers after it, from the time
+    every later tier took per residue. Tiers that searched nothing are left out, as their speed is unknown."""
+
+    saved = 0.0
+    for tier_number, tier in enumerate(tier_results):
+        for later_tier in tier_results[tier_number + 1:]:
+            if later_tier.residues > 0:
+                saved += tier.resolved_residues * later_tier.seconds / later_tier.residues
+
+    return saved
+
+
+def run_shards(searches: List[Search], threads: int, threads_per_search: int, retries: int,
+               on_shard: Callable = None, timeout: float = None) -> None:
+    """Runs every search in shards, using at most 'threads' threads in total: threads // threads_per_search BLAST
+    processes run at the same time, each with threads_per_search threads. A shard is tried retries + 1 times before
+    giving up, and an attempt that takes more than timeout seconds (if given) is killed and counts as failed.
+    If on_shard is given, on_shard(shard) is called as soon as a shard is done. It runs in a thread of its own, so that
+    it does not hold up the shards that are still running, one shard at a time in the order they finish. Every call is
+    done before run_shards() returns."""
+
+    if not searches:
+        return
+
+    processes = max(1, threads // threads_per_search)
+
+    shards_by_search = [split_query(search, number_of_shards=processes) for search in searches]
+    interleaved = [shard for shards in itertools.zip_longest(*shards_by_search) for shard in shards if shard is not None]
+
+    try:
+        asyncio.run(run_shards_in_loop(interleaved, processes=processes, threads_per_search=threads_per_search,
+                                       retries=retries, timeout=timeout, on_shard=on_shard))
+    finally:
+        print('')  # Necessary because the progress reports roll back on themselves
+
+    for search, shards in zip(searches, shards_by_search):
+        merge_shards(search, shards)
+        shutil.rmtree(shard_folder(search))
+
+
+def read_blocks(filename: str) -> List[str]:
+    """Splits an outfmt 7 file into the blocks of its queries, in order. A block starts with the line that names
+    the BLAST program (ie. "# BLASTP 2.9.0+"), and the "# BLAST processed" line at the end is left out."""
+
+    blocks = []
+
+    with open(filename, 'r') as blast_output:
+        for line in blast_output:
+            if line.startswith(BLAST_FOOTER):
+                continue
+            if line.startswith("# BLAST") or not blocks:
+                blocks.append(line)
+            else:
+                blocks[-1] += line
+
+    return blocks
+
+
+async def run_shards_in_loop(shards: List[Shard], processes: int, threads_per_search: int, retries: int,
+                             timeout: float, on_shard: Callable) -> None:
+    """Runs the shards in order, at most 'processes' at the same time, and reports the progress until all are done.
+    If a shard fails for good, or SIGINT is received, the shards that are still running are killed and the others are
+    not started. SIGINT is then raised again as KeyboardInterrupt.
+    on_shard (see run_shards()) is handed to a single worker thread with loop.run_in_executor(), so the event loop
+    keeps starting shards and reporting progress while it runs."""
+
+    progress = SearchProgress(shards)
+    slots = asyncio.Semaphore(processes)
+    tasks = [asyncio.ensure_future(run_shard(shard, threads_per_search, retries, timeout, slots, progress))
+             for shard in shards]
+    reporter = asyncio.ensure_future(progress.report_every(PROGRESS_INTERVAL))
+
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    interrupted = []
+    callbacks = ThreadPoolExecutor(max_workers=1) if on_shard is not None else None
+    pending = []  # on_shard() of every finished shard
+
+    def interrupt() -> None:
+        interrupted.append(True)
+        main_task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    except (NotImplementedError, RuntimeError, ValueError):  # ie. on Windows, or outside of the main thread
+        pass
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            shard = await next_done
+            progress.finished(shard)
+            if callbacks is not None:
+                pending.append(loop.run_in_executor(callbacks, on_shard, shard))
+            progress.report()
+        await asyncio.gather(*pending)
+    except asyncio.CancelledError:
+        if interrupted:
+            raise KeyboardInterrupt
+        raise
+    finally:
+        for task in tasks + [reporter] + pending:
+            task.cancel()
+        await asyncio.gather(*tasks, reporter, *pending, return_exceptions=True)
+        if callbacks is not None:
+            callbacks.shutdown(wait=True)  # Lets a call that has already started finish
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+
+class SearchProgress:
+    """Number of queries that the shards have searched so far, counted from the "# Query:" lines in their outputs,
+    which BLAST writes as it goes."""
+
+    def __init__(self, shards: List[Shard]):
+        self.total_queries = sum(len(shard.records) for shard in shards)
+        self.total_shards = len(shards)
+        self.finished_shards = 0
+        self.outputs = {}  # output file of a running or finished shard -> [bytes read, queries counted]
+        self.start_time = time.monotonic()
+
+    def started(self, shard: Shard) -> None:
+        """A shard (re)starts from scratch, so its output is counted again."""
+        self.outputs[shard.out] = [0, 0]
+
+    def finished(self, shard: Shard) -> None:
+        self.outputs[shard.out] = [None, len(shard.records)]
+        self.finished_shards += 1
+
+    def update(self) -> None:
+        """Counts the "# Query:" lines that were written since the last update, up to the last complete line."""
+
+        for out, counts in self.outputs.items():
+            if counts[0] is None:  # Finished
+                continue
+            try:
+                with open(out, 'rb') as output:
+                    output.seek(counts[0])
+                    text = output.read()
+            except OSError:  # Not written yet
+                continue
+
+            text = text[:text.rfind(b"\n") + 1]
+            counts[0] += len(text)
+            counts[1] += sum(line.startswith(QUERY_LINE.encode()) for line in text.split(b"\n"))
+
+    def report(self) -> None:
+        """Prints the number of queries searched, queries per second and the estimated time left, on a single line."""
+
+        searched = min(self.total_queries, sum(counts[1] for counts in self.outputs.values()))
+        elapsed = time.monotonic() - self.start_time
+        rate = searched / elapsed if elapsed > 0 else 0.0
+
+        if searched == self.total_queries:
+            time_left = "done"
+        elif rate > 0:
+            seconds = int((self.total_queries - searched) / rate)
+            time_left = "%d:%02d:%02d left" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+        else:
+            time_left = "time left unknown"
+
+        print("%s\tBLAST: %s / %s queries searched (%.1f queries/s, %s), shards finished: %s / %s" % (
+            current_time(), searched, self.total_queries, rate, time_left, self.finished_shards, self.total_shards),
+            end='\r')
+        sys.stdout.flush()
+
+    async def report_every(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.update()
+            self.report()
+
+
+def shard_blocks(shard: Shard, records: List[str], keys: List[str], representatives: Dict[str, int]) -> Dict[int, str]:
+    """Blocks of the queries that a finished shard has searched, as {query number: block} in the numbers of the
+    original query file. Shards search the representatives only (see run_searches), so the queries with the same
+    sequence as one of them get its block too."""
+
+    searched = read_blocks(shard.out)
+    if len(searched) != len(shard.records):
+        raise ValueError("%s did not report every query of %s." % (shard.search.name, shard.query))
+
+    representative_numbers = list(representatives.values())
+    blocks = {representative_numbers[record]: block for record, block in zip(shard.records, searched)}
+
+    for number, key in enumerate(keys):
+        representative = representatives.get(key)
+        if representative is not None and representative != number and representative in blocks:
+            blocks[number] = named_block(anonymous_block(blocks[representative]), records[number])
+
+    return blocks
+
+
+def anonymous_block(block: str) -> str:
+    """A block without the name of its query, which is removed from its "# Query:" line and from every hit."""
+
+    lines = []
+    for line in block.splitlines(keepends=True):
+        if line.startswith(QUERY_LINE):
+            lines.append(QUERY_LINE + "\n")
+        elif line.startswith("#"):
+            lines.append(line)
+        else:
+            lines.append("\t" + line.split("\t", 1)[1])
+
+    return "".join(lines)
+
+
+def named_block(block: str, record: str) -> str:
+    """Gives an anonymous block the name of a query (from its fasta record), as BLAST would have written it."""
+
+    description = record.splitlines()[0][1:].strip()
+    query_id = description.split()[0]
+
+    lines = []
+    for line in block.splitlines(keepends=True):
+        if line.startswith(QUERY_LINE):
+            lines.append("%s %s\n" % (QUERY_LINE, description))
+        elif line.startswith("#"):
+            lines.append(line)
+        else:
+            lines.append(query_id + line)
+
+    return "".join(lines)
+
+
+def shard_folder(search: Search) -> str:
+    """Folder that holds the shards of a search while it runs, next to its output file."""
+    return search.out + ".shards"
+
+
+def split_query(search: Search, number_of_shards: int) -> List[Shard]:
+    """Splits the query file of a search into at most number_of_shards files of consecutive queries, with about the
+    same number of residues each. A query is never split, so a very long one may get a shard to itself."""
+
+    records = read_fasta_records(search.query)
+    lengths = numpy.array([record_length(record) for record in records], dtype=numpy.int64)
+    total = int(lengths.sum())
+
+    # Every query goes to the shard that contains its middle residue
+    if total > 0:
+        middles = numpy.cumsum(lengths) - lengths / 2
+        shard_of_record = numpy.minimum(middles * number_of_shards // total, number_of_shards - 1).astype(numpy.int64)
+    else:
+        shard_of_record = numpy.zeros(len(records), dtype=numpy.int64)
+
+    folder = shard_folder(search)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    shards = []
+    # Empty shards are skipped, but an empty query file still gets one (empty) shard
+    for shard_number in sorted(set(shard_of_record.tolist())) or [0]:
+        shard = Shard(search=search,
+                      number=len(shards),
+                      query=os.path.join(folder, "%d.fasta" % len(shards)),
+                      out=os.path.join(folder, "%d.tsv" % len(shards)),
+                      records=numpy.flatnonzero(shard_of_record == shard_number).tolist())
+        with open(shard.query, 'w') as query_file:
+            query_file.writelines(record for record, number in zip(records, shard_of_record.tolist())
+                                  if number == shard_number)
+        shards.append(shard)
+
+    return shards
+
+
+def read_fasta_records(filename: str) -> List[str]:
+    """Reads a fasta file as a list of records, each one the text of its header line and sequence lines.
+    Records are kept exactly as they are written, so that the queries BLAST sees do not change."""
+
+    records = []
+
+    with open(filename, 'r') as fasta:
+        for line in fasta:
+            if line.startswith(">") or not records:
+                records.append(line)
+            else:
+                records[-1] += line
+
+    return records
+
+
+def record_length(record: str) -> int:
+    """Number of residues in a fasta record."""
+    return len(record_sequence(record))
+
+
+def record_sequence(record: str) -> str:
+    """Sequence of a fasta record, on a single line."""
+    return "".join(line.strip() for line in record.splitlines()[1:])
+
+
+async def run_shard(shard: Shard, threads: int, retries: int, timeout: float, slots: asyncio.Semaphore,
+                    progress: SearchProgress) -> Shard:
+    """Runs BLAST on a single shard once one of the slots is free, and runs it again (from scratch) if it fails."""
+
+    async with slots:
+        for attempt in range(retries + 1):
+            progress.started(shard)
+            try:
+                await run_command(shard.search.command(query=shard.query, out=shard.out, threads=threads), timeout)
+                if shard.search.finish is not None:
+                    shard.search.finish(query=shard.query, out=shard.out)
+                return shard
+            except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as error:
+                if attempt == retries:
+                    raise
+                print("\n%s\t%s shard %s failed (%s), trying again." % (current_time(), shard.search.name,
+                                                                        shard.number, error))
+                sys.stdout.flush()
+
+
+async def run_command(command, timeout: float) -> None:
+    """Runs a command line (a list of arguments or ie. NcbiblastpCommandline) as a child process. Raises
+    CalledProcessError if it fails, and TimeoutExpired if it takes more than timeout seconds. The process is killed if
+    it is cancelled or too slow."""
+
+    arguments = command if isinstance(command, list) else shlex.split(str(command))
+    process = await asyncio.create_subprocess_exec(*arguments, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(arguments, timeout)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, arguments, output=stdout, stderr=stderr)
+
+
+def merge_shards(search: Search, shards: List[Shard]) -> None:
+    """Joins the outputs of the shards of a search into its output file, in shard order (the order of the queries).
+    The "# BLAST processed" line that ends every shard is replaced by a single one for all queries."""
+
+    processed = None
+
+    with open(search.out, 'w') as output:
+        for shard in shards:
+            with open(shard.out, 'r') as shard_output:
+                for line in shard_output:
+                    if line.startswith(BLAST_FOOTER):
+                        processed = (processed or 0) + int(line.split()[3])
+                    else:
+                        output.write(line)
+
+        if processed is not None:
+            output.write("%s%d queries\n" % (BLAST_FOOTER, processed))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import NamedTuple, List, Dict
+
+from Bio import SeqIO
+
+# Sidecar index layout: MAGIC, the length of the JSON header as an unsigned 64 bit integer, the JSON header
+# (contigs, features, translations and the fingerprint of the genome) and finally every contig sequence laid
+# end to end in a single blob. The blob is memory mapped when the index is loaded.
+SIDECAR_SUFFIX = ".pfidx"
+SIDECAR_MAGIC = b"PFIDX001"
+SIDECAR_LENGTH = struct.Struct("<Q")
+
+# Data definitions
+# A single CDS or gene feature, with its coordinates stored the same way Biopython reports them (0-based, end exclusive).
+GenomeFeature = NamedTuple('GenomeFeature', [('locus_tag', str),
+                                             ('start', int),
+                                             ('end', int),
+                                             ('strand', int),
+                                             ('location', str),      # Biopython location string, ie. '[0:1407](+)'
+                                             ('translation', str)])  # Empty for gene features
+
+# Everything pseudofinder needs to know about a single contig from the genbank file.
+ContigRecord = NamedTuple('ContigRecord', [('name', str),
+                                           ('id', str),
+                                           ('length', int),
+                                           ('seq', object),  # Any sliceable sequence (Bio.Seq or str-like)
+                                           ('cds', List[GenomeFeature]),
+                                           ('genes', List[GenomeFeature])])
+
+# The whole genome, parsed once and shared by every stage of the pipeline.
+GenomeIndex = NamedTuple('GenomeIndex', [('filename', str),
+                                         ('contigs', List[ContigRecord]),
+                                         ('by_name', Dict[str, ContigRecord])])
+
+
+class MappedSequence:
+    """A read-only slice of the memory mapped sequence blob, which behaves like a sequence for len() and slicing."""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, length: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key) -> str:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return self.buffer[self.offset + start:self.offset + stop].decode('ascii')[::step]
+            return self.buffer[self.offset + start:self.offset + max(start, stop)].decode('ascii')
+        else:
+            if key < 0:
+                key += self.length
+            if not 0 <= key < self.length:
+                raise IndexError("sequence index out of range")
+            return chr(self.buffer[self.offset + key])
+
+    def __str__(self) -> str:
+        return self[:]
+
+
+def load_genome(genome: str) -> GenomeIndex:
+    """Returns the GenomeIndex for a genbank file, using the sidecar index next to the genome whenever it is
+    still up to date. If it is missing or stale, the genbank file is parsed and a new sidecar is written."""
+
+    sidecar = genome + SIDECAR_SUFFIX
+
+    try:
+        return read_sidecar(genome, sidecar)
+    except (OSError, ValueError, KeyError):  # Missing, stale or unreadable index, fall back to the genbank file
+        pass
+
+    index = read_genome(genome)
+
+    try:
+        write_sidecar(index, sidecar)
+    except OSError:  # The folder containing the genome may not be writable. The index is only an optimisation.
+        pass
+
+    return index
+
+
+def genome_fingerprint(genome: str) -> dict:
+    """Size and modification time of a genome file, used to quickly decide if a sidecar index is still valid."""
+    stat = os.stat(genome)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def genome_checksum(genome: str) -> str:
+    """SHA-1 hash of the genome file contents."""
+    sha1 = hashlib.sha1()
+    with open(genome, 'rb') as genome_handle:
+        for block in iter(lambda: genome_handle.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def write_sidecar(index: GenomeIndex, sidecar: str) -> None:
+    """Writes the GenomeIndex to a sidecar file that can be loaded by read_sidecar() in later runs."""
+
+    header = {'genome': genome_fingerprint(index.filename),
+              'sha1': genome_checksum(index.filename),
+              'contigs': []}
+    offset = 0
+
+    for contig in index.contigs:
+        header['contigs'].append({'name': contig.name,
+                                  'id': contig.id,
+                                  'length': contig.length,
+                                  'offset': offset,
+                                  'cds': [list(feature) for feature in contig.cds],
+                                  'genes': [list(feature) for feature in contig.genes]})
+        offset += contig.length
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+
+    # Written to a temporary file first, so that an interrupted run never leaves a half written index behind
+    temporary_file = "%s.%d.tmp" % (sidecar, os.getpid())
+    try:
+        with open(temporary_file, 'wb') as sidecar_handle:
+            sidecar_handle.write(SIDECAR_MAGIC + SIDECAR_LENGTH.pack(len(header_bytes)) + header_bytes)
+            for contig in index.contigs:
+                sidecar_handle.write(str(contig.seq).encode('ascii'))
+        os.replace(temporary_file, sidecar)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+def read_sidecar(genome: str, sidecar: str) -> GenomeIndex:
+    """Loads a sidecar index and memory maps its sequences.
+    Raises ValueError if the index does not belong to the current version of the genome file."""
+
+    with open(sidecar, 'rb') as sidecar_handle:
+        if sidecar_handle.read(len(SIDECAR_MAGIC)) != SIDECAR_MAGIC:
+            raise ValueError("%s is not a pseudofinder genome index." % sidecar)
+        header_length = SIDECAR_LENGTH.unpack(sidecar_handle.read(SIDECAR_LENGTH.size))[0]
+        header = json.loads(sidecar_handle.read(header_length).decode())
+
+        # Size and modification time are checked first. If the file was touched or copied,
+        # its contents may still be the same, which is settled by the checksum.
+        if header['genome'] != genome_fingerprint(genome) and header['sha1'] != genome_checksum(genome):
+            raise ValueError("%s is out of date." % sidecar)
+
+        blob_start = len(SIDECAR_MAGIC) + SIDECAR_LENGTH.size + header_length
+        if os.fstat(sidecar_handle.fileno()).st_size > blob_start:
+            buffer = mmap.mmap(sidecar_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # A genome without any sequence cannot be memory mapped
+            buffer = b''
+
+    contigs = []
+    for contig in header['contigs']:
+        contigs.append(ContigRecord(name=contig['name'],
+                                    id=contig['id'],
+                                    length=contig['length'],
+                                    seq=MappedSequence(buffer, blob_start + contig['offset'], contig['length']),
+                                    cds=[GenomeFeature(*feature) for feature in contig['cds']],
+                                    genes=[GenomeFeature(*feature) for feature in contig['genes']]))
+
+    return GenomeIndex(filename=genome,
+                       contigs=contigs,
+                       by_name={contig.name: contig for contig in contigs})
+
+
+def read_genome(genome: str) -> GenomeIndex:
+    """Parses a genbank file a single time and returns all contigs and features in a GenomeIndex."""
+
+    contigs = []
+
+    for seq_record in SeqIO.parse(genome, "genbank"):
+        cds_list = []
+        gene_list = []
+
+        for seq_feature in seq_record.features:
+            if seq_feature.type == "CDS":
+                assert len(seq_feature.qualifiers['translation']) == 1
+                cds_list.append(make_feature(seq_feature, translation=seq_feature.qualifiers['translation'][0]))
+
+            elif seq_feature.type == "gene":  # Only present if prokka was run with --compliant flag
+                gene_list.append(make_feature(seq_feature, translation=''))
+
+        contigs.append(ContigRecord(name=seq_record.name,
+                                    id=seq_record.id,
+                                    length=len(seq_record),
+                                    seq=seq_record.seq,
+                                    cds=cds_list,
+                                    genes=gene_list))
+
+    return GenomeIndex(filename=genome,
+                       contigs=contigs,
+                       by_name={contig.name: contig for contig in contigs})
+
+
+def make_feature(seq_feature, translation: str) -> GenomeFeature:
+    """Converts a Biopython SeqFeature into the lightweight GenomeFeature stored in the index."""
+
+    try:
+        locus_tag = seq_feature.qualifiers['locus_tag'][0]
+    except KeyError:
+        locus_tag = ''
+
+    return GenomeFeature(locus_tag=locus_tag,
+                         start=int(seq_feature.location.start),
+                         end=int(seq_feature.location.end),
+                         strand=seq_feature.location.strand,
+                         location=str(seq_feature.location),
+                         translation=translation)
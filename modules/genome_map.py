@@ -7,8 +7,11 @@ from time import localtime, strftime
 from reportlab.lib import colors
 from Bio.Graphics import GenomeDiagram
 from Bio import SeqIO
+from Bio.Seq import Seq
 from Bio.SeqFeature import FeatureLocation, SeqFeature
 
+from . import genome_index
+
 
 def current_time() -> str:
     """Returns the current time when this function was executed."""
@@ -41,11 +44,22 @@ def get_args():
     return args
 
 
-def read_gbk(genome: str) -> SeqIO.SeqRecord:
-    """Reads the input genome file and concatenates all contigs into a single SeqRecord."""
-    whole_record = SeqIO.SeqRecord(seq="", id="", name="", features=None)  # Blank SeqRecord that will be added to
-    for record in SeqIO.parse(handle=genome, format='genbank'):  # Merge all contigs into one large SeqRecord
-        whole_record += record
+def read_gbk(genome: genome_index.GenomeIndex) -> SeqIO.SeqRecord:
+    """Concatenates all contigs from the genome index into a single SeqRecord holding every gene feature."""
+
+    feature_list = []   # Gene features with positions shifted to their absolute position in the genome
+    previous_absolute_end = 0   # Contigs are laid end to end, so we use this to track distance
+
+    for contig in genome.contigs:
+        for gene in contig.genes:
+            feature_list.append(SeqFeature(FeatureLocation(previous_absolute_end+gene.start,
+                                                           previous_absolute_end+gene.end,
+                                                           strand=gene.strand), type='gene'))
+        previous_absolute_end += contig.length
+
+    # Only the length of the sequence is used when drawing, so there is no need to copy the nucleotides
+    whole_record = SeqIO.SeqRecord(seq=Seq(None, length=previous_absolute_end), id="", name="", features=feature_list)
+
     return whole_record
 
 
@@ -132,13 +146,13 @@ def make_diagram(genome_record: SeqIO.SeqRecord, pseudo_record: SeqIO.SeqRecord,
 
 def main():
     args = get_args()
-    base_record = read_gbk(args.genome)
+    base_record = read_gbk(genome_index.load_genome(args.genome))
     pseudos_record = read_gff(args.gff)
     make_diagram(base_record, pseudos_record, args.outprefix)
 
 
 # genome_map.full() allows this module to be called from another module, which is what happens in annotate.main()
-def full(genome: str, gff: str, outfile: str):
+def full(genome: genome_index.GenomeIndex, gff: str, outfile: str):
     base_record = read_gbk(genome)
     pseudos_record = read_gff(gff)
     make_diagram(base_record, pseudos_record, outfile)
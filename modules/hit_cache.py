@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import List, Dict
+
+"""
+Cache of BLAST results for single query sequences, so that sequences that were already searched (ie. the same
+proteins in a reannotated assembly or a closely related strain) are not sent to BLAST again.
+
+Results are stored in an SQLite database, keyed by the SHA-1 hash of the query sequence and by everything else that
+changes them: the program, the identity of the database (its files, their sizes and modification times), the e-value
+and the hitcap. The result of a query is its block of the BLAST output (outfmt 7), without the query's name, so that
+it can be given to any query with the same sequence (see blast_search.py).
+
+The database is hits.sqlite in $PSEUDOFINDER_CACHE_DIR (see blast_cache.py), and setting that to an empty string
+disables it. Whenever results are stored, the least recently used ones are evicted until the stored blocks take less
+than $PSEUDOFINDER_HIT_CACHE_SIZE megabytes (default: 1024).
+"""
+
+# Bump this whenever the stored blocks or the BLAST output format change, so that old results are never used.
+HIT_CACHE_VERSION = 1
+HIT_CACHE_NAME = "hits.sqlite"
+
+
+def hit_cache_path() -> str:
+    """Path of the SQLite database, or an empty string if the cache is disabled."""
+    directory = os.environ.get('PSEUDOFINDER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pseudofinder'))
+    return os.path.join(directory, HIT_CACHE_NAME) if directory else ""
+
+
+def hit_cache_size_limit() -> int:
+    """Maximum size of the stored blocks in bytes."""
+    return int(float(os.environ.get('PSEUDOFINDER_HIT_CACHE_SIZE', 1024)) * 1024 * 1024)
+
+
+def database_identity(database: str) -> list:
+    """Files of a BLAST database with their sizes and modification times, so that results are not reused once the
+    database is rebuilt or updated. The database is looked up as given, then in $BLASTDB. Databases that are a single
+    file (ie. of DIAMOND, see search_engines.py) are that file. If no files are found (ie. a remote database), only
+    its name is used."""
+
+    candidates = [database] + [os.path.join(folder, database) for folder in os.environ.get('BLASTDB', '').split(os.pathsep)
+                               if folder]
+    for candidate in candidates:
+        files = sorted(glob.glob(glob.escape(candidate) + ".*"))
+        if os.path.isfile(candidate):
+            files.insert(0, candidate)
+        if files:
+            return [[os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns] for path in files]
+
+    return [database]
+
+
+def search_settings(program: str, database: str, evalue: str, hitcap: int) -> str:
+    """Everything apart from the query sequence that changes the result of a search, as a single string."""
+
+    return json.dumps({'program': program,
+                       'database': database_identity(database),
+                       'evalue': float(evalue),
+                       'hitcap': hitcap,
+                       'version': HIT_CACHE_VERSION}, sort_keys=True)
+
+
+def query_key(settings: str, sequence: str) -> str:
+    """Key of the result of a single query sequence, searched with the given settings."""
+    return hashlib.sha1((settings + "\n" + sequence.upper()).encode()).hexdigest()
+
+
+class HitCache:
+    """Results of single queries in an SQLite database. Failing to read or write it is never an error,
+    the cache is only an optimisation."""
+
+    def __init__(self, path: str, size_limit: int):
+        self.path = path
+        self.size_limit = size_limit
+        self.connection = None
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.connection = sqlite3.connect(path, timeout=60)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, block TEXT NOT NULL, "
+                                    "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_by_use ON results (last_used)")
+            self.connection.commit()
+        except (OSError, sqlite3.Error):
+            self.connection = None
+
+    def lookup(self, keys: List[str]) -> Dict[str, str]:
+        """Stored blocks of the given keys as {key: block}, for the keys that are in the cache.
+        They are marked as recently used."""
+
+        found = {}
+        if self.connection is None:
+            return found
+
+        try:
+            unique_keys = list(dict.fromkeys(keys))
+            for first in range(0, len(unique_keys), 500):  # SQLite limits the number of parameters of a query
+                batch = unique_keys[first:first + 500]
+                rows = self.connection.execute("SELECT key, block FROM results WHERE key IN (%s)" %
+                                               ",".join("?" * len(batch)), batch)
+                found.update(rows)
+            self.connection.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                        [(time.time(), key) for key in found])
+            self.connection.commit()
+        except sqlite3.Error:
+            return {}
+
+        return found
+
+    def store(self, blocks: Dict[str, str]) -> None:
+        """Stores blocks as {key: block}, then evicts the least recently used ones if the cache is too big."""
+
+        if self.connection is None or not blocks:
+            return
+
+        try:
+            now = time.time()
+            self.connection.executemany("INSERT OR REPLACE INTO results (key, block, size, last_used) "
+                                        "VALUES (?, ?, ?, ?)",
+                                        [(key, block, len(block), now) for key, block in blocks.items()])
+            self.connection.commit()
+            self.evict(self.size_limit)
+        except sqlite3.Error:
+            pass
+
+    def evict(self, max_size: int) -> None:
+        """Removes the least recently used blocks until the stored blocks take at most max_size bytes."""
+
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total_size <= max_size:
+            return
+
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if total_size <= max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+
+        self.connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.connection.commit()
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def open_hit_cache() -> HitCache:
+    """The hit cache of this machine, or None if it is disabled."""
+
+    path = hit_cache_path()
+    return HitCache(path, hit_cache_size_limit()) if path else None
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import numpy
+
+"""
+Sorted-endpoint index over a set of intervals (ie. the pseudogenes on a contig).
+
+The intervals are sorted by start position once, and the largest end position seen so far is kept for every
+position in that order. Whether a region lies within any interval is then a binary search for the last interval
+starting at or before the region, and a comparison with the largest end up to that interval.
+All queries take arrays of positions and are answered for every element at once, in O(log n) each.
+"""
+
+
+class IntervalIndex:
+    """Intervals [start, end], both ends included, indexed by start position."""
+
+    def __init__(self, starts: numpy.ndarray, ends: numpy.ndarray):
+        self.order = numpy.argsort(starts, kind='stable')   # Interval numbers, sorted by start position
+        self.starts = numpy.asarray(starts)[self.order]
+        self.max_ends = numpy.maximum.accumulate(numpy.asarray(ends)[self.order])  # Largest end up to each interval
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def contains(self, starts: numpy.ndarray, ends: numpy.ndarray) -> numpy.ndarray:
+        """True for every region (starts[i], ends[i]) that lies within at least one interval."""
+
+        # Number of intervals that start at or before each region
+        preceding = numpy.searchsorted(self.starts, starts, side='right')
+        if len(self) == 0:
+            return numpy.zeros(len(preceding), dtype=bool)
+
+        return (preceding > 0) & (self.max_ends[numpy.maximum(preceding - 1, 0)] >= ends)
+
+    def first_at(self, starts: numpy.ndarray) -> numpy.ndarray:
+        """The first interval (in the order they were given) that starts at each position, or -1 if there is none."""
+
+        first = numpy.searchsorted(self.starts, starts, side='left')
+        if len(self) == 0:
+            return numpy.full(len(first), -1, dtype=numpy.int64)
+
+        found = first < len(self)
+        found[found] = self.starts[first[found]] == numpy.asarray(starts)[found]
+
+        return numpy.where(found, self.order[numpy.minimum(first, len(self) - 1)], -1)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import sys
+from typing import List, Dict
+
+from Bio.Seq import Seq
+
+"""
+Deterministic stand-in for blastp and blastx, for testing and benchmarking the whole workflow without BLAST
+(see annotate --search_engine mock). The database is a protein fasta file.
+
+Queries are compared with the database through their shared k-mers. For blastx, the six frames of every query are
+translated first. The hits of a query are the proteins that share at least one k-mer with it, scored by the number of
+shared k-mers, and written with the positions of the first and last shared k-mers as BLAST tabular output with
+comment lines (outfmt 7), like BLAST would. The same input always gives the same output.
+
+This file is run as a script by annotate (so that searches are separate processes that can be killed like BLAST), and
+does not import anything else from pseudofinder.
+"""
+
+KMER_LENGTH = 5
+# Fields of the hit lines, in the order of the outfmt 7 options that annotate gives BLAST
+FIELDS = ("query id, subject id, % identity, alignment length, mismatches, gap opens, q. start, q. end, s. start, "
+          "s. end, subject length, evalue, bit score, query/sbjct frames, subject title")
+
+
+def get_args(arguments: List[str]):
+    parser = argparse.ArgumentParser(description='Searches a fasta file against a protein fasta file by shared k-mers.')
+    parser.add_argument('program', choices=['blastp', 'blastx'])
+    parser.add_argument('-query', required=True)
+    parser.add_argument('-db', required=True)
+    parser.add_argument('-out', required=True)
+    parser.add_argument('-evalue', default=10.0, type=float)
+    parser.add_argument('-max_target_seqs', default=500, type=int)
+
+    return parser.parse_args(arguments)
+
+
+def read_fasta(filename: str) -> List[tuple]:
+    """Every record of a fasta file as (description, sequence)."""
+
+    records = []
+
+    with open(filename, 'r') as fasta:
+        for line in fasta:
+            if line.startswith(">"):
+                records.append([line[1:].strip(), []])
+            elif records:
+                records[-1][1].append(line.strip())
+
+    return [(description, "".join(sequence).upper()) for description, sequence in records]
+
+
+def kmer_index(proteins: List[tuple]) -> Dict[str, List[tuple]]:
+    """Positions of every k-mer in the database as {k-mer: [(protein number, position), ...]}."""
+
+    index = {}
+    for number, (description, sequence) in enumerate(proteins):
+        for position in range(len(sequence) - KMER_LENGTH + 1):
+            index.setdefault(sequence[position:position + KMER_LENGTH], []).append((number, position))
+
+    return index
+
+
+def query_frames(sequence: str, program: str) -> List[tuple]:
+    """Protein sequences to search for a query, as (frame, protein, function that converts a range of protein
+    positions to the range of query positions that BLAST would report)."""
+
+    if program == 'blastp':
+        return [(0, sequence, lambda first, last: (first + 1, last + 1))]
+
+    frames = []
+    length = len(sequence)
+    for strand, nucleotides in ((1, sequence), (-1, str(Seq(sequence).reverse_complement()))):
+        for offset in range(3):
+            codons = nucleotides[offset:]
+            protein = str(Seq(codons[:len(codons) // 3 * 3]).translate())
+            if strand == 1:
+                to_query = (lambda first, last, offset=offset: (offset + 3 * first + 1, offset + 3 * last + 3))
+            else:  # Positions on the reverse strand are reported from the end of the query, start > end
+                to_query = (lambda first, last, offset=offset: (length - offset - 3 * first,
+                                                                length - offset - 3 * last - 2))
+            frames.append((strand * (offset + 1), protein, to_query))
+
+    return frames
+
+
+def search_query(sequence: str, program: str, proteins: List[tuple], index: dict, database_size: int,
+                 evalue: float, max_target_seqs: int) -> List[list]:
+    """Hits of a single query as lists of fields, best first."""
+
+    best = {}  # protein number -> (shared k-mers, frame, query range, protein range)
+
+    for frame, protein, to_query in query_frames(sequence, program):
+        shared = {}  # protein number -> [shared k-mers, first query position, last, first protein position, last]
+        for position in range(len(protein) - KMER_LENGTH + 1):
+            for number, protein_position in index.get(protein[position:position + KMER_LENGTH], ()):
+                counts = shared.get(number)
+                if counts is None:
+                    shared[number] = [1, position, position, protein_position, protein_position]
+                else:
+                    counts[0] += 1
+                    counts[2] = position
+                    counts[3] = min(counts[3], protein_position)
+                    counts[4] = max(counts[4], protein_position)
+
+        for number, (count, first, last, protein_first, protein_last) in shared.items():
+            if number not in best or count > best[number][0]:
+                best[number] = (count, frame, to_query(first, last + KMER_LENGTH - 1),
+                                (protein_first + 1, protein_last + KMER_LENGTH))
+
+    hits = []
+    query_residues = len(sequence) // 3 if program == 'blastx' else len(sequence)
+    for number, (count, frame, (q_start, q_end), (s_start, s_end)) in best.items():
+        bit_score = 2.0 * count
+        hit_evalue = query_residues * database_size * math.pow(2, -bit_score)
+        if hit_evalue > evalue:
+            continue
+
+        description, protein = proteins[number]
+        length = s_end - s_start + 1
+        identity = min(100.0, 100.0 * (count + KMER_LENGTH - 1) / length)
+        hits.append((hit_evalue, number, [description.split()[0], "%.3f" % identity, length, 0, 0, q_start, q_end,
+                                          s_start, s_end, len(protein), "%.2e" % hit_evalue, "%.1f" % bit_score,
+                                          "%d/0" % frame, description]))
+
+    hits.sort(key=lambda hit: (hit[0], hit[1]))
+    return [fields for hit_evalue, number, fields in hits[:max_target_seqs]]
+
+
+def write_block(output, program: str, description: str, database: str, hits: List[list]) -> None:
+    """Writes the block of a single query as BLAST does in outfmt 7. hits are the fields of every hit without the
+    query id, which is taken from the description."""
+
+    query_id = description.split()[0]
+
+    output.write("# %s\n# Query: %s\n# Database: %s\n" % (program.upper(), description, database))
+    if hits:
+        output.write("# Fields: %s\n" % FIELDS)
+    output.write("# %d hits found\n" % len(hits))
+    for fields in hits:
+        output.write("\t".join(map(str, [query_id] + list(fields))) + "\n")
+
+
+def main(arguments: List[str] = None) -> None:
+    args = get_args(sys.argv[1:] if arguments is None else arguments)
+
+    proteins = read_fasta(args.db)
+    index = kmer_index(proteins)
+    database_size = sum(len(sequence) for description, sequence in proteins)
+    queries = read_fasta(args.query)
+
+    with open(args.out, 'w') as output:
+        for description, sequence in queries:
+            hits = search_query(sequence, args.program, proteins, index, database_size=database_size,
+                                evalue=args.evalue, max_target_seqs=args.max_target_seqs)
+            write_block(output, program=args.program, description=description, database=args.db, hits=hits)
+            output.flush()
+        output.write("# BLAST processed %d queries\n" % len(queries))
+
+
+if __name__ == '__main__':
+    main()
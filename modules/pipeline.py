@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from typing import NamedTuple, List, Callable
+from time import localtime, strftime
+
+from . import blast_cache
+
+"""
+Runs the stages of a workflow (ie. annotate) in order, and skips the stages that are already up to date.
+
+Stages are connected through files: a stage reads its input files and writes its output files, so the outputs of one
+stage are the inputs of the next ones. After a stage has run, the SHA-1 hashes of its inputs and outputs, its
+parameters and the results it returned are recorded in a manifest (a JSON file next to the outputs). When the workflow
+is run again, a stage is skipped if its parameters are the same, its inputs have the same hashes and its outputs are
+still there, unchanged. The first stage that is not up to date runs again, and so does every stage after it whose
+inputs it changed. If a run is interrupted, running it again resumes from the stage that was interrupted.
+
+The manifest also records the settings of the run, for reannotate and visualize (see read_settings()).
+"""
+
+MANIFEST_SUFFIX = "_manifest.json"
+LOG_SUFFIX = "_log.txt"
+
+# A single stage of a workflow. run(results) does the work, given the results of the stages before it as
+# {name: results}, and returns a dictionary of results (ie. statistics) or None.
+# Parameters and results must be JSON serialisable.
+Stage = NamedTuple('Stage', [('name', str),
+                             ('inputs', List[str]),
+                             ('parameters', dict),
+                             ('outputs', List[str]),
+                             ('run', Callable)])
+
+
+def current_time() -> str:
+    """Returns the current time when this function was executed."""
+    return str(strftime("%Y-%m-%d %H:%M:%S", localtime()))
+
+
+def manifest_path(outprefix: str) -> str:
+    return outprefix + MANIFEST_SUFFIX
+
+
+def run_stages(stages: List[Stage], manifest_file: str, restart: bool = False) -> dict:
+    """Runs every stage that is not up to date, in order, and records it in the manifest as soon as it is done.
+    With restart, every stage runs. Returns the results of every stage as {name: results}, taken from the manifest
+    for the stages that were skipped."""
+
+    check_order(stages)
+    manifest = {} if restart else read_manifest(manifest_file)
+    stage_records = manifest.setdefault('stages', {})
+    results = {}
+
+    for stage in stages:
+        record = stage_records.get(stage.name)
+
+        if record is not None and up_to_date(stage, record):
+            print('%s\tSkipping stage "%s", its outputs are up to date.' % (current_time(), stage.name))
+            sys.stdout.flush()
+            results[stage.name] = record['results']
+            continue
+
+        stage_records.pop(stage.name, None)
+        inputs = checksums(stage.inputs)  # Before running, in case the inputs change in the meantime
+        results[stage.name] = stage.run(dict(results)) or {}
+        stage_records[stage.name] = {'inputs': inputs,
+                                     'parameters': stage.parameters,
+                                     'outputs': checksums(stage.outputs),
+                                     'results': results[stage.name]}
+        write_manifest(manifest_file, manifest)
+
+    return results
+
+
+def check_order(stages: List[Stage]) -> None:
+    """Stages must be given in an order in which every stage comes after the stages whose outputs it reads."""
+
+    produced_by = {output: number for number, stage in enumerate(stages) for output in stage.outputs}
+
+    for number, stage in enumerate(stages):
+        for path in stage.inputs:
+            if produced_by.get(path, -1) >= number:
+                raise ValueError('Stage "%s" reads %s before it is written.' % (stage.name, path))
+
+
+def up_to_date(stage: Stage, record: dict) -> bool:
+    """True if a stage ran with the same parameters and inputs as now, and its outputs have not changed since."""
+
+    if json.loads(json.dumps(stage.parameters)) != record['parameters']:
+        return False
+    if sorted(stage.inputs) != sorted(record['inputs']) or sorted(stage.outputs) != sorted(record['outputs']):
+        return False
+    if not all(os.path.exists(path) for path in stage.inputs + stage.outputs):
+        return False
+
+    return checksums(stage.inputs) == record['inputs'] and checksums(stage.outputs) == record['outputs']
+
+
+def checksums(paths: List[str]) -> dict:
+    """SHA-1 hash of every file as {path: hash}."""
+    return {path: blast_cache.file_checksum(path, blast_cache.file_stamp(path)) for path in paths}
+
+
+def read_manifest(manifest_file: str) -> dict:
+    """Contents of a manifest, or an empty one if it is missing or unreadable."""
+
+    try:
+        with open(manifest_file, 'r') as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest_file: str, manifest: dict) -> None:
+    """Writes the manifest to a temporary file first, so that it is never left half written."""
+
+    temporary_file = "%s.%d.tmp" % (manifest_file, os.getpid())
+    with open(temporary_file, 'w') as manifest_handle:
+        json.dump(manifest, manifest_handle, indent=2, sort_keys=True)
+    os.replace(temporary_file, manifest_file)
+
+
+def record_settings(manifest_file: str, settings: dict, logfile: str) -> None:
+    """Adds the settings of a run to its manifest, with the hash of the log file that the run wrote them to."""
+
+    manifest = read_manifest(manifest_file)
+    manifest['settings'] = settings
+    manifest['log'] = checksums([logfile])[logfile]
+    write_manifest(manifest_file, manifest)
+
+
+def read_settings(logfile: str) -> dict:
+    """Settings recorded in the manifest that belongs to a log file ([prefix]_log.txt -> [prefix]_manifest.json),
+    or in a manifest given directly. Returns None if there is no manifest with settings, or if they were recorded for
+    another version of the log file (ie. one that reannotate has written over since)."""
+
+    if logfile.endswith(MANIFEST_SUFFIX):
+        return read_manifest(logfile).get('settings')
+    elif not logfile.endswith(LOG_SUFFIX):
+        return None
+
+    manifest = read_manifest(logfile[:-len(LOG_SUFFIX)] + MANIFEST_SUFFIX)
+    if 'log' not in manifest or not os.path.exists(logfile) or checksums([logfile])[logfile] != manifest['log']:
+        return None
+
+    return manifest.get('settings')
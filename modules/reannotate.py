@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
-from . import annotate, genome_map
+from . import annotate, genome_index, blast_cache, pipeline
 
 import argparse
-import sys
 import re
+import sys
 
 
 def get_args():
@@ -15,9 +15,9 @@ def get_args():
 
     always_required.add_argument('-g', '--genome', help='Provide your genome file in genbank format.',
                                  required=True)
-    always_required.add_argument('-p', '--blastp', help='Specify an input blastp file.',
+    always_required.add_argument('-p', '--blastp', help='Specify an input blastp file (may be gzip-compressed).',
                                  required=True)
-    always_required.add_argument('-x', '--blastx', help='Specify an input blastx file.',
+    always_required.add_argument('-x', '--blastx', help='Specify an input blastx file (may be gzip-compressed).',
                                  required=True)
     always_required.add_argument('-log', '--logfile', required=True,
                                  help='Provide the log file from the run that generated the blast files.')
@@ -40,6 +40,18 @@ def get_args():
                                'Default is %(default)s.')
     optional.add_argument('-d', '--distance', default=None, type=int,
                           help='Maximum distance between two regions to consider joining them. Default is %(default)s.')
+    optional.add_argument('-hc', '--hitcap', default=None, type=int,
+                          help='Maximum number of blast hits used per region (those with the lowest e-values).\n'
+                               'Can be at most the hitcap that BLAST was run with (--search_hitcap in annotate).\n'
+                               'Default is the hitcap in the log file.')
+    optional.add_argument('-i', '--intergenic_length', default=None, type=int,
+                          help='Length of the shortest intergenic regions to check. Can be at least the length that\n'
+                               'BLAST was run with (--search_intergenic_length in annotate).\n'
+                               'Default is the intergenic length in the log file.')
+    optional.add_argument('-cc', '--clear_cache', default=False, action='store_true',
+                          help='Discard any cached results from previous parses of the blast files.')
+    optional.add_argument('-w', '--workers', default=1, type=int,
+                          help='Number of processes used to check contigs for pseudogenes. Default is %(default)s.')
 
     # parse_known_args will create a tuple of known arguments in the first position and unknown in the second.
     # We only care about the known arguments, so we take [0].
@@ -49,6 +61,15 @@ def get_args():
 
 
 def parse_log(logfile: str):
+    """Returns the settings of the run that wrote a log file. They are read from the manifest of that run
+    (see pipeline.py) if there is one, otherwise from the log file itself."""
+
+    settings = pipeline.read_settings(logfile)
+    if settings is not None:
+        return settings
+
+    search_hitcap = None
+    search_intergenic_length = None
 
     with open(logfile, 'r') as log:
         for line in log.readlines():
@@ -58,6 +79,10 @@ def parse_log(logfile: str):
                 hitcap = int(line.split(sep="\t")[1])
             elif re.match("Intergenic_length", line):
                 intergenic_length = int(line.split(sep="\t")[1])
+            elif re.match("Search_hitcap", line):
+                search_hitcap = int(line.split(sep="\t")[1])
+            elif re.match("Search_intergenic_length", line):
+                search_intergenic_length = int(line.split(sep="\t")[1])
             elif re.match("Intergenic_threshold", line):
                 intergenic_threshold = float(line.split(sep="\t")[1])
             elif re.match("Length_pseudo", line):
@@ -71,6 +96,9 @@ def parse_log(logfile: str):
         'distance': distance,
         'hitcap': hitcap,
         'intergenic_length': intergenic_length,
+        # Logs written before --search_hitcap existed come from a search with the same settings
+        'search_hitcap': hitcap if search_hitcap is None else search_hitcap,
+        'search_intergenic_length': intergenic_length if search_intergenic_length is None else search_intergenic_length,
         'intergenic_threshold': intergenic_threshold,
         'length_pseudo': length_pseudo,
         'shared_hits': shared_hits,
@@ -98,14 +126,32 @@ def fix_args(command_line_args, logged_args):
     if args.intergenic_threshold is None:
         args.intergenic_threshold = logged_args['intergenic_threshold']
 
-    args.hitcap = logged_args['hitcap']
+    if args.hitcap is None:
+        args.hitcap = logged_args['hitcap']
+
+    if args.intergenic_length is None:
+        args.intergenic_length = logged_args['intergenic_length']
+
+    # The blast files only contain what BLAST was asked for. Any smaller hitcap or longer intergenic length can be
+    # derived from them (see annotate.limit_to_settings), anything beyond that needs a new search.
+    args.search_hitcap = logged_args['search_hitcap']
+    args.search_intergenic_length = logged_args['search_intergenic_length']
+    if args.hitcap > args.search_hitcap or args.intergenic_length < args.search_intergenic_length:
+        sys.exit("The blast files were searched with a hitcap of %s and an intergenic length of %s. Use a hitcap of "
+                 "at most %s and an intergenic length of at least %s, or run annotate again with a larger "
+                 "--search_hitcap or a shorter --search_intergenic_length." % (args.search_hitcap,
+                                                                               args.search_intergenic_length,
+                                                                               args.search_hitcap,
+                                                                               args.search_intergenic_length))
+
     args.database = logged_args['database']
-    args.intergenic_length = logged_args['intergenic_length']
 
     return args
 
 
-def reannotate(args):
+def reannotate(args, genome: genome_index.GenomeIndex) -> annotate.RunStats:
+    """Runs the annotate workflow on existing blast files, writes all output files and returns the statistics of the run.
+    Every call counts into its own statistics, so several reannotations can run in the same process."""
 
     base_outfile_name = args.outprefix + "_"
     file_dict = {
@@ -119,51 +165,15 @@ def reannotate(args):
         'log': base_outfile_name + "log.txt"
     }
 
-    # Collect everything from the blast files
-    orfs = annotate.parse_blast(filename=file_dict['blastp_filename'], blast_format='BlastP')
-    intergenic_regions = annotate.parse_blast(filename=file_dict['blastx_filename'], blast_format='BlastX')
-    all_regions = orfs + intergenic_regions
-
-    # Sorted list of contigs containing only orfs, no intergenic regions
-    orfs_by_contig = annotate.sort_contigs(loc=annotate.split_regions_into_contigs(lori=orfs))
-    # Sorted list of contigs containing orfs and intergenic regions
-    all_regions_by_contig = annotate.sort_contigs(loc=annotate.split_regions_into_contigs(lori=all_regions))
-
-    pseudogenes = []
-    functional_genes = []
-
-    for contig_index, contig in enumerate(all_regions_by_contig):
-        print('\033[1m'+'%s\tChecking contig %s / %s for pseudogenes.\033[0m' % (annotate.current_time(),
-                                                                                 contig_index+1,
-                                                                                 len(all_regions_by_contig))),
-        sys.stdout.flush()
-
-        pseudos_on_contig = annotate.annotate_pseudos(args=args, contig=contig)  # Returns 'Contig' data type
-        pseudogenes.extend(pseudos_on_contig.regions)  # List of regions
-
-        try:
-            functional_genes_on_contig = annotate.get_functional_genes(contig=orfs_by_contig[contig_index],
-                                                                       pseudos=pseudos_on_contig.regions)
-            functional_genes.extend(functional_genes_on_contig.regions)
-        except IndexError:  # If there are no orfs on a small contig, an error will be thrown when checking that contig.
-            continue
-
-        print('\t\t\tNumber of ORFs on this contig: %s\n'
-              '\t\t\tNumber of pseudogenes flagged: %s' % (
-                  len([region for region in contig.regions if region.region_type == annotate.RegionType.ORF]),
-                  len(pseudos_on_contig.regions))),
-        sys.stdout.flush()
-
-    # Write all output files
-    annotate.write_genes_to_gff(args, lopg=pseudogenes, gff=file_dict['pseudos_gff'])
-    annotate.write_genes_to_gff(args, lopg=functional_genes, gff=file_dict['functional_gff'])
-    annotate.write_pseudos_to_fasta(args, pseudofinder_regions=pseudogenes, outfile=file_dict['pseudos_fasta'])
-    # TODO: Activate this feature once you finish writing it
-    # write_functional_to_fasta(infile=file_dict['proteome_filename'], outfile=file_dict['functional_faa'],
-    #                           contigs=functional_genes)
-    genome_map.full(genome=args.genome, gff=file_dict['pseudos_gff'], outfile=file_dict['chromosome_map'])
-    annotate.write_summary_file(args=args, file_dict=file_dict)
-    annotate.reset_statistics_dict()
+    # Statistics of this run, reported in the log file
+    stats = annotate.RunStats()
+
+    annotate.annotate_blast_files(args=args, genome=genome, file_dict=file_dict, stats=stats)
+    # A later reannotate or visualize of this log file must read these settings, not those of an earlier run
+    pipeline.record_settings(pipeline.manifest_path(args.outprefix), annotate.logged_settings(args),
+                             logfile=file_dict['log'])
+
+    return stats
 
 
 def main():
@@ -172,8 +182,12 @@ def main():
     logged_args = parse_log(command_line_args.logfile)
     args = fix_args(command_line_args, logged_args)
 
+    if args.clear_cache is True:
+        blast_cache.clear_cache(args.blastp)
+        blast_cache.clear_cache(args.blastx)
+
     # Do the reannotation
-    reannotate(args)
+    reannotate(args, genome=genome_index.load_genome(args.genome))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+from typing import List, Dict
+
+import numpy
+
+"""
+Column-oriented storage for regions (ORFs and intergenic regions) and their blast hits.
+
+Every region is a row in a RegionTable, stored as one numpy array per field. The blast hits of all regions are kept
+once in a shared HitTable, and each region points at its hits through an offset index (like a sparse matrix):
+the hits of region i are hits[hit_index[hit_offsets[i]:hit_offsets[i+1]]].
+Accessions and contig names are interned, so they are stored as small integers instead of strings.
+Identical hits are only stored once, so two regions with the same hit point at the same row of the HitTable.
+"""
+
+
+class HitTable:
+    """Unique blast hits, stored column by column."""
+
+    def __init__(self, accession: numpy.ndarray, slen: numpy.ndarray, s_start: numpy.ndarray, s_end: numpy.ndarray,
+                 eval: numpy.ndarray, accession_names: List[str]):
+        self.accession = accession              # index into accession_names
+        self.slen = slen
+        self.s_start = s_start
+        self.s_end = s_end
+        self.eval = eval
+        self.accession_names = accession_names
+
+    def __len__(self) -> int:
+        return len(self.accession)
+
+
+class RegionTable:
+    """A set of regions, stored column by column. Region types are stored as RegionType values."""
+
+    def __init__(self, contig: numpy.ndarray, query: List[str], start: numpy.ndarray, end: numpy.ndarray,
+                 query_length: numpy.ndarray, strand: numpy.ndarray, region_type: numpy.ndarray, note: List[str],
+                 hit_offsets: numpy.ndarray, hit_index: numpy.ndarray, hits: HitTable, contig_names: List[str]):
+        self.contig = contig                    # index into contig_names
+        self.query = query
+        self.start = start
+        self.end = end
+        self.query_length = query_length        # length of the sequence that was blasted
+        self.strand = strand
+        self.region_type = region_type
+        self.note = note
+        self.hit_offsets = hit_offsets          # len(self) + 1 offsets into hit_index
+        self.hit_index = hit_index              # rows of the HitTable
+        self.hits = hits
+        self.contig_names = contig_names
+        self._buffers = {}                      # Column name -> array with spare room for append_region()
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def hit_counts(self) -> numpy.ndarray:
+        """Number of blast hits of every region."""
+        return numpy.diff(self.hit_offsets)
+
+    def region_hits(self, row: int) -> numpy.ndarray:
+        """Rows of the HitTable that belong to a single region."""
+        return self.hit_index[self.hit_offsets[row]:self.hit_offsets[row + 1]]
+
+    def contig_name(self, row: int) -> str:
+        return self.contig_names[self.contig[row]]
+
+    def rows_by_contig(self) -> Dict[int, numpy.ndarray]:
+        """Rows of every contig in the table as {contig id: rows}, rows in table order and contig ids in increasing
+        order. Grouped with a single stable sort of the contig column instead of scanning the table once per contig."""
+
+        order = numpy.argsort(self.contig, kind='stable')
+        contig_ids, first_rows = numpy.unique(self.contig[order], return_index=True)
+
+        return dict(zip(contig_ids.tolist(), numpy.split(order, first_rows[1:])))
+
+    def take(self, rows) -> 'RegionTable':
+        """Returns a new table containing only the given rows, in the given order. Rows can be repeated."""
+
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        counts = numpy.diff(self.hit_offsets)[rows]
+        hit_offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=hit_offsets[1:])
+
+        # Position of every hit of the selected rows in the old hit_index
+        gather = numpy.repeat(self.hit_offsets[:-1][rows] - hit_offsets[:-1], counts) + numpy.arange(hit_offsets[-1])
+
+        return RegionTable(contig=self.contig[rows],
+                           query=[self.query[row] for row in rows.tolist()],
+                           start=self.start[rows],
+                           end=self.end[rows],
+                           query_length=self.query_length[rows],
+                           strand=self.strand[rows],
+                           region_type=self.region_type[rows],
+                           note=[self.note[row] for row in rows.tolist()],
+                           hit_offsets=hit_offsets,
+                           hit_index=self.hit_index[gather],
+                           hits=self.hits,
+                           contig_names=self.contig_names)
+
+    def append_region(self, contig: int, query: str, start: int, end: int, strand: str, region_type: int,
+                      note: str, hit_rows: numpy.ndarray) -> int:
+        """Adds a region made of hits that are already in the HitTable to the end of this table,
+        and returns its row number. Columns grow with spare room, so appending n regions takes O(n) time.
+        The region was not blasted itself, so its query length is the length of the region."""
+
+        row = len(self)
+        hit_total = int(self.hit_offsets[-1])
+
+        for name, value in (('contig', contig), ('start', start), ('end', end), ('query_length', end - start + 1),
+                            ('strand', strand),
+                            ('region_type', region_type), ('hit_offsets', hit_total + len(hit_rows))):
+            column = self._grow(name, len(getattr(self, name)) + 1)
+            column[-1] = value
+
+        self._grow('hit_index', hit_total + len(hit_rows))[hit_total:] = hit_rows
+        self.query.append(query)
+        self.note.append(note)
+
+        return row
+
+    def _grow(self, name: str, length: int) -> numpy.ndarray:
+        """Makes column 'name' length elements long, and returns it. The column is a view of a larger buffer,
+        which is only reallocated (doubling its size) when it is full."""
+
+        column = getattr(self, name)
+        buffer = self._buffers.get(name)
+
+        if buffer is None or column.base is not buffer:  # First append, or the column was replaced
+            buffer = column
+        if len(buffer) < length:
+            buffer = numpy.empty(max(length, 2 * len(buffer), 16), dtype=column.dtype)
+            buffer[:len(column)] = column
+            self._buffers[name] = buffer
+
+        setattr(self, name, buffer[:length])
+        return getattr(self, name)
+
+
+class SharedHits:
+    """Counts the accessions shared by pairs of regions of a single table.
+
+    The accessions of every region are reduced to a sorted array of unique accession ids the first time the region
+    is looked at, and the count for each pair of regions is remembered. Merging regions revisits the same pairs many
+    times (it backtracks after every merge), so each pair is only intersected once. Rows are never changed after
+    they are added to a RegionTable, so the results stay valid while regions are appended."""
+
+    def __init__(self, table: RegionTable):
+        self.table = table
+        self.accession_sets = {}  # row -> sorted unique accession ids
+        self.counts = {}          # (row, row) -> number of shared accessions
+
+    def accession_set(self, row: int) -> numpy.ndarray:
+        if row not in self.accession_sets:
+            self.accession_sets[row] = numpy.unique(self.table.hits.accession[self.table.region_hits(row)])
+        return self.accession_sets[row]
+
+    def count(self, r1: int, r2: int) -> int:
+        key = (r1, r2) if r1 < r2 else (r2, r1)
+        if key not in self.counts:
+            self.counts[key] = len(numpy.intersect1d(self.accession_set(r1), self.accession_set(r2),
+                                                     assume_unique=True))
+        return self.counts[key]
+
+
+class RegionChain:
+    """Rows of a RegionTable in order of their start position, stored as a doubly linked list.
+
+    It is indexed like a Python list (negative positions and IndexError included), but the last accessed position
+    is remembered. Reading, deleting and inserting close to it takes constant time, instead of shifting or
+    re-sorting the whole list."""
+
+    def __init__(self, rows: List[int], starts: List[int]):
+        self.starts = starts    # Start position of every row, can be extended by the caller as rows are added
+        self.prev = {}
+        self.next = {}
+        self.head = rows[0] if rows else None
+        self.tail = rows[-1] if rows else None
+        self.length = len(rows)
+        self.cursor = self.head  # Last accessed row, and its position
+        self.cursor_position = 0
+
+        for previous_row, row in zip([None] + rows[:-1], rows):
+            self.prev[row] = previous_row
+            self.next[row] = None
+            if previous_row is not None:
+                self.next[previous_row] = row
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, position: int) -> int:
+        self.seek(position)
+        return self.cursor
+
+    def __delitem__(self, position: int) -> None:
+        self.seek(position)
+        row = self.cursor
+        previous_row = self.prev.pop(row)
+        next_row = self.next.pop(row)
+
+        if previous_row is None:
+            self.head = next_row
+        else:
+            self.next[previous_row] = next_row
+        if next_row is None:
+            self.tail = previous_row
+        else:
+            self.prev[next_row] = previous_row
+        self.length -= 1
+
+        # The next row takes the position of the deleted one
+        if next_row is not None:
+            self.cursor = next_row
+        else:
+            self.cursor = previous_row
+            self.cursor_position -= 1
+
+    def seek(self, position: int) -> None:
+        """Moves the cursor to a position, walking from whichever of the head, the tail or the cursor is closest."""
+
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("chain index out of range")
+
+        if self.cursor is None or position < abs(position - self.cursor_position):
+            self.cursor, self.cursor_position = self.head, 0
+        if self.length - 1 - position < abs(position - self.cursor_position):
+            self.cursor, self.cursor_position = self.tail, self.length - 1
+
+        while self.cursor_position < position:
+            self.cursor = self.next[self.cursor]
+            self.cursor_position += 1
+        while self.cursor_position > position:
+            self.cursor = self.prev[self.cursor]
+            self.cursor_position -= 1
+
+    def insert_sorted(self, row: int) -> None:
+        """Inserts a row after every row with the same or a lower start position, which is where a stable sort
+        would put a row appended to the end of the list. The search starts at the cursor."""
+
+        start = self.starts[row]
+        previous_row, position = self.cursor, self.cursor_position  # position of previous_row, -1 before the head
+        if previous_row is None:
+            position = -1
+
+        while previous_row is not None and self.starts[previous_row] > start:
+            previous_row = self.prev[previous_row]
+            position -= 1
+        while True:
+            next_row = self.head if previous_row is None else self.next[previous_row]
+            if next_row is None or self.starts[next_row] > start:
+                break
+            previous_row = next_row
+            position += 1
+
+        self.prev[row] = previous_row
+        self.next[row] = next_row
+        if previous_row is None:
+            self.head = row
+        else:
+            self.next[previous_row] = row
+        if next_row is None:
+            self.tail = row
+        else:
+            self.prev[next_row] = row
+        self.length += 1
+        self.cursor, self.cursor_position = row, position + 1
+
+
+class RegionTableBuilder:
+    """Collects regions one at a time (ie. while parsing a blast file) and builds a RegionTable at the end."""
+
+    def __init__(self):
+        self.contig_ids = {}
+        self.accession_ids = {}
+        self.contig = []
+        self.query = []
+        self.start = []
+        self.end = []
+        self.query_length = []
+        self.strand = []
+        self.region_type = []
+        self.note = []
+        self.hit_offsets = [0]
+        self.accession = []
+        self.slen = []
+        self.s_start = []
+        self.s_end = []
+        self.eval = []
+
+    def add_region(self, contig: str, query: str, start: int, end: int, query_length: int, strand: str,
+                   region_type: int, note: str, hits) -> None:
+        """Adds a region. hits is a list of (accession, slen, s_start, s_end, eval), such as a list of BlastHit."""
+
+        self.contig.append(self.contig_ids.setdefault(contig, len(self.contig_ids)))
+        self.query.append(query)
+        self.start.append(start)
+        self.end.append(end)
+        self.query_length.append(query_length)
+        self.strand.append(strand)
+        self.region_type.append(region_type)
+        self.note.append(note)
+
+        for accession, slen, s_start, s_end, evalue in hits:
+            self.accession.append(self.accession_ids.setdefault(accession, len(self.accession_ids)))
+            self.slen.append(slen)
+            self.s_start.append(s_start)
+            self.s_end.append(s_end)
+            self.eval.append(evalue)
+
+        self.hit_offsets.append(len(self.accession))
+
+    def build(self) -> RegionTable:
+        hits, hit_index = unique_hits(accession=numpy.array(self.accession, dtype=numpy.int32),
+                                      slen=numpy.array(self.slen, dtype=numpy.int64),
+                                      s_start=numpy.array(self.s_start, dtype=numpy.int64),
+                                      s_end=numpy.array(self.s_end, dtype=numpy.int64),
+                                      eval=numpy.array(self.eval, dtype=numpy.float64),
+                                      accession_names=list(self.accession_ids))
+
+        return RegionTable(contig=numpy.array(self.contig, dtype=numpy.int32),
+                           query=self.query,
+                           start=numpy.array(self.start, dtype=numpy.int64),
+                           end=numpy.array(self.end, dtype=numpy.int64),
+                           query_length=numpy.array(self.query_length, dtype=numpy.int64),
+                           strand=strand_array(self.strand),
+                           region_type=numpy.array(self.region_type, dtype=numpy.int8),
+                           note=self.note,
+                           hit_offsets=numpy.array(self.hit_offsets, dtype=numpy.int64),
+                           hit_index=hit_index,
+                           hits=hits,
+                           contig_names=list(self.contig_ids))
+
+
+def strand_array(strands: list) -> numpy.ndarray:
+    """Strands are stored as a numpy string array ('+' or '-')."""
+    if strands:
+        return numpy.array(strands, dtype=str)
+    else:
+        return numpy.array([], dtype='<U1')
+
+
+def unique_hits(accession: numpy.ndarray, slen: numpy.ndarray, s_start: numpy.ndarray, s_end: numpy.ndarray,
+                eval: numpy.ndarray, accession_names: List[str]) -> tuple:
+    """Removes duplicate hits. Returns the HitTable of unique hits and the row of the HitTable for every input hit."""
+
+    records = numpy.empty(len(accession), dtype=[('accession', numpy.int32), ('slen', numpy.int64),
+                                                 ('s_start', numpy.int64), ('s_end', numpy.int64),
+                                                 ('eval', numpy.float64)])
+    records['accession'] = accession
+    records['slen'] = slen
+    records['s_start'] = s_start
+    records['s_end'] = s_end
+    records['eval'] = eval
+
+    unique_records, inverse = numpy.unique(records, return_inverse=True)
+
+    hits = HitTable(accession=unique_records['accession'].copy(),
+                    slen=unique_records['slen'].copy(),
+                    s_start=unique_records['s_start'].copy(),
+                    s_end=unique_records['s_end'].copy(),
+                    eval=unique_records['eval'].copy(),
+                    accession_names=accession_names)
+
+    return hits, inverse.reshape(-1).astype(numpy.int64)
+
+
+def concatenate(tables: List[RegionTable]) -> RegionTable:
+    """Joins several tables into one. Contig names and hits of tables that were built separately are merged."""
+
+    first = tables[0]
+
+    if all(table.hits is first.hits and table.contig_names is first.contig_names for table in tables):
+        hits = first.hits
+        contig_names = first.contig_names
+        contig = [table.contig for table in tables]
+        hit_index = [table.hit_index for table in tables]
+
+    else:
+        # Re-intern contig names and accessions, then remove hits that are now duplicated between tables
+        contig_ids = {}
+        accession_ids = {}
+        contig = []
+        accession = []
+        hit_index = []
+        hit_count = 0
+
+        for table in tables:
+            contig_map = numpy.array([contig_ids.setdefault(name, len(contig_ids)) for name in table.contig_names],
+                                     dtype=numpy.int32)
+            accession_map = numpy.array([accession_ids.setdefault(name, len(accession_ids))
+                                         for name in table.hits.accession_names], dtype=numpy.int32)
+            contig.append(contig_map[table.contig] if len(table) else table.contig)
+            accession.append(accession_map[table.hits.accession] if len(table.hits) else table.hits.accession)
+            hit_index.append(table.hit_index + hit_count)
+            hit_count += len(table.hits)
+
+        hits, hit_map = unique_hits(accession=numpy.concatenate(accession),
+                                    slen=numpy.concatenate([table.hits.slen for table in tables]),
+                                    s_start=numpy.concatenate([table.hits.s_start for table in tables]),
+                                    s_end=numpy.concatenate([table.hits.s_end for table in tables]),
+                                    eval=numpy.concatenate([table.hits.eval for table in tables]),
+                                    accession_names=list(accession_ids))
+        hit_index = [hit_map[index] for index in hit_index]
+        contig_names = list(contig_ids)
+
+    hit_offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    hit_total = 0
+    for table in tables:
+        hit_offsets.append(table.hit_offsets[1:] + hit_total)
+        hit_total += table.hit_offsets[-1]
+
+    return RegionTable(contig=numpy.concatenate(contig).astype(numpy.int32),
+                       query=[query for table in tables for query in table.query],
+                       start=numpy.concatenate([table.start for table in tables]),
+                       end=numpy.concatenate([table.end for table in tables]),
+                       query_length=numpy.concatenate([table.query_length for table in tables]),
+                       strand=numpy.concatenate([table.strand for table in tables]),
+                       region_type=numpy.concatenate([table.region_type for table in tables]),
+                       note=[note for table in tables for note in table.note],
+                       hit_offsets=numpy.concatenate(hit_offsets),
+                       hit_index=numpy.concatenate(hit_index).astype(numpy.int64),
+                       hits=hits,
+                       contig_names=contig_names)
+
+
+def best_hits(table: RegionTable, hitcap: int) -> RegionTable:
+    """A copy of a table in which every region keeps at most hitcap of its hits: those with the lowest e-values,
+    in their original order when e-values are equal. Kept hits stay in the order they had in the table."""
+
+    counts = table.hit_counts()
+    region_of_hit = numpy.repeat(numpy.arange(len(table)), counts)
+
+    # Position of every hit within its region, after sorting the hits of each region by e-value (lexsort is stable)
+    order = numpy.lexsort((table.hits.eval[table.hit_index], region_of_hit))
+    rank = numpy.empty(len(order), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(order)) - table.hit_offsets[:-1][region_of_hit[order]]
+
+    hit_offsets = numpy.zeros(len(table) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.minimum(counts, hitcap), out=hit_offsets[1:])
+
+    return RegionTable(contig=table.contig.copy(), query=list(table.query), start=table.start.copy(),
+                       end=table.end.copy(), query_length=table.query_length.copy(), strand=table.strand.copy(),
+                       region_type=table.region_type.copy(), note=list(table.note), hit_offsets=hit_offsets,
+                       hit_index=table.hit_index[rank < hitcap], hits=table.hits, contig_names=table.contig_names)
+
+
+def empty(like: RegionTable) -> RegionTable:
+    """An empty table that shares the hits and contig names of another table."""
+    return like.take(numpy.zeros(0, dtype=numpy.int64))
+
+
+def detach(table: RegionTable) -> RegionTable:
+    """A copy of a table without its HitTable and contig names, which is much cheaper to send between processes.
+    Its rows still point at the same hits and contigs, attach() gives them back."""
+
+    return RegionTable(contig=table.contig, query=table.query, start=table.start, end=table.end,
+                       query_length=table.query_length, strand=table.strand, region_type=table.region_type,
+                       note=table.note, hit_offsets=table.hit_offsets, hit_index=table.hit_index, hits=None,
+                       contig_names=None)
+
+
+def attach(table: RegionTable, like: RegionTable) -> RegionTable:
+    """Gives a detached table the HitTable and contig names of the table it was made from (or an identical copy)."""
+
+    table.hits = like.hits
+    table.contig_names = like.contig_names
+    return table
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from typing import NamedTuple, List, Callable
+
+from Bio.Blast.Applications import NcbiblastpCommandline, NcbiblastxCommandline
+
+from . import blast_search, kmer_search
+
+"""
+Programs that annotate can search its queries with (see --search_engine). Every engine writes the same BLAST tabular
+output with comment lines (outfmt 7), so the rest of pseudofinder reads them all in the same way:
+    *blast:   NCBI BLAST+ (blastp and blastx), against a BLAST database.
+    *diamond: DIAMOND (blastp and blastx), against a DIAMOND database. DIAMOND cannot write outfmt 7, so its
+              tabular output (outfmt 6) is converted afterwards.
+    *mock:    A deterministic k-mer search against a protein fasta file (see kmer_search.py), written in python.
+              It is much less sensitive than the others, and is meant for testing and benchmarking the workflow
+              where BLAST is not installed.
+"""
+
+# Fields of every hit, in the order that parse_blast() expects them
+BLAST_OUTFMT = "\'7 qseqid sseqid pident length mismatch gapopen qstart qend sstart send slen evalue bitscore frames stitle\'"
+DIAMOND_FIELDS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send",
+                  "slen", "evalue", "bitscore", "qframe", "stitle"]
+DIAMOND_SUFFIX = ".diamond.tsv"
+
+# command(args, database, hitcap, program, query, out, threads) returns the command line that searches the fasta file
+# 'query' against database with program (blastp or blastx), keeping at most hitcap hits per query.
+# If finish is not None, finish(program, query, out, database) is called once the command is done, to convert its
+# output into outfmt 7.
+SearchEngine = NamedTuple('SearchEngine', [('name', str),
+                                           ('command', Callable),
+                                           ('finish', Callable)])
+
+
+def blast_command(args, database: str, hitcap: int, program: str, query: str, out: str, threads: int):
+    """BLASTP or BLASTX command line for a fasta file against DB of your choice."""
+
+    commandline = NcbiblastpCommandline if program == 'blastp' else NcbiblastxCommandline
+
+    return commandline(query=query,
+                       num_threads=threads,
+                       db=database,
+                       max_target_seqs=hitcap,
+                       max_hsps=1,
+                       evalue=args.evalue,
+                       outfmt=BLAST_OUTFMT,
+                       out=out)
+
+
+def diamond_command(args, database: str, hitcap: int, program: str, query: str, out: str, threads: int) -> List[str]:
+    """DIAMOND command line for a fasta file, which writes outfmt 6 next to 'out' (see diamond_to_outfmt7)."""
+
+    return ["diamond", program,
+            "--query", query,
+            "--db", database,
+            "--out", out + DIAMOND_SUFFIX,
+            "--outfmt", "6"] + DIAMOND_FIELDS + [
+            "--max-target-seqs", str(hitcap),
+            "--max-hsps", "1",
+            "--evalue", str(args.evalue),
+            "--threads", str(threads)]
+
+
+def diamond_to_outfmt7(program: str, query: str, out: str, database: str) -> None:
+    """Converts the outfmt 6 file that DIAMOND wrote for the queries of a fasta file into outfmt 7. DIAMOND only
+    reports queries with hits, in any order, so every query gets its block in the order of the fasta file."""
+
+    hits_by_query = {}
+    with open(out + DIAMOND_SUFFIX, 'r') as diamond_output:
+        for line in diamond_output:
+            fields = line.rstrip("\n").split("\t")
+            hits_by_query.setdefault(fields[0], []).append(fields[1:])
+
+    records = blast_search.read_fasta_records(query)
+    with open(out, 'w') as output:
+        for record in records:
+            description = record.splitlines()[0][1:].strip()
+            kmer_search.write_block(output, program="%s (diamond)" % program, description=description,
+                                    database=database, hits=hits_by_query.get(description.split()[0], []))
+        output.write("%s%d queries\n" % (blast_search.BLAST_FOOTER, len(records)))
+
+    os.remove(out + DIAMOND_SUFFIX)
+
+
+def mock_command(args, database: str, hitcap: int, program: str, query: str, out: str, threads: int) -> List[str]:
+    """Command line that runs kmer_search.py on a fasta file. It always uses a single thread."""
+
+    return [sys.executable, kmer_search.__file__, program,
+            "-query", query,
+            "-db", database,
+            "-out", out,
+            "-evalue", str(args.evalue),
+            "-max_target_seqs", str(hitcap)]
+
+
+ENGINES = {'blast': SearchEngine(name='blast', command=blast_command, finish=None),
+           'diamond': SearchEngine(name='diamond', command=diamond_command, finish=diamond_to_outfmt7),
+           'mock': SearchEngine(name='mock', command=mock_command, finish=None)}
+
+
+def program_name(engine: SearchEngine, program: str) -> str:
+    """Name of a program of an engine, as it is recorded in the hit cache (see hit_cache.search_settings).
+    BLAST keeps the plain program name, so that results cached before there were other engines are still found."""
+    return program if engine.name == 'blast' else "%s %s" % (engine.name, program)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+import copy
+import heapq
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple, List, Iterator, Callable
+
+import numpy
+
+from . import annotate, genome_index, region_table
+
+"""
+In-memory parameter sweeps over the annotate workflow, used by visualize.
+
+The blast files are parsed and split into contigs once (load_sweep). Every point of the sweep then only runs the
+pseudogene checks on those contigs and counts the results (count_pseudogenes): no output files are written, and no
+log files have to be read back. The contig tables are never modified by the checks, so they are shared by all points.
+
+A ThresholdProfile holds the per-region values that the checks compare with the settings (length ratios, hit
+fractions, and the shared hits and distance of neighbouring regions). They are sorted once, so the number of regions
+that pass a threshold is a binary search (numpy.searchsorted) for any number of threshold values at once.
+
+run_sweep() checks many points, in a pool of processes if asked to. Workers receive the parsed blast files once,
+when they start (inherited through fork where possible), and are then only sent the settings of each point.
+
+explore() samples several settings at once without a full grid. It starts from the corners and centre of the whole
+range, and keeps splitting the cells (boxes of settings) in which the number of pseudogenes changes the most into
+2^d smaller cells, like a quadtree in d dimensions, until it runs out of points or depth. All its rounds of points go
+through one SweepRunner, so the profile is built and the pool of processes is started only once.
+explore_hitcaps() runs explore() for a few hitcaps, since every hitcap needs blast files limited to it (load_sweep).
+"""
+
+# SweepData of the current sweep, set in every worker process by init_sweep_worker()
+WorkerSweep = None
+
+# A setting that explore() varies between low and high. Integer settings (ie. distance) are rounded.
+ExploreParameter = NamedTuple('ExploreParameter', [('name', str),
+                                                   ('low', float),
+                                                   ('high', float),
+                                                   ('integer', bool)])
+
+# Result of explore(): every point that was checked, and how sensitive the number of pseudogenes is to each setting.
+Exploration = NamedTuple('Exploration', [('points', List[dict]),        # settings and 'pseudogenes' of every point
+                                         ('sensitivity', List[tuple])])  # (name, sensitivity), most sensitive first
+
+# Everything a sweep needs from the blast files, parsed once.
+SweepData = NamedTuple('SweepData', [('contigs', List[annotate.Contig]),  # contigs with orfs and intergenic regions
+                                     ('stats', annotate.RunStats)])       # statistics collected while parsing
+
+
+def load_sweep(args, genome: genome_index.GenomeIndex) -> SweepData:
+    """Parses the blast files given in args (args.blastp, args.blastx) and splits their regions into contigs.
+    Regions are limited to args.hitcap and args.intergenic_length (see annotate.limit_to_settings), so every point of
+    a sweep uses the same hitcap and intergenic length."""
+
+    stats = annotate.RunStats()
+    orfs = annotate.limit_to_settings(args, annotate.parse_blast(filename=args.blastp, blast_format='BlastP',
+                                                                 stats=stats))
+    intergenic_regions = annotate.limit_to_settings(args, annotate.parse_blast(filename=args.blastx,
+                                                                               blast_format='BlastX', stats=stats))
+    all_regions = region_table.concatenate([orfs, intergenic_regions])
+
+    contigs = annotate.sort_contigs(loc=annotate.split_regions_into_contigs(lori=all_regions, genome=genome))
+    stats.number_of_contigs = len(contigs)
+
+    return SweepData(contigs=contigs, stats=stats)
+
+
+def count_pseudogenes(args, data: SweepData) -> annotate.RunStats:
+    """Checks every contig for pseudogenes with the settings in args, and returns the statistics of that run.
+    These are the same statistics that reannotate would write to its log file with the same settings."""
+
+    stats = annotate.RunStats().merge(data.stats)
+
+    for contig in data.contigs:
+        stats.merge(annotate.annotate_contig(args, contig, orfs=None)[2])  # Functional genes are not needed
+
+    return stats
+
+
+class ThresholdProfile:
+    """Values of every region of a sweep that do not depend on the settings, sorted for numpy.searchsorted."""
+
+    def __init__(self, data: SweepData, hitcap: int):
+        length_ratios = []
+        hit_counts = []
+        pair_fractions = []
+        pair_distances = []
+
+        for contig in data.contigs:
+            regions = contig.regions
+
+            # ORFs are too short if their ratio is below length_pseudo (see annotate.check_individual_ORFs)
+            length_ratios.append(annotate.orf_length_ratios(regions)[1])
+            hit_counts.append(regions.hit_counts()[regions.region_type == annotate.RegionType.intergenic.value])
+
+            # Neighbouring regions, in order of start position (see annotate.check_adjacent_regions)
+            order = numpy.argsort(regions.start, kind='stable')
+            first, second = order[:-1], order[1:]
+            shared_hits = region_table.SharedHits(regions)
+            number_of_hits = regions.hit_counts()
+            least_hits = numpy.minimum(number_of_hits[first], number_of_hits[second])
+            shared = numpy.array([shared_hits.count(r1, r2) for r1, r2 in zip(first.tolist(), second.tolist())],
+                                 dtype=numpy.int64)
+
+            # Pairs that can never be joined get a fraction of -1, so they never pass a shared_hits threshold
+            both_intergenic = ((regions.region_type[first] == annotate.RegionType.intergenic.value) &
+                               (regions.region_type[second] == annotate.RegionType.intergenic.value))
+            can_join = (least_hits > 0) & (regions.strand[first] == regions.strand[second]) & ~both_intergenic
+            pair_fractions.append(numpy.where(can_join, shared / numpy.maximum(least_hits, 1), -1.0))
+            pair_distances.append(regions.start[second] - regions.end[first])
+
+        self.hitcap = hitcap
+        self.length_ratios = numpy.sort(numpy.concatenate(length_ratios + [numpy.zeros(0)]))
+        self.hit_fractions = numpy.sort(numpy.concatenate(hit_counts + [numpy.zeros(0, dtype=numpy.int64)]) / hitcap)
+        self.pair_fractions = numpy.concatenate(pair_fractions + [numpy.zeros(0)])
+        self.pair_distances = numpy.concatenate(pair_distances + [numpy.zeros(0, dtype=numpy.int64)])
+
+    def short_pseudogenes(self, length_pseudo) -> numpy.ndarray:
+        """Number of ORFs flagged as too short with each value of length_pseudo."""
+        return numpy.searchsorted(self.length_ratios, length_pseudo, side='left')
+
+    def intergenic_pseudogenes(self, intergenic_threshold) -> numpy.ndarray:
+        """Number of intergenic regions flagged as pseudogenes with each value of intergenic_threshold."""
+        return len(self.hit_fractions) - numpy.searchsorted(self.hit_fractions, intergenic_threshold, side='left')
+
+    def joinable_pairs(self, shared_hits, distance: int) -> numpy.ndarray:
+        """Number of neighbouring regions (before any of them are joined) that are close enough and share enough hits
+        to be joined, with each value of shared_hits."""
+        fractions = numpy.sort(self.pair_fractions[self.pair_distances < distance])
+        return len(fractions) - numpy.searchsorted(fractions, shared_hits, side='left')
+
+    def setting_key(self, args) -> tuple:
+        """Settings with the same key flag exactly the same regions, so they find the same pseudogenes.
+        Which ORFs are too short, and which intergenic regions have enough hits, only depends on how many pass."""
+        return (int(self.short_pseudogenes(args.length_pseudo)),
+                int(self.intergenic_pseudogenes(args.intergenic_threshold)),
+                args.shared_hits, args.distance, args.hitcap)
+
+
+def run_sweep(args, data: SweepData, points: List[dict], workers: int = 1) -> Iterator[tuple]:
+    """Runs count_pseudogenes() for every point, a dictionary of settings that replace those in args
+    (ie. {'length_pseudo': 0.5, 'shared_hits': 0.3}). Yields (point number, RunStats) as soon as each point is done,
+    in no particular order. Points that flag the same regions (see ThresholdProfile.setting_key) are only checked once.
+    With workers > 1, points are checked in a pool of that many processes."""
+
+    with SweepRunner(args, data, workers) as runner:
+        yield from runner.run(points)
+
+
+class SweepRunner:
+    """Checks the points of a sweep that arrive in several rounds (see explore), with the same ThresholdProfile and,
+    with workers > 1, the same pool of processes for all of them. The pool is started for the first round that has
+    more than one group of points, and shut down when the runner is closed. Every setting key is only checked once,
+    in whichever round it first appears."""
+
+    def __init__(self, args, data: SweepData, workers: int = 1):
+        self.args = args
+        self.data = data
+        self.workers = workers
+        self.profile = ThresholdProfile(data, hitcap=args.hitcap)
+        self.results = {}   # setting key -> RunStats of every group checked so far
+        self.pool = None
+
+    def __enter__(self) -> 'SweepRunner':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self, points: List[dict]) -> Iterator[tuple]:
+        """Like run_sweep(), for one round of points."""
+
+        # Groups the points by setting key, every group is only checked once
+        groups = {}
+        for point_number, point in enumerate(points):
+            point_args = copy.copy(self.args)
+            vars(point_args).update(point)
+            groups.setdefault(self.profile.setting_key(point_args), (point_args, []))[1].append(point_number)
+
+        # Groups that were checked in an earlier round
+        for key in [key for key in groups if key in self.results]:
+            for point_number in groups.pop(key)[1]:
+                yield point_number, self.results[key]
+
+        keys = list(groups)
+
+        if self.workers <= 1 or len(keys) <= 1:
+            for key in keys:
+                self.results[key] = count_pseudogenes(groups[key][0], self.data)
+                for point_number in groups[key][1]:
+                    yield point_number, self.results[key]
+            return
+
+        if self.pool is None:
+            # Workers are forked where possible, so that the parsed blast files are not copied into them
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method),
+                                            initializer=init_sweep_worker, initargs=(self.data,))
+
+        # Small batches, so that results come back steadily and the pool stays busy until the end
+        batch_size = max(1, len(keys) // (8 * self.workers))
+        batches = [keys[start:start + batch_size] for start in range(0, len(keys), batch_size)]
+        futures = [self.pool.submit(sweep_batch, [groups[key][0] for key in batch]) for batch in batches]
+        batch_of_future = dict(zip(futures, batches))
+
+        try:
+            for future in as_completed(futures):
+                for key, stats in zip(batch_of_future[future], future.result()):
+                    self.results[key] = stats
+                    for point_number in groups[key][1]:
+                        yield point_number, stats
+        finally:  # Stops the remaining batches if the sweep is interrupted
+            for future in futures:
+                future.cancel()
+
+
+def init_sweep_worker(data: SweepData) -> None:
+    """Runs once in every worker process of run_sweep()."""
+
+    global WorkerSweep
+    WorkerSweep = data
+
+
+def sweep_batch(batch: List) -> List[annotate.RunStats]:
+    """Runs count_pseudogenes() on a batch of settings (args), in a worker process."""
+
+    return [count_pseudogenes(point_args, WorkerSweep) for point_args in batch]
+
+
+def first_sample_size(dimensions: int, max_depth: int) -> int:
+    """Number of points that explore() always checks first: the corners and centre of the whole range (3^d points),
+    or only its corners (2^d points) with a max_depth of 0."""
+    return 3 ** dimensions if max_depth > 0 else 2 ** dimensions
+
+
+def explore(args, data: SweepData, parameters: List[ExploreParameter], budget: int, max_depth: int, workers: int = 1,
+            tolerance: float = 0.02, progress: Callable = None) -> Exploration:
+    """Explores the number of pseudogenes over several settings at once, checking at most budget points. The budget
+    must be at least first_sample_size().
+
+    Points lie on a lattice with 2^max_depth steps along every setting. A cell is split if the number of pseudogenes
+    at its corners differs by more than tolerance times the range seen so far, cells with the largest difference first.
+    The sensitivity to each setting is the average change in the number of pseudogenes from one end of its range
+    to the other, measured along the edges of all cells (weighted by their size).
+    progress(points checked, budget) is called after each batch of points."""
+
+    if budget < first_sample_size(len(parameters), max_depth):
+        raise ValueError("A budget of %s points is smaller than the first sample of explore (%s points)."
+                         % (budget, first_sample_size(len(parameters), max_depth)))
+
+    steps = 2 ** max_depth
+    counts = {}  # lattice coordinates -> number of pseudogenes
+
+    def settings(coordinates: tuple) -> dict:
+        point = {}
+        for parameter, step in zip(parameters, coordinates):
+            value = parameter.low + (parameter.high - parameter.low) * step / steps
+            point[parameter.name] = int(round(value)) if parameter.integer else value
+        return point
+
+    def check(corners: List[tuple]) -> None:
+        new_corners = [corner for corner in dict.fromkeys(corners) if corner not in counts]
+        for point_number, stats in runner.run([settings(corner) for corner in new_corners]):
+            counts[new_corners[point_number]] = stats.pseudogenes_total
+        if progress is not None:
+            progress(len(counts), budget)
+
+    def cell_corners(origin: tuple, size: int) -> List[tuple]:
+        return [tuple(o + size * c for o, c in zip(origin, corner)) for corner in itertools.product((0, 1), repeat=len(origin))]
+
+    def children(origin: tuple, size: int) -> List[tuple]:
+        return [tuple(o + size // 2 * c for o, c in zip(origin, child)) for child in itertools.product((0, 1), repeat=len(origin))]
+
+    def spread(origin: tuple, size: int) -> float:
+        values = [counts[corner] for corner in cell_corners(origin, size)]
+        return max(values) - min(values)
+
+    # All points are checked with the same profile and pool of processes
+    with SweepRunner(args, data, workers) as runner:
+        # The whole range is always split once, so the first sample is its corners and centre (3^d points)
+        root = tuple(0 for _ in parameters)
+        cells = children(root, steps) if max_depth > 0 else [root]
+        cell_size = steps // 2 if max_depth > 0 else steps
+        check([corner for cell in cells for corner in cell_corners(cell, cell_size)])
+
+        leaves = []  # (origin, size) of cells that were not split
+        queue = [(-spread(cell, cell_size), cell, cell_size) for cell in cells]  # cells with the largest spread first
+        heapq.heapify(queue)
+
+        while queue:
+            negative_spread, origin, size = heapq.heappop(queue)
+            range_seen = max(counts.values()) - min(counts.values())
+
+            new_corners = {corner for child in children(origin, size) for corner in cell_corners(child, size // 2)} \
+                if size > 1 else set()
+            new_corners.difference_update(counts)
+
+            if size == 1 or -negative_spread <= tolerance * range_seen or len(counts) + len(new_corners) > budget:
+                leaves.append((origin, size))
+                continue
+
+            check(list(new_corners))
+            for child in children(origin, size):
+                heapq.heappush(queue, (-spread(child, size // 2), child, size // 2))
+
+    # Sensitivity: change along each setting on every edge of every leaf cell, scaled to the whole range of the setting
+    sensitivity = []
+    for dimension, parameter in enumerate(parameters):
+        total_change = 0.0
+        total_weight = 0.0
+        for origin, size in leaves:
+            weight = (size / steps) ** len(parameters)
+            edges = [corner for corner in cell_corners(origin, size) if corner[dimension] == origin[dimension]]
+            changes = [abs(counts[tuple(c + size * (d == dimension) for d, c in enumerate(corner))] - counts[corner])
+                       for corner in edges]
+            total_change += weight * (sum(changes) / len(changes)) * (steps / size)
+            total_weight += weight
+        sensitivity.append((parameter.name, total_change / total_weight))
+
+    points = [dict(settings(corner), pseudogenes=count) for corner, count in sorted(counts.items())]
+
+    return Exploration(points=points, sensitivity=sorted(sensitivity, key=lambda item: item[1], reverse=True))
+
+
+def explore_hitcaps(args, genome: genome_index.GenomeIndex, hitcaps: List[int], parameters: List[ExploreParameter],
+                    budget: int, max_depth: int, workers: int = 1, tolerance: float = 0.02,
+                    progress: Callable = None) -> Exploration:
+    """Runs explore() once for every hitcap, with an equal share of the budget. Each hitcap has its own load_sweep()
+    (regions limited to that hitcap, see annotate.limit_to_settings) and so its own SweepRunner.
+    Every point gets a 'hitcap' setting. The sensitivity to hitcap is the change in the number of pseudogenes from one
+    hitcap to the next, summed from the smallest to the largest and averaged over the points that were checked with
+    every hitcap (at least the first sample). The sensitivity to the other settings is averaged over the hitcaps."""
+
+    hitcap_budget = budget // len(hitcaps)
+    points = []
+    counts = []         # for every hitcap: settings of each point -> number of pseudogenes
+    sensitivities = []  # for every hitcap: {name: sensitivity}
+
+    for number, hitcap in enumerate(hitcaps):
+        hitcap_args = copy.copy(args)
+        hitcap_args.hitcap = hitcap
+
+        def hitcap_progress(done: int, total: int) -> None:
+            progress(number * hitcap_budget + done, hitcap_budget * len(hitcaps))
+
+        exploration = explore(hitcap_args, load_sweep(hitcap_args, genome=genome), parameters, budget=hitcap_budget,
+                              max_depth=max_depth, workers=workers, tolerance=tolerance,
+                              progress=hitcap_progress if progress is not None else None)
+
+        points.extend(dict(point, hitcap=hitcap) for point in exploration.points)
+        counts.append({tuple(point[parameter.name] for parameter in parameters): point['pseudogenes']
+                       for point in exploration.points})
+        sensitivities.append(dict(exploration.sensitivity))
+
+    common = set.intersection(*[set(hitcap_counts) for hitcap_counts in counts])
+    hitcap_change = sum(abs(higher[point] - lower[point]) for point in common
+                        for lower, higher in zip(counts, counts[1:])) / len(common)
+
+    sensitivity = [(parameter.name, sum(hitcap_sensitivity[parameter.name] for hitcap_sensitivity in sensitivities) /
+                    len(hitcaps)) for parameter in parameters] + [('hitcap', hitcap_change)]
+
+    return Exploration(points=points, sensitivity=sorted(sensitivity, key=lambda item: item[1], reverse=True))
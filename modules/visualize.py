@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 
-from . import reannotate
+from . import reannotate, genome_index, blast_cache, sweep
 
 import sys
 import os
 import argparse
-import re
 import shutil
 import subprocess
-from time import localtime, strftime
+import json
+import time
+from time import localtime, strftime, gmtime
 from contextlib import contextmanager
 
 import pandas as pd
 import numpy
 from plotly.offline import plot
-from plotly.graph_objs import Surface, Layout, Scene, Figure
+from plotly.graph_objs import Surface, Scatter3d, Layout, Scene, Figure
+
+
+# Settings that --explore varies together for every hitcap (see sweep.explore_hitcaps)
+EXPLORED_SETTINGS = ['length_pseudo', 'shared_hits', 'intergenic_threshold', 'distance']
 
 
 def current_time() -> str:
@@ -37,9 +42,9 @@ def get_args():
                                  help='Specify an output prefix. A folder will also be created with this name.',
                                  required=True)
     always_required.add_argument('-p', '--blastp', required=True,
-                                 help='Specify an input blastp file.')
+                                 help='Specify an input blastp file (may be gzip-compressed).')
     always_required.add_argument('-x', '--blastx', required=True,
-                                 help='Specify an input blastx file.')
+                                 help='Specify an input blastx file (may be gzip-compressed).')
     always_required.add_argument('-log', '--logfile', required=True,
                                  help='Provide the log file from the run that generated the blast files.')
 
@@ -56,8 +61,9 @@ def get_args():
     optional.add_argument('-k', '--keep_files',
                           default=False,
                           type=bool,
-                          help='Specifies whether to keep all output files. \'-k False\' will remove'
-                               ' all files except for the graph and data matrix after running. Default is %(default)s.')
+                          help='Specifies whether to write and keep all output files of every combination of settings.'
+                               ' \'-k False\' only writes the graph and data matrix, which is much faster.'
+                               ' Default is %(default)s.')
     optional.add_argument('-t', '--title',
                           default=None,
                           type=str,
@@ -68,11 +74,48 @@ def get_args():
                                'Default is %(default)s.')
     optional.add_argument('-d', '--distance', default=None, type=int,
                           help='Maximum distance between two regions to consider joining them. Default is %(default)s.')
+    optional.add_argument('-hc', '--hitcap', default=None, type=int,
+                          help='Maximum number of blast hits used per region, up to the hitcap that BLAST was run\n'
+                               'with (see reannotate). Default is the hitcap in the log file.')
+    optional.add_argument('-i', '--intergenic_length', default=None, type=int,
+                          help='Length of the shortest intergenic regions to check, from the length that BLAST was\n'
+                               'run with up (see reannotate). Default is the intergenic length in the log file.')
+    optional.add_argument('-cc', '--clear_cache', default=False, action='store_true',
+                          help='Discard any cached results from previous parses of the blast files.')
+    optional.add_argument('-w', '--workers', default=1, type=int,
+                          help='Number of processes used to check combinations of settings (or contigs, with\n'
+                               '--keep_files). Default is %(default)s.')
+    optional.add_argument('-tc', '--threshold_counts', default=False, action='store_true',
+                          help='Instead of plotting, print how many regions pass each value of --length_pseudo,\n'
+                               '--intergenic_threshold and --shared_hits (one setting at a time), at the resolution\n'
+                               'given by --resolution. This only takes a few seconds.')
+    optional.add_argument('-e', '--explore', default=False, action='store_true',
+                          help='Instead of a grid of length_pseudo x shared_hits, explore length_pseudo, shared_hits,\n'
+                               'intergenic_threshold and distance together, for a few hitcaps. Points are added where\n'
+                               'the number of pseudogenes changes the most, and the settings are ranked by how much\n'
+                               'they matter.')
+    optional.add_argument('-b', '--budget', default=900, type=int,
+                          help='Maximum number of combinations checked by --explore, shared equally by the hitcaps.\n'
+                               'Must be at least 81 per hitcap. Default is %(default)s.')
+    optional.add_argument('-eh', '--explore_hitcaps', default=3, type=int,
+                          help='Number of hitcaps explored by --explore, evenly spaced up to the hitcap that BLAST\n'
+                               'was run with. Default is %(default)s.')
+    optional.add_argument('-ed', '--explore_depth', default=5, type=int,
+                          help='Finest step of --explore, as 1/2^depth of the range of each setting.\n'
+                               'Default is %(default)s.')
 
     # "parse_known_args" will create a tuple of known arguments in the first position and unknown in the second.
     # We only care about the known arguments, so we take [0].
     args = parser.parse_known_args()[0]
 
+    # Every hitcap starts with the corners and centre of the whole range of settings (see sweep.explore)
+    first_sample = sweep.first_sample_size(len(EXPLORED_SETTINGS), args.explore_depth)
+    if args.explore and args.explore_hitcaps < 1:
+        parser.error("--explore_hitcaps must be at least 1.")
+    if args.explore and args.budget < args.explore_hitcaps * first_sample:
+        parser.error("--budget must be at least %s to explore %s hitcaps (%s combinations each)."
+                     % (args.explore_hitcaps * first_sample, args.explore_hitcaps, first_sample))
+
     return args
 
 
@@ -89,71 +132,207 @@ def suppress_output_to_console():
 
 
 def settings_loop(args):
-    """This function will run annotate.py with a variety of settings."""
+    """This function will count the pseudogenes found with a variety of settings, and write them to the matrix file.
+
+    The blast files are only parsed once, and each combination of settings is checked in memory (see sweep.py),
+    in --workers processes. Combinations that flag the same regions (see sweep.ThresholdProfile) are only checked once.
+    With --keep_files, reannotate.py is run for every combination instead, so that all of its output files are kept.
 
-    interval = 1 / args.resolution  # interval will be used to print the progress to stdout
+    Every finished combination is added to a checkpoint file straight away. If the sweep is interrupted, running the
+    same command again only checks the combinations that are missing from it."""
 
     # Preparing arguments for reannotate.py
     command_line_args = args
     logged_args = reannotate.parse_log(args.logfile)
     reannotate.fix_args(command_line_args, logged_args)
     basename = args.outprefix
+    genome = genome_index.load_genome(args.genome)  # Loaded once and shared by every reannotation below
+
+    grid = [{'length_pseudo': length_pseudo, 'shared_hits': shared_hits}
+            for length_pseudo in numpy.arange(0.0, 1.01, 1 / args.resolution)
+            for shared_hits in numpy.arange(0.0, 1.01, 1 / args.resolution)]
+
+    checkpoint = basename + '_matrix.partial.tsv'
+    fingerprint = sweep_fingerprint(args)
+    counts = read_checkpoint(checkpoint, fingerprint)  # (length_pseudo, shared_hits) -> number of pseudogenes
+    remaining = [point for point in grid if matrix_key(point) not in counts]
+
+    if not counts:  # Starting from scratch
+        with open(checkpoint, 'w') as partial:
+            partial.write(fingerprint + "\n")
+        if args.keep_files is True:  # Reset the folder specified to contain the outputs of every combination
+            if os.path.exists(basename):
+                shutil.rmtree(basename)
+            os.makedirs(basename)
+    else:
+        print("%s\tResuming from %s: %s of %s combinations are already done." % (current_time(), checkpoint,
+                                                                               len(counts), len(grid)))
+
+    started = time.time()
+    with open(checkpoint, 'a') as partial:
+        def record(point, stats):
+            counts[matrix_key(point)] = float(stats.pseudogenes_total)
+            partial.write('\t'.join(map(str, matrix_key(point) + (counts[matrix_key(point)],))) + "\n")
+            partial.flush()
+            print_progress(done=len(counts), total=len(grid), done_before=len(grid) - len(remaining), started=started)
+
+        if args.keep_files is True:
+            for point in remaining:
+                vars(args).update(point)
+                args.outprefix = "%s/L%s_S%s" % (basename, point['length_pseudo'], point['shared_hits'])
+                with suppress_output_to_console():  # Prevents writing to stdout
+                    record(point, reannotate.reannotate(args, genome=genome))
+            args.outprefix = basename  # Have to put this back to its original value
+
+        elif remaining:
+            sweep_data = sweep.load_sweep(args, genome=genome)  # Parsed once and shared by every combination below
+            for point_number, stats in sweep.run_sweep(args, sweep_data, points=remaining, workers=args.workers):
+                record(remaining[point_number], stats)
 
-    for length_pseudo in numpy.arange(0.0, 1.01, interval):
-        print("%s\tCollecting data: %d%% completed" % (current_time(), round(length_pseudo*100, 2)), end='\r')
+    print('')  # Necessary because the previous print was rolling back on itself
+
+    with open(basename + '_matrix.tsv', 'w') as outfile:
+        outfile.write("length_pseudo\tshared_hits\tpseudogenes\n")  # header for the output file
+        for point in grid:
+            outfile.write('\t'.join(map(str, matrix_key(point) + (counts[matrix_key(point)],)))+"\n")
+    os.remove(checkpoint)
 
-        for shared_hits in numpy.arange(0.0, 1.01, interval):
-            args.length_pseudo = length_pseudo
-            args.shared_hits = shared_hits
-            args.outprefix = "%s/L%s_S%s" % (basename, length_pseudo, shared_hits)
 
-            with suppress_output_to_console():  # Prevents writing to stdout
-                reannotate.reannotate(args)
+def explore_loop(args) -> list:
+    """Explores length_pseudo, shared_hits, intergenic_threshold and distance together for --explore_hitcaps hitcaps
+    (see sweep.explore_hitcaps), writes every point checked to the matrix file and returns the settings, hitcap
+    included, ranked by how much they change the number of pseudogenes. Hitcaps are evenly spaced up to the hitcap
+    that BLAST was run with, and distance is explored from 0 to twice its logged value."""
+
+    logged_args = reannotate.parse_log(args.logfile)
+    reannotate.fix_args(args, logged_args)
+    genome = genome_index.load_genome(args.genome)
 
-    args.outprefix = basename  # Have to put this back to its original value
+    ranges = {'length_pseudo': (0.0, 1.0, False),
+              'shared_hits': (0.0, 1.0, False),
+              'intergenic_threshold': (0.0, 1.0, False),
+              'distance': (0, 2 * args.distance, True)}
+    parameters = [sweep.ExploreParameter(name, *ranges[name]) for name in EXPLORED_SETTINGS]
+    hitcaps = sorted({max(1, int(round(args.search_hitcap * number / args.explore_hitcaps)))
+                      for number in range(1, args.explore_hitcaps + 1)})
+
+    started = time.time()
+
+    def progress(done, budget):
+        print_progress(done=done, total=budget, done_before=0, started=started)
+
+    exploration = sweep.explore_hitcaps(args, genome, hitcaps, parameters, budget=args.budget,
+                                        max_depth=args.explore_depth, workers=args.workers, progress=progress)
     print('')  # Necessary because the previous print was rolling back on itself
 
+    names = ['hitcap'] + EXPLORED_SETTINGS
+    with open(args.outprefix + '_matrix.tsv', 'w') as outfile:
+        outfile.write('\t'.join(names + ['pseudogenes']) + "\n")
+        for point in exploration.points:
+            outfile.write('\t'.join(str(point[name]) for name in names + ['pseudogenes']) + "\n")
+
+    print("%s\tChecked %s combinations. Change in the number of pseudogenes from one end of each setting to the "
+          "other:" % (current_time(), len(exploration.points)))
+    for name, sensitivity in exploration.sensitivity:
+        print("\t%s\t%.1f" % (name, sensitivity))
+
+    return [name for name, sensitivity in exploration.sensitivity]
+
+
+def matrix_key(point: dict) -> tuple:
+    """(length_pseudo, shared_hits) of a combination of settings, as they are written in the matrix file."""
+    return float(point['length_pseudo']), float(point['shared_hits'])
+
 
-def parse_summary_files(args):
-    """This function will parse the summary files for the values needed to generate a 3D plot."""
-
-    outfile = open(args.outprefix + '_matrix.tsv', 'w')
-    outfile.write("length_pseudo\tshared_hits\tpseudogenes\n")  # header for the output file
-
-    for root, dirs, files in os.walk(args.outprefix):
-        log_files = [file for file in files if "_log.txt" in file]
-        for file in log_files:
-            path = os.path.join(root, file)
-            with open(path, 'r') as infile:
-                lines = infile.readlines()
-                data = []
-                # regex to find 'length_pseudo', 'shared_hits', 'num_pseudos'
-                for line in lines:
-                    if re.match('Length_pseudo', line):
-                        data.append(float(line.split(sep='\t')[1]))
-                    elif re.match('Shared_hits', line):
-                        data.append(float(line.split(sep='\t')[1]))
-                    elif re.match('Pseudogenes \(total\)', line):
-                        data.append(float(line.split(sep='\t')[1]))
-            outfile.write('\t'.join(map(str, data))+"\n")
-    outfile.close()
-
-
-def make_plot(args):
-    """This function will generate a 3D surface plot."""
-    raw_data = pd.read_csv(args.outprefix+'_matrix.tsv', sep="\t", dtype=float,
-                           names=['length_pseudo', 'shared_hits', 'vals'], header=0)
-    matrix = raw_data.pivot(index='length_pseudo', columns='shared_hits', values='vals')
-
-    data = [Surface(x=matrix.columns,
-                    y=matrix.index,
-                    z=matrix.values)]
+def sweep_fingerprint(args) -> str:
+    """First line of the checkpoint file. Describes everything, apart from length_pseudo and shared_hits,
+    that changes the results, so that a checkpoint is only resumed by the same sweep."""
+
+    return "# " + json.dumps({'blastp': blast_cache.file_stamp(args.blastp),
+                              'blastx': blast_cache.file_stamp(args.blastx),
+                              'distance': args.distance,
+                              'hitcap': args.hitcap,
+                              'intergenic_length': args.intergenic_length,
+                              'intergenic_threshold': args.intergenic_threshold,
+                              'keep_files': args.keep_files}, sort_keys=True)
+
+
+def read_checkpoint(checkpoint: str, fingerprint: str) -> dict:
+    """Returns the combinations already in a checkpoint file, if it was written by the same sweep."""
+
+    counts = {}
+
+    try:
+        with open(checkpoint, 'r') as partial:
+            if partial.readline().rstrip("\n") != fingerprint:
+                return {}
+            for line in partial:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 3:  # The last line may be incomplete if the sweep was killed
+                    counts[(float(fields[0]), float(fields[1]))] = float(fields[2])
+    except (OSError, ValueError):
+        return {}
+
+    return counts
+
+
+def print_progress(done: int, total: int, done_before: int, started: float) -> None:
+    """Prints a progress line that rolls back on itself, with an estimate of the time left."""
+
+    elapsed = time.time() - started
+    time_left = max(0.0, elapsed / (done - done_before) * (total - done))
+
+    print("%s\tCollecting data: %s / %s combinations (%d%%), %s left  " % (
+        current_time(), done, total, 100 * done // total, strftime("%H:%M:%S", gmtime(time_left))), end='\r')
+    sys.stdout.flush()
+
+
+def print_threshold_counts(args):
+    """Prints the number of regions that pass each threshold on the grid, from the sorted values of a ThresholdProfile.
+    Thresholds are applied one at a time, and pairs of neighbouring regions are counted before any are joined."""
+
+    logged_args = reannotate.parse_log(args.logfile)
+    reannotate.fix_args(args, logged_args)
+    genome = genome_index.load_genome(args.genome)
+    profile = sweep.ThresholdProfile(sweep.load_sweep(args, genome=genome), hitcap=args.hitcap)
+
+    values = numpy.arange(0.0, 1.01, 1 / args.resolution)
+    short_pseudogenes = profile.short_pseudogenes(values)
+    intergenic_pseudogenes = profile.intergenic_pseudogenes(values)
+    joinable_pairs = profile.joinable_pairs(values, distance=args.distance)
+
+    print("threshold\tshort ORFs (length_pseudo)\tintergenic pseudogenes (intergenic_threshold)\t"
+          "joinable neighbours (shared_hits, distance %s)" % args.distance)
+    for row in zip(values.tolist(), short_pseudogenes.tolist(), intergenic_pseudogenes.tolist(), joinable_pairs.tolist()):
+        print('%.3g\t%s\t%s\t%s' % row)
+
+
+def make_plot(args, axes: list = None):
+    """This function will generate a 3D surface plot.
+    For a matrix written by --explore, axes gives the two settings to plot, and every point is drawn as a marker
+    coloured by the number of pseudogenes."""
+    if axes is None:
+        raw_data = pd.read_csv(args.outprefix+'_matrix.tsv', sep="\t", dtype=float,
+                               names=['length_pseudo', 'shared_hits', 'vals'], header=0)
+        matrix = raw_data.pivot(index='length_pseudo', columns='shared_hits', values='vals')
+
+        data = [Surface(x=matrix.columns,
+                        y=matrix.index,
+                        z=matrix.values)]
+        axes = ['shared_hits', 'length_pseudo']
+    else:
+        raw_data = pd.read_csv(args.outprefix+'_matrix.tsv', sep="\t", dtype=float)
+        data = [Scatter3d(x=raw_data[axes[0]],
+                          y=raw_data[axes[1]],
+                          z=raw_data['pseudogenes'],
+                          mode='markers',
+                          marker=dict(size=3, color=raw_data['pseudogenes']))]
 
     layout = Layout(
         scene=Scene(
-            xaxis=dict(title='shared_hits',
+            xaxis=dict(title=axes[0],
                        autorange=True),
-            yaxis=dict(title='length_pseudo',
+            yaxis=dict(title=axes[1],
                        autorange=True),
             zaxis=dict(title=args.title,
                        autorange=True)
@@ -170,17 +349,21 @@ def main():
     args.length_pseudo = None
     args.shared_hits = None
 
-    # Reset the folder specified to contain the outputs
-    if os.path.exists(args.outprefix):
-        shutil.rmtree(args.outprefix)
-    os.makedirs(args.outprefix)
+    if args.clear_cache is True:
+        blast_cache.clear_cache(args.blastp)
+        blast_cache.clear_cache(args.blastx)
 
-    settings_loop(args)  # Generates the data
-    parse_summary_files(args)  # Collects and builds the matrix
-    make_plot(args)  # Plots the data
+    if args.threshold_counts is True:
+        print_threshold_counts(args)
+        return
 
-    if args.keep_files is False:
-        shutil.rmtree(args.outprefix)
+    if args.explore is True:
+        ranking = explore_loop(args)
+        make_plot(args, axes=ranking[:2])  # Plots the two settings that matter most
+        return
+
+    settings_loop(args)  # Generates the data and builds the matrix
+    make_plot(args)  # Plots the data
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import pseudofinder's modules the same way pseudofinder.py does ("from modules import annotate").
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
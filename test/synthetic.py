@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import random
+from types import SimpleNamespace
+from typing import List, NamedTuple
+
+from modules import annotate, genome_index, region_table
+
+"""
+Regions and blast hits for the tests, laid out on the CDS coordinates of the Tremblaya fixture or on made up contigs.
+
+Hits are drawn from a pool of accessions that moves along the contig, so that neighbouring regions share part of their
+hits and are joined now and then. Subject lengths are scattered around the length of the region, so that some ORFs are
+too short and others are not. The same random number generator seed always gives the same regions.
+"""
+
+FIXTURE_GENBANK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "candidatus_tremblaya_princeps_PCIT.gbf")
+
+# Where a region is, before it gets its hits
+RegionLayout = NamedTuple('RegionLayout', [('contig', str),
+                                           ('start', int),
+                                           ('end', int),
+                                           ('strand', str),
+                                           ('region_type', annotate.RegionType)])
+
+
+def annotate_args(**settings) -> SimpleNamespace:
+    """The settings that annotate checks regions with, at their defaults unless given."""
+
+    args = SimpleNamespace(distance=1000, hitcap=15, intergenic_length=30, intergenic_threshold=0.30,
+                           length_pseudo=0.65, shared_hits=0.50)
+    vars(args).update(settings)
+
+    return args
+
+
+def fixture_genome() -> genome_index.GenomeIndex:
+    """The Tremblaya fixture, parsed without writing a sidecar index next to it."""
+    return genome_index.read_genome(FIXTURE_GENBANK)
+
+
+def split_genome(genome: genome_index.GenomeIndex, parts: int) -> genome_index.GenomeIndex:
+    """The first contig of a genome cut into 'parts' contigs of about the same length, named TREMCTG_1, TREMCTG_2...
+    Features that cross a cut are left out."""
+
+    contig = genome.contigs[0]
+    sequence = str(contig.seq)
+    bounds = [contig.length * part // parts for part in range(parts + 1)]
+    contigs = []
+
+    for part in range(parts):
+        first, last = bounds[part], bounds[part + 1]
+
+        def inside(features: List[genome_index.GenomeFeature]) -> List[genome_index.GenomeFeature]:
+            return [feature._replace(start=feature.start - first, end=feature.end - first,
+                                     location="[%d:%d](%s)" % (feature.start - first, feature.end - first,
+                                                               '+' if feature.strand == 1 else '-'))
+                    for feature in features if first <= feature.start and feature.end <= last]
+
+        name = "TREMCTG_%d" % (part + 1)
+        contigs.append(genome_index.ContigRecord(name=name, id=name, length=last - first, seq=sequence[first:last],
+                                                 cds=inside(contig.cds), genes=inside(contig.genes)))
+
+    return genome_index.GenomeIndex(filename=genome.filename, contigs=contigs,
+                                    by_name={contig.name: contig for contig in contigs})
+
+
+def genome_layout(genome: genome_index.GenomeIndex) -> List[RegionLayout]:
+    """An ORF for every CDS of the genome, and an intergenic region between every two genes that are 30 bp apart,
+    with the coordinates that annotate reads from the headers of the blast files."""
+
+    layout = []
+
+    for contig in genome.contigs:
+        for cds in contig.cds:
+            layout.append(RegionLayout(contig=contig.name, start=cds.start + 1, end=cds.end,
+                                       strand='+' if cds.strand == 1 else '-', region_type=annotate.RegionType.ORF))
+
+        genes = sorted((gene.start, gene.end) for gene in contig.genes)
+        for (last_start, last_end), (this_start, this_end) in zip(genes, genes[1:]):
+            if this_start - last_end >= 30:
+                layout.append(RegionLayout(contig=contig.name, start=last_end + 1, end=this_start, strand='+',
+                                           region_type=annotate.RegionType.intergenic))
+
+    return layout
+
+
+def synthetic_layout(rng: random.Random, contigs: int, regions_per_contig: int) -> List[RegionLayout]:
+    """Densely packed contigs named SYNCTG_1, SYNCTG_2..., with runs of ORFs on the same strand and an intergenic
+    region every now and then."""
+
+    layout = []
+
+    for contig_number in range(contigs):
+        position = rng.randrange(1, 500)
+        strand = '+'
+        for _ in range(regions_per_contig):
+            if rng.random() < 0.2:
+                strand = '-' if strand == '+' else '+'
+            region_type = annotate.RegionType.intergenic if rng.random() < 0.15 else annotate.RegionType.ORF
+            length = rng.randrange(60, 300) if region_type == annotate.RegionType.intergenic else rng.randrange(150, 1800)
+            layout.append(RegionLayout(contig="SYNCTG_%d" % (contig_number + 1), start=position,
+                                       end=position + length - 1, strand=strand, region_type=region_type))
+            position += length + rng.randrange(-20, 300)
+
+    return layout
+
+
+def regions_with_hits(layout: List[RegionLayout], rng: random.Random,
+                      max_hits: int = 20) -> List[annotate.RegionInfo]:
+    """Gives every region up to max_hits hits, sorted by e-value, as annotate.iterate_blast() would read them."""
+
+    regions = []
+
+    for number, region in enumerate(layout):
+        length = region.end - region.start + 1
+        pool = range(number // 4 * 3, number // 4 * 3 + 24)  # Accessions near this region on the contig
+        hits = []
+        for accession in rng.sample(pool, rng.randint(0, max_hits)):
+            s_start = rng.randrange(1, max(2, length // 3))
+            hits.append(annotate.BlastHit(accession="sp|P%05d|SYN" % accession,
+                                          slen=rng.choice([length // 2, length, int(length * 1.3),
+                                                           int(length * 1.8) + 1, 900]),
+                                          s_start=s_start,
+                                          s_end=rng.randrange(s_start, length + 1),
+                                          eval=float("%.2e" % (rng.random() * 1e-5))))
+        hits.sort(key=lambda hit: hit.eval)
+
+        start, end = region.start, region.end
+        if region.region_type == annotate.RegionType.intergenic:  # See annotate.make_region
+            start, end = annotate.get_intergenic_query_range(hits, region.start) if hits else (0, 0)
+
+        regions.append(annotate.RegionInfo(contig=region.contig, query="query_%05d" % number, start=start, end=end,
+                                           query_length=length, strand=region.strand, hits=hits,
+                                           note='From BlastP;colour=51 153 102'
+                                           if region.region_type == annotate.RegionType.ORF else 'From BlastX',
+                                           region_type=region.region_type))
+
+    return regions
+
+
+def table_rows(table: region_table.RegionTable) -> List[tuple]:
+    """Every row of a table with the accessions of its hits, in order, to compare tables that were built apart."""
+
+    return [(table.contig_name(row), table.query[row], int(table.start[row]), int(table.end[row]),
+             str(table.strand[row]), int(table.region_type[row]), table.note[row],
+             [table.hits.accession_names[accession] for accession in table.hits.accession[table.region_hits(row)]])
+            for row in range(len(table))]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from modules import blast_search
+from synthetic import FIXTURE_GENBANK, fixture_genome
+
+"""
+annotate --adaptive_hitcap searches every query with a small hitcap first, and only the queries that reached it again
+with --search_hitcap. Its BLAST output files, and so its pseudogenes, must be those of a search with --search_hitcap
+only, and it must not search more queries again than reached the small hitcap.
+
+Both runs use the mock search engine (see kmer_search.py) against a database of variants of the fixture's proteins:
+shortened and lengthened copies, in random numbers per protein so that the numbers of hits vary around the small
+hitcap, and fusions of neighbouring proteins so that some ORFs share hits and are joined.
+"""
+
+PSEUDOFINDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pseudofinder.py")
+SETTINGS = ["--hitcap", "10", "--search_hitcap", "20"]
+ADAPTIVE_HITCAP = 5
+
+
+def write_variant_database(path: str, rng: random.Random) -> None:
+    proteins = [cds.translation for contig in fixture_genome().contigs for cds in contig.cds if cds.translation]
+    amino_acids = "ACDEFGHIKLMNPQRSTVWY"
+
+    with open(path, "w") as database:
+        for number, protein in enumerate(proteins):
+            variants = []
+            for _ in range(rng.choice([0, 1, 2, 4, 5, 6, 8, 12, 25])):
+                if rng.random() < 0.5:  # A shorter copy
+                    length = int(len(protein) * rng.uniform(0.3, 0.95))
+                    start = rng.randrange(len(protein) - length + 1)
+                    variants.append(protein[start:start + length])
+                else:  # A longer copy
+                    variants.append(protein + "".join(rng.choice(amino_acids) for _ in range(rng.randrange(20, 400))))
+            if number + 1 < len(proteins) and rng.random() < 0.3:  # A fusion with the next protein
+                variants.append(protein + proteins[number + 1])
+
+            for variant_number, variant in enumerate(variants):
+                database.write(">DB%05d_%d variant of protein %d\n%s\n" % (number, variant_number, number, variant))
+
+
+def run_annotate(folder: str, database: str, *extra: str) -> str:
+    os.makedirs(folder)
+    genome = os.path.join(folder, "genome.gbf")  # A copy, so that its sidecar index is written there
+    shutil.copyfile(FIXTURE_GENBANK, genome)
+    environment = dict(os.environ, PSEUDOFINDER_CACHE_DIR="")  # Without hit cache, every query is really searched
+
+    subprocess.run([sys.executable, PSEUDOFINDER, "annotate", "-g", genome, "-db", database,
+                    "-op", os.path.join(folder, "run"), "--search_engine", "mock", "--threads", "2"] +
+                   SETTINGS + list(extra),
+                   check=True, env=environment, stdout=subprocess.DEVNULL)
+
+    return os.path.join(folder, "run_")
+
+
+def read_output(prefix: str, suffix: str) -> str:
+    with open(prefix + suffix) as output:
+        return "".join(line for line in output if not line.startswith("#!annotation-date"))
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp("adaptive_hitcap"))
+    database = os.path.join(folder, "variants.faa")
+    write_variant_database(database, random.Random(25))
+
+    return (run_annotate(os.path.join(folder, "full"), database),
+            run_annotate(os.path.join(folder, "adaptive"), database, "--adaptive_hitcap", str(ADAPTIVE_HITCAP)))
+
+
+@pytest.mark.parametrize("suffix", ["proteome.faa.blastP_output.tsv", "intergenic.fasta.blastX_output.tsv",
+                                    "pseudos.gff", "pseudos.fasta", "functional.gff"])
+def test_same_output_as_full_hitcap(runs, suffix):
+    full, adaptive = runs
+    assert read_output(adaptive, suffix) == read_output(full, suffix)
+
+
+def test_pseudogenes_of_every_kind(runs):
+    full, adaptive = runs
+    notes = read_output(full, "pseudos.gff")
+
+    for reason in ("ORF is", "Predicted fragmentation", "Intergenic region with"):
+        assert reason in notes
+
+
+def test_only_capped_queries_are_searched_again(runs):
+    full, adaptive = runs
+    blocks = (blast_search.read_blocks(full + "proteome.faa.blastP_output.tsv") +
+              blast_search.read_blocks(full + "intergenic.fasta.blastX_output.tsv"))
+    capped = sum(blast_search.count_hits(block) >= ADAPTIVE_HITCAP for block in blocks)
+
+    with open(adaptive + "log.txt") as log:
+        escalated = [int(line.split("\t")[1]) for line in log
+                     if line.startswith("BLAST queries searched again with the full hitcap:")]
+
+    assert escalated == [capped]
+    assert 0 < capped < len(blocks) / 2
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+
+from modules import blast_cache
+
+"""
+Parsed blast files are reused from memory (keyed by path, size and modification time) and from the on-disk store
+(keyed by the SHA-1 hash and size of the contents). A changed blast file must be parsed again, the store must be kept
+below $PSEUDOFINDER_CACHE_SIZE by evicting the least recently used entries, and clear_cache(filename) must only
+remove the entries of that file.
+"""
+
+
+class CountingParser:
+    """Stands in for annotate.build_region_table, and counts how often each file is parsed."""
+
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, filename: str, blast_format: str) -> tuple:
+        self.parsed.append(os.path.basename(filename))
+        with open(filename) as blast_file:
+            return blast_format, blast_file.read()
+
+
+@pytest.fixture
+def cache_folder(tmp_path, monkeypatch):
+    folder = tmp_path / "cache"
+    monkeypatch.setenv("PSEUDOFINDER_CACHE_DIR", str(folder))
+    monkeypatch.setattr(blast_cache, "_memory_cache", blast_cache.OrderedDict())
+    monkeypatch.setattr(blast_cache, "_checksums", {})
+    return folder
+
+
+def write_blast_file(path, text: str, mtime_ns: int) -> str:
+    path.write_text(text)
+    os.utime(str(path), ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_changed_file_is_parsed_again(tmp_path, cache_folder):
+    parser = CountingParser()
+    blast_file = write_blast_file(tmp_path / "run.tsv", "# Query: A\n", mtime_ns=10 ** 18)
+
+    assert blast_cache.cached_parse(blast_file, "BlastP", parser) == ("BlastP", "# Query: A\n")
+    blast_cache.cached_parse(blast_file, "BlastP", parser)
+    assert parser.parsed == ["run.tsv"]
+
+    # New size
+    write_blast_file(tmp_path / "run.tsv", "# Query: A\n# Query: B\n", mtime_ns=10 ** 18)
+    assert blast_cache.cached_parse(blast_file, "BlastP", parser) == ("BlastP", "# Query: A\n# Query: B\n")
+
+    # Same size, new contents and modification time
+    write_blast_file(tmp_path / "run.tsv", "# Query: A\n# Query: C\n", mtime_ns=2 * 10 ** 18)
+    assert blast_cache.cached_parse(blast_file, "BlastP", parser) == ("BlastP", "# Query: A\n# Query: C\n")
+    assert parser.parsed == ["run.tsv"] * 3
+
+    # Only a new modification time: not taken from memory, but the contents are still in the on-disk store
+    first = blast_cache.cached_parse(blast_file, "BlastP", parser)
+    os.utime(blast_file, ns=(3 * 10 ** 18, 3 * 10 ** 18))
+    second = blast_cache.cached_parse(blast_file, "BlastP", parser)
+    assert second == first and second is not first
+    assert parser.parsed == ["run.tsv"] * 3
+
+
+def test_new_modification_time_without_store(tmp_path, cache_folder, monkeypatch):
+    monkeypatch.setenv("PSEUDOFINDER_CACHE_DIR", "")
+    parser = CountingParser()
+    blast_file = write_blast_file(tmp_path / "run.tsv", "# Query: A\n", mtime_ns=10 ** 18)
+
+    blast_cache.cached_parse(blast_file, "BlastP", parser)
+    os.utime(blast_file, ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    blast_cache.cached_parse(blast_file, "BlastP", parser)
+
+    assert parser.parsed == ["run.tsv"] * 2
+
+
+def test_evict_least_recently_used_first(cache_folder, monkeypatch):
+    cache_folder.mkdir()
+    for number in range(5):  # Entries of 1 KiB, entry_0 used longest ago
+        entry = cache_folder / ("entry_%d%s" % (number, blast_cache.CACHE_SUFFIX))
+        entry.write_bytes(b"x" * 1024)
+        os.utime(str(entry), (1000 + number, 1000 + number))
+    (cache_folder / "unrelated.txt").write_bytes(b"x" * 4096)
+
+    monkeypatch.setenv("PSEUDOFINDER_CACHE_SIZE", str(3 * 1024 / (1024 * 1024)))  # 3 KiB, in megabytes
+    blast_cache.evict(blast_cache.cache_size_limit())
+
+    assert sorted(os.listdir(str(cache_folder))) == ["entry_2.pfcache", "entry_3.pfcache", "entry_4.pfcache",
+                                                     "unrelated.txt"]
+
+
+def test_writing_an_entry_evicts(tmp_path, cache_folder, monkeypatch):
+    parser = CountingParser()
+    monkeypatch.setenv("PSEUDOFINDER_CACHE_SIZE", "0")
+
+    blast_cache.cached_parse(write_blast_file(tmp_path / "run.tsv", "# Query: A\n", mtime_ns=10 ** 18),
+                             "BlastP", parser)
+
+    assert blast_cache.list_entries() == []
+
+
+def test_clear_cache_of_one_file(tmp_path, cache_folder):
+    parser = CountingParser()
+    first = write_blast_file(tmp_path / "first.tsv", "# Query: A\n", mtime_ns=10 ** 18)
+    second = write_blast_file(tmp_path / "second.tsv", "# Query: B\n", mtime_ns=10 ** 18)
+    for blast_file in (first, second):
+        for blast_format in ("BlastP", "BlastX"):
+            blast_cache.cached_parse(blast_file, blast_format, parser)
+    assert len(blast_cache.list_entries()) == 4
+
+    blast_cache.clear_cache(first)
+
+    remaining = [os.path.basename(path) for path, size, last_used in blast_cache.list_entries()]
+    checksum = blast_cache.file_checksum(second, blast_cache.file_stamp(second))
+    assert len(remaining) == 2 and all(name.startswith(checksum) for name in remaining)
+
+    parser.parsed.clear()
+    for blast_file in (first, second):
+        blast_cache.cached_parse(blast_file, "BlastP", parser)
+    assert parser.parsed == ["first.tsv"]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import shutil
+
+import pytest
+
+from modules import annotate
+from modules.annotate import BlastHit, RegionInfo, RegionType
+
+"""
+iterate_blast() streams blast output (outfmt 7), plain or gzip-compressed, and must give the regions that the
+readlines and regex parser it replaced gave. The expected regions below are what that parser read from the sample
+files, with the query length that RegionInfo has since gained.
+"""
+
+SAMPLES = os.path.dirname(os.path.abspath(__file__))
+
+EXPECTED = {
+    'BlastP': ("sample_proteome.faa.blastP_output.tsv", [
+        RegionInfo(contig='SMPL_1', query='SMPL_00001', start=1, end=1407, query_length=1407, strand='+',
+                   hits=[BlastHit(accession='sp|P0A7G6|RECA_ECOLI', slen=1059, s_start=5, s_end=344, eval=1.09e-150),
+                         BlastHit(accession='sp|P26347|RECA_NEIGO', slen=1044, s_start=5, s_end=339, eval=6.88e-138),
+                         BlastHit(accession='sp|Q9AJG2|RECA_PSEAI', slen=1038, s_start=30, s_end=338, eval=2.3e-90)],
+                   note='From BlastP;colour=51 153 102', region_type=RegionType.ORF),
+        RegionInfo(contig='SMPL_1', query='SMPL_00002', start=1409, end=2017, query_length=609, strand='+',
+                   hits=[], note='From BlastP;colour=51 153 102', region_type=RegionType.ORF),
+        RegionInfo(contig='SMPL_1', query='SMPL_00003', start=3422, end=4639, query_length=1218, strand='-',
+                   hits=[BlastHit(accession='sp|P86052|CYC4_THIRO', slen=576, s_start=61, s_end=225, eval=1.33e-40),
+                         BlastHit(accession='sp|Q8ZQ03|YBAB_SALTY', slen=327, s_start=200, s_end=318, eval=0.004)],
+                   note='From BlastP;colour=51 153 102', region_type=RegionType.ORF),
+        RegionInfo(contig='SMPL_2', query='SMPL_00004', start=11, end=400, query_length=390, strand='+',
+                   hits=[BlastHit(accession='sp|P0A6F5|CH60_ECOLI', slen=1644, s_start=1, s_end=120, eval=5e-55)],
+                   note='From BlastP;colour=51 153 102', region_type=RegionType.ORF)]),
+    'BlastX': ("sample_intergenic.fasta.blastX_output.tsv", [
+        RegionInfo(contig='SMPL_1', query='SMPL_1_ign_1', start=2320, end=3069, query_length=1403, strand='+',
+                   hits=[BlastHit(accession='sp|P0A7G6|RECA_ECOLI', slen=1059, s_start=301, s_end=900, eval=2.2e-60),
+                         BlastHit(accession='sp|P26347|RECA_NEIGO', slen=1044, s_start=601, s_end=1050, eval=7.5e-20)],
+                   note='From BlastX', region_type=RegionType.intergenic),
+        RegionInfo(contig='SMPL_1', query='SMPL_1_ign_2', start=0, end=0, query_length=39, strand='+',
+                   hits=[], note='From BlastX', region_type=RegionType.intergenic),
+        RegionInfo(contig='SMPL_2', query='SMPL_2_ign_1', start=403, end=702, query_length=500, strand='+',
+                   hits=[BlastHit(accession='sp|P0A6F5|CH60_ECOLI', slen=1644, s_start=1, s_end=300, eval=0.001)],
+                   note='From BlastX', region_type=RegionType.intergenic)])
+}
+
+
+def sample_file(tmp_path, name: str, compressed: bool) -> str:
+    if not compressed:
+        return os.path.join(SAMPLES, name)
+
+    gzipped = str(tmp_path / (name + ".gz"))
+    with open(os.path.join(SAMPLES, name), 'rb') as plain, gzip.open(gzipped, 'wb') as compressed_file:
+        shutil.copyfileobj(plain, compressed_file)
+
+    return gzipped
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+@pytest.mark.parametrize("blast_format", ["BlastP", "BlastX"])
+def test_iterate_blast(tmp_path, blast_format, compressed):
+    name, expected = EXPECTED[blast_format]
+    filename = sample_file(tmp_path, name, compressed)
+
+    assert list(annotate.iterate_blast(filename=filename, blast_format=blast_format)) == expected
+    assert annotate.collect_query_ids(filename) == [region.query for region in expected]
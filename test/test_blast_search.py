@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+import time
+
+from modules import blast_search
+
+"""
+run_shards() hands every finished shard to on_shard in a thread of its own, so that the event loop goes on starting
+and watching the other shards while on_shard runs (ie. while annotate --overlap checks a contig).
+"""
+
+# Stands in for BLAST: copies the query file to the output file after a short while
+COPY_COMMAND = "import shutil, sys, time; time.sleep(0.2); shutil.copyfile(sys.argv[1], sys.argv[2])"
+
+
+def copy_search(tmp_path, name: str) -> blast_search.Search:
+    query = tmp_path / ("%s.fasta" % name)
+    query.write_text("".join(">%s_%d\n%s\n" % (name, number, "MKVLAT" * 20) for number in range(4)))
+
+    return blast_search.Search(name=name, query=str(query), out=str(tmp_path / ("%s.tsv" % name)),
+                               command=lambda query, out, threads: [sys.executable, "-c", COPY_COMMAND, query, out],
+                               finish=None, settings="")
+
+
+def test_on_shard_runs_beside_the_event_loop(tmp_path):
+    searches = [copy_search(tmp_path, "BlastP"), copy_search(tmp_path, "BlastX")]
+    shards = []
+    threads = set()
+
+    def on_shard(shard: blast_search.Shard) -> None:
+        threads.add(threading.get_ident())
+        if not shards:
+            # The first shard waits for all the others, which only finish if the event loop keeps running them
+            others = [os.path.join(blast_search.shard_folder(search), "%d.tsv" % number)
+                      for search in searches for number in range(2)]
+            deadline = time.monotonic() + 10
+            while not all(os.path.exists(out) and os.path.getsize(out) for out in others if out != shard.out):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+        shards.append(shard)
+
+    # Two BLAST processes for two searches of two shards each, so half of the shards start after the first ones
+    blast_search.run_shards(searches, threads=2, threads_per_search=1, retries=0, on_shard=on_shard)
+
+    assert len(shards) == 4
+    assert threads and threading.get_ident() not in threads
+    for search in searches:
+        assert open(search.out).read() == open(search.query).read()
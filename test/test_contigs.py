@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import random
+import re
+
+import numpy
+import pytest
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from modules import annotate, genome_index, region_table
+from synthetic import fixture_genome, genome_layout, regions_with_hits, split_genome, synthetic_layout, table_rows
+
+"""
+split_regions_into_contigs() and write_pseudos_to_fasta() group the rows of a table by contig in a single pass.
+They must give the same contigs, in the same order, as the versions that scanned the whole table once per contig.
+"""
+
+
+def reference_split_regions_into_contigs(lori: region_table.RegionTable) -> list:
+    """split_regions_into_contigs() as it was before the single pass: a scan of the table for every contig, and contig
+    numbers taken from the digits in their names."""
+
+    contig_list = []
+
+    for contig_id in numpy.unique(lori.contig).tolist():
+        contig_name = lori.contig_names[contig_id]
+        contig_number = int("".join(re.findall(r'\d', str(contig_name))))
+        regions_on_contig = lori.take(numpy.flatnonzero(lori.contig == contig_id))
+        contig_list.append(annotate.Contig(regions=regions_on_contig, name=contig_name, number=contig_number))
+
+    return contig_list
+
+
+def reference_write_pseudos_to_fasta(genome: genome_index.GenomeIndex, pseudofinder_regions: region_table.RegionTable,
+                                     outfile: str) -> None:
+    """write_pseudos_to_fasta() as it was before the single pass."""
+
+    fasta_list = []
+    contig_names = pseudofinder_regions.contig_names
+
+    for contig in genome.contigs:
+        if contig.name not in contig_names:
+            continue
+
+        pseudofinder_regions_on_contig = numpy.flatnonzero(pseudofinder_regions.contig == contig_names.index(contig.name))
+
+        coord_list = zip(pseudofinder_regions.start[pseudofinder_regions_on_contig].tolist(),
+                         pseudofinder_regions.end[pseudofinder_regions_on_contig].tolist())
+        for counter, coordinate in enumerate(coord_list):
+            fasta_list.append(SeqRecord(seq=Seq(str(contig.seq[coordinate[0]:coordinate[1]])), id="%s_%04d" % (contig.name, counter + 1),
+                                        description="%s-%s +" % (coordinate[0], coordinate[1])))
+
+    SeqIO.write(fasta_list, open(outfile, "w"), "fasta")
+
+
+def contig_rows(contigs: list) -> list:
+    return [(contig.name, table_rows(contig.regions)) for contig in annotate.sort_contigs(contigs)]
+
+
+def shuffled_table(regions: list, rng: random.Random) -> region_table.RegionTable:
+    """Regions of all contigs mixed together, so that the contigs do not appear in the table in genome order."""
+
+    regions = list(regions)
+    rng.shuffle(regions)
+
+    return annotate.regions_to_table(regions)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_split_fixture_contigs(seed):
+    rng = random.Random(seed)
+    genome = split_genome(fixture_genome(), parts=12)
+    lori = shuffled_table(regions_with_hits(genome_layout(genome), rng), rng)
+
+    assert [contig.name for contig in annotate.sort_contigs(annotate.split_regions_into_contigs(lori, genome))] == \
+        [contig.name for contig in genome.contigs]
+    assert contig_rows(annotate.split_regions_into_contigs(lori, genome)) == \
+        contig_rows(reference_split_regions_into_contigs(lori))
+
+
+def test_split_many_contigs():
+    rng = random.Random(0)
+    lori = annotate.regions_to_table(regions_with_hits(synthetic_layout(rng, contigs=300, regions_per_contig=15), rng))
+
+    # Without a genome, contigs keep the order they first appear in, which is the order of their numbers here
+    assert contig_rows(annotate.split_regions_into_contigs(lori)) == \
+        contig_rows(reference_split_regions_into_contigs(lori))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_write_pseudos_to_fasta(tmp_path, seed):
+    rng = random.Random(seed)
+    genome = split_genome(fixture_genome(), parts=12)
+    regions = [region for region in regions_with_hits(genome_layout(genome), rng)
+               if region.contig != "TREMCTG_5"]  # A contig without pseudogenes is skipped
+    lori = shuffled_table(regions, rng)
+
+    annotate.write_pseudos_to_fasta(genome, lori, str(tmp_path / "new.fasta"))
+    reference_write_pseudos_to_fasta(genome, lori, str(tmp_path / "reference.fasta"))
+
+    assert (tmp_path / "new.fasta").read_text() == (tmp_path / "reference.fasta").read_text()
+    assert (tmp_path / "new.fasta").read_text().count(">") == len(lori)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+from modules import hit_cache
+
+"""
+HitCache keeps the stored blocks below its size limit by evicting the blocks that were used longest ago, where both
+storing and looking up a block count as using it.
+"""
+
+
+class Clock:
+    """Stands in for time.time(), one second later on every call."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+def stored_keys(cache: hit_cache.HitCache) -> list:
+    """Keys in the cache, without marking them as used like lookup() does."""
+    return sorted(key for key, in cache.connection.execute("SELECT key FROM results"))
+
+
+def test_evict_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(hit_cache.time, "time", Clock())
+    cache = hit_cache.HitCache(str(tmp_path / hit_cache.HIT_CACHE_NAME), size_limit=300)
+
+    for key in ("a", "b", "c"):
+        cache.store({key: key * 100})
+    assert cache.lookup(["a"]) == {"a": "a" * 100}  # a is now used more recently than b and c
+
+    cache.store({"d": "d" * 100})  # 400 bytes, one block too many
+    assert stored_keys(cache) == ["a", "c", "d"]
+
+    cache.evict(150)
+    assert stored_keys(cache) == ["d"]
+    cache.close()
+
+
+def test_blocks_outlive_the_connection(tmp_path):
+    path = str(tmp_path / hit_cache.HIT_CACHE_NAME)
+    cache = hit_cache.HitCache(path, size_limit=1000)
+    cache.store({"a": "block"})
+    cache.close()
+
+    assert hit_cache.HitCache(path, size_limit=1000).lookup(["a", "b"]) == {"a": "block"}
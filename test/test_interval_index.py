@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import random
+
+import numpy
+import pytest
+
+from modules import annotate, region_table
+from modules.interval_index import IntervalIndex
+from synthetic import annotate_args, fixture_genome, genome_layout, regions_with_hits, synthetic_layout, table_rows
+
+"""
+IntervalIndex answers which regions lie within a pseudogene, and which pseudogene starts where a region starts.
+The answers must be those of a comparison of every region with every pseudogene.
+"""
+
+
+def reference_replace_pseudos_in_list(pseudos: region_table.RegionTable,
+                                      regions: region_table.RegionTable) -> region_table.RegionTable:
+    """replace_pseudos_in_list() as it was before the interval index: a dictionary of the first pseudogene at every
+    start position."""
+
+    pseudo_at_start = {}
+    for row, start in enumerate(pseudos.start.tolist()):
+        pseudo_at_start.setdefault(start, len(regions) + row)
+
+    final_rows = [pseudo_at_start.get(start, row) for row, start in enumerate(regions.start.tolist())]
+
+    return region_table.concatenate([regions, pseudos]).take(final_rows)
+
+
+def reference_get_functional_genes(contig: annotate.Contig, pseudos: region_table.RegionTable) -> annotate.Contig:
+    """get_functional_genes() as it was before the interval index: every region compared with every pseudogene."""
+
+    region_list = contig.regions.take(numpy.argsort(contig.regions.start, kind='stable'))
+
+    nested = ((region_list.start[:, numpy.newaxis] >= pseudos.start[numpy.newaxis, :]) &
+              (region_list.end[:, numpy.newaxis] <= pseudos.end[numpy.newaxis, :])).any(axis=1)
+
+    functional_list = region_list.take(numpy.flatnonzero(~nested))
+
+    return annotate.Contig(regions=functional_list, name=contig.name, number=contig.number)
+
+
+def random_intervals(rng: random.Random, number: int, span: int) -> tuple:
+    starts = numpy.array([rng.randrange(span) for _ in range(number)], dtype=numpy.int64)
+    ends = starts + numpy.array([rng.randrange(span // 10 + 1) for _ in range(number)], dtype=numpy.int64)
+
+    return starts, ends
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("intervals", [0, 1, 5, 200])
+def test_against_brute_force(seed, intervals):
+    rng = random.Random(seed)
+    interval_starts, interval_ends = random_intervals(rng, intervals, span=1000)
+    starts, ends = random_intervals(rng, 300, span=1000)
+    starts[:100] = rng.choices(interval_starts.tolist() or [0], k=100)  # Many regions start where an interval starts
+    index = IntervalIndex(interval_starts, interval_ends)
+
+    contains = [any(start >= interval_start and end <= interval_end
+                    for interval_start, interval_end in zip(interval_starts.tolist(), interval_ends.tolist()))
+                for start, end in zip(starts.tolist(), ends.tolist())]
+    first_at = [interval_starts.tolist().index(start) if start in interval_starts.tolist() else -1
+                for start in starts.tolist()]
+
+    assert index.contains(starts, ends).tolist() == contains
+    assert index.first_at(starts).tolist() == first_at
+
+
+def pseudogenes_by_contig(args, regions: list) -> list:
+    """Every contig with its individual pseudogenes, and with the pseudogenes that annotate_pseudos() finds on it."""
+
+    contigs = []
+
+    for contig in annotate.split_regions_into_contigs(annotate.regions_to_table(regions)):
+        individual_pseudos, intergenic_pseudos = annotate.check_individual_ORFs(args=args, lori=contig.regions)
+        pseudos = annotate.annotate_pseudos(args, contig, annotate.RunStats())
+        contigs.append((contig, region_table.concatenate([individual_pseudos, intergenic_pseudos]), pseudos.regions))
+
+    return contigs
+
+
+@pytest.mark.parametrize("regions", ["fixture", "synthetic"])
+def test_pseudogene_lookups(regions):
+    rng = random.Random(0)
+    layout = genome_layout(fixture_genome()) if regions == "fixture" else \
+        synthetic_layout(rng, contigs=3, regions_per_contig=800)
+    replaced = functional = 0
+
+    for contig, individual_pseudos, pseudos in pseudogenes_by_contig(annotate_args(), regions_with_hits(layout, rng)):
+        new = annotate.replace_pseudos_in_list(pseudos=individual_pseudos, regions=contig.regions)
+        assert table_rows(new) == \
+            table_rows(reference_replace_pseudos_in_list(pseudos=individual_pseudos, regions=contig.regions))
+        replaced += sum(note != original for note, original in zip(new.note, contig.regions.note))
+
+        new = annotate.get_functional_genes(contig, pseudos)
+        assert table_rows(new.regions) == table_rows(reference_get_functional_genes(contig, pseudos).regions)
+        functional += len(new.regions)
+
+    # Some regions were replaced by pseudogenes, and some were left out as nested within one
+    assert replaced > 0
+    assert 0 < functional < len(layout)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import random
+
+import numpy
+import pytest
+
+from modules import annotate, region_table
+from modules.annotate import RegionType
+from synthetic import annotate_args, fixture_genome, genome_layout, regions_with_hits, synthetic_layout, table_rows
+
+"""
+check_adjacent_regions() walks the regions in a linked list (RegionChain) and keeps the pseudogenes found in
+dictionaries. It must find exactly the pseudogenes, in the same order, as the sorted lists it replaced.
+"""
+
+
+def reference_check_adjacent_regions(args, lori: region_table.RegionTable, stats: annotate.RunStats) -> tuple:
+    """check_adjacent_regions() as it was before the linked list: the list of regions is sorted again after every
+    merge, and the lists of pseudogenes are filtered with list comprehensions. Unlike that version, it compares
+    start and end positions with != where it had 'is not', which only worked as long as the positions were small
+    enough to be the same int objects."""
+
+    shared_hits = region_table.SharedHits(lori)
+    sorted_lori = sorted(range(len(lori)), key=lambda r: lori.start[r])
+    merged_list = []
+    individual_list = []
+    i = 0
+
+    while i < len(sorted_lori)-1 and len(sorted_lori) > 1:
+        new_pseudo_made = False
+        try:
+            if annotate.compare_regions(args, lori, shared_hits, r1=sorted_lori[i], r2=sorted_lori[i + 1]) is True:
+                new_pseudo_made = True
+                pseudo = annotate.join_regions(lori, sorted_lori[i], sorted_lori[i + 1])
+
+                for region in [sorted_lori[i], sorted_lori[i + 1]]:
+                    if lori.region_type[region] == RegionType.ORF.value or lori.region_type[region] == RegionType.shortpseudo.value:
+                        stats.fragmented_orfs += 1
+
+                del sorted_lori[i + 1]
+                del sorted_lori[i]
+
+            elif annotate.compare_regions(args, lori, shared_hits, r1=sorted_lori[i], r2=sorted_lori[i + 2]) is True:
+                new_pseudo_made = True
+                pseudo = annotate.join_regions(lori, sorted_lori[i], sorted_lori[i + 2])
+
+                for region in [sorted_lori[i], sorted_lori[i + 1], sorted_lori[i + 2]]:
+                    if lori.region_type[region] == RegionType.ORF.value or lori.region_type[region] == RegionType.shortpseudo.value:
+                        stats.fragmented_orfs += 1
+
+                del sorted_lori[i + 2]
+                del sorted_lori[i + 1]
+                del sorted_lori[i]
+
+            elif lori.region_type[sorted_lori[i]] == RegionType.shortpseudo.value or lori.region_type[sorted_lori[i]] == RegionType.intergenicpseudo.value:
+                pseudo = sorted_lori[i]
+                individual_list[:] = [item for item in individual_list if lori.start[item] != lori.start[pseudo]]
+                individual_list.append(pseudo)
+
+        except IndexError:
+            pass
+
+        if new_pseudo_made is True:
+            merged_list[:] = [item for item in merged_list if (lori.start[item] != lori.start[pseudo]) and (lori.end[item] != lori.end[pseudo])]
+            merged_list.append(pseudo)
+            sorted_lori.append(pseudo)
+            sorted_lori = sorted(sorted_lori, key=lambda r: lori.start[r])
+            i = i - 1
+
+        else:
+            i = i + 1
+
+        individual_list[:] = [item for item in individual_list if lori.start[item] not in [lori.start[pseudo] for pseudo in merged_list]]
+
+    individual_pseudos = lori.take(individual_list)
+    merged_pseudos = lori.take(merged_list)
+
+    stats.pseudogenes_total += len(individual_list) + len(merged_list)
+    stats.pseudogenes_short += int(numpy.count_nonzero(individual_pseudos.region_type == RegionType.shortpseudo.value))
+    stats.pseudogenes_intergenic += int(numpy.count_nonzero(individual_pseudos.region_type == RegionType.intergenicpseudo.value))
+    stats.pseudogenes_fragmented += len(merged_list)
+
+    return individual_pseudos, merged_pseudos
+
+
+def regions_to_merge(args, regions: list) -> list:
+    """The regions of every contig as check_adjacent_regions() gets them from annotate_pseudos(): with the
+    individual pseudogenes in place of the regions they were found in."""
+
+    contigs = []
+
+    for contig in annotate.split_regions_into_contigs(annotate.regions_to_table(regions)):
+        individual_pseudos, intergenic_pseudos = annotate.check_individual_ORFs(args=args, lori=contig.regions)
+        contigs.append(annotate.replace_pseudos_in_list(
+            pseudos=region_table.concatenate([individual_pseudos, intergenic_pseudos]), regions=contig.regions))
+
+    return contigs
+
+
+def assert_same_pseudogenes(args, regions: list) -> None:
+    # Both versions append the merged regions to the table they are given, so each gets its own copy
+    new_stats, reference_stats = annotate.RunStats(), annotate.RunStats()
+    merges = 0
+
+    for new_input, reference_input in zip(regions_to_merge(args, regions), regions_to_merge(args, regions)):
+        new = annotate.check_adjacent_regions(args, new_input, new_stats)
+        reference = reference_check_adjacent_regions(args, reference_input, reference_stats)
+        merges += len(reference[1])
+
+        assert table_rows(new[0]) == table_rows(reference[0])
+        assert table_rows(new[1]) == table_rows(reference[1])
+
+    assert vars(new_stats) == vars(reference_stats)
+    assert merges > 0  # Otherwise the regions did not test merging at all
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_fixture_layout(seed):
+    regions = regions_with_hits(genome_layout(fixture_genome()), random.Random(seed))
+    assert_same_pseudogenes(annotate_args(), regions)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("settings", [{}, {'shared_hits': 0.3, 'distance': 200}, {'shared_hits': 0.7, 'hitcap': 8}])
+def test_large_synthetic_contigs(seed, settings):
+    rng = random.Random(seed)
+    regions = regions_with_hits(synthetic_layout(rng, contigs=3, regions_per_contig=800), rng)
+    assert_same_pseudogenes(annotate_args(**settings), regions)
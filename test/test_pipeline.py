@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+from modules import pipeline
+
+"""
+reannotate and visualize take the settings of a run from its manifest only as long as the log file next to it is the
+one those settings were recorded with. Once another run has written over the log file, the log file itself is read.
+"""
+
+
+def test_settings_belong_to_their_log_file(tmp_path):
+    prefix = str(tmp_path / "run")
+    logfile, manifest_file = prefix + pipeline.LOG_SUFFIX, pipeline.manifest_path(prefix)
+
+    with open(logfile, "w") as log:
+        log.write("Distance:\t1000\n")
+    pipeline.record_settings(manifest_file, {'distance': 1000}, logfile=logfile)
+    assert pipeline.read_settings(logfile) == {'distance': 1000}
+
+    with open(logfile, "w") as log:  # Written over, ie. by reannotate -d 200
+        log.write("Distance:\t200\n")
+    assert pipeline.read_settings(logfile) is None
+    assert pipeline.read_settings(manifest_file) == {'distance': 1000}
+
+    pipeline.record_settings(manifest_file, {'distance': 200}, logfile=logfile)
+    assert pipeline.read_settings(logfile) == {'distance': 200}
+
+
+def test_manifest_without_log_hash(tmp_path):
+    prefix = str(tmp_path / "run")
+    (tmp_path / "run_log.txt").write_text("Distance:\t200\n")
+    pipeline.write_manifest(pipeline.manifest_path(prefix), {'settings': {'distance': 1000}})
+
+    assert pipeline.read_settings(prefix + pipeline.LOG_SUFFIX) is None
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import random
+
+import pytest
+
+from modules import annotate, sweep
+from synthetic import annotate_args, regions_with_hits, synthetic_layout
+
+"""
+explore() checks at most its budget of points, and refuses a budget that does not even cover its first sample.
+"""
+
+PARAMETERS = [sweep.ExploreParameter('length_pseudo', 0.0, 1.0, False),
+              sweep.ExploreParameter('shared_hits', 0.0, 1.0, False),
+              sweep.ExploreParameter('distance', 0, 2000, True)]
+
+
+def synthetic_sweep() -> sweep.SweepData:
+    rng = random.Random(0)
+    regions = regions_with_hits(synthetic_layout(rng, contigs=2, regions_per_contig=100), rng)
+    contigs = annotate.sort_contigs(annotate.split_regions_into_contigs(annotate.regions_to_table(regions)))
+
+    return sweep.SweepData(contigs=contigs, stats=annotate.RunStats())
+
+
+@pytest.mark.parametrize("budget", [27, 50, 120])
+def test_explore_stays_within_budget(budget):
+    checked = []
+    exploration = sweep.explore(annotate_args(), synthetic_sweep(), PARAMETERS, budget=budget, max_depth=3,
+                                progress=lambda done, total: checked.append(done))
+
+    assert checked[0] == sweep.first_sample_size(len(PARAMETERS), max_depth=3) == 27
+    assert len(exploration.points) == checked[-1] <= budget
+    assert len(exploration.sensitivity) == len(PARAMETERS)
+
+
+def test_explore_refuses_a_budget_below_the_first_sample():
+    with pytest.raises(ValueError):
+        sweep.explore(annotate_args(), synthetic_sweep(), PARAMETERS, budget=26, max_depth=3)